@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+import plotly
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,20 +44,33 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # 時間の内訳を Server-Timing ヘッダーで返す (main/profiling.py)
+    "main.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # ログインユーザーをプロセス内に短時間持ち、リクエストごとの読み込みを省く
+    "main.auth.CachedAuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+if DEBUG:
+    # 開発時はリクエストごとのクエリ数をチェックする (main/querybudget.py)
+    MIDDLEWARE.insert(0, "main.middleware.QueryBudgetMiddleware")
+
 ROOT_URLCONF = "be_en_todo.urls"
 
+# ASGI で動かすときは読み取り中心の画面 (ホーム・一覧・カレンダー・マイページ) を
+# 非同期ビューで処理する (DJANGO_ASYNC_READ_VIEWS=1)
+ASYNC_READ_VIEWS = os.environ.get("DJANGO_ASYNC_READ_VIEWS") == "1"
+
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates と同じで、描画の時間を Server-Timing に載せる
+        "BACKEND": "main.profiling.TimedTemplates",
+        "NAME": "django",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -69,6 +85,15 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "be_en_todo.wsgi.application"
 
+# プロファイル (main/profiling.py)。結果は PROFILE_DIR に SQL と一緒に書き出す
+# 全リクエストのうち cProfile を取る割合 (0〜1)
+PROFILE_SAMPLE_RATE = float(os.environ.get("DJANGO_PROFILE_SAMPLE_RATE", "0"))
+# これより時間のかかったリクエストはスタックのサンプリング結果を残す (ミリ秒、0 で無効)
+PROFILE_SLOW_MS = float(os.environ.get("DJANGO_PROFILE_SLOW_MS", "0"))
+# スタックのサンプリング間隔 (秒)
+PROFILE_STACK_INTERVAL = 0.005
+PROFILE_DIR = Path(os.environ.get("DJANGO_PROFILE_DIR", BASE_DIR / "profiles"))
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -80,6 +105,79 @@ DATABASES = {
     }
 }
 
+# 同時アクセスの多い本番向け SQLite プロファイル (DJANGO_SQLITE_PROFILE=production)
+# 接続ごとに PRAGMA を流し、書き込みトランザクションは最初から RESERVED ロックを取る
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # 負の値は KiB 単位
+    "temp_store": "MEMORY",
+}
+
+SQLITE_PRODUCTION_SETTINGS = {
+    "CONN_MAX_AGE": 600,
+    "CONN_HEALTH_CHECKS": True,
+    "OPTIONS": {
+        "init_command": ";".join(
+            f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()
+        ),
+        "transaction_mode": "IMMEDIATE",
+    },
+}
+
+if os.environ.get("DJANGO_SQLITE_PROFILE") == "production":
+    DATABASES["default"].update(SQLITE_PRODUCTION_SETTINGS)
+
+# 読み取り専用レプリカ (DJANGO_DB_REPLICAS にカンマ区切りで SQLite のパスを指定)
+# 一覧・カレンダー・マイページの GET をレプリカから読む (main/replicas.py)
+# 例: DJANGO_DB_REPLICAS=/var/lib/todo/replica1.sqlite3,/var/lib/todo/replica2.sqlite3
+REPLICA_DATABASES = []
+for number, path in enumerate(
+    filter(None, os.environ.get("DJANGO_DB_REPLICAS", "").split(",")), start=1
+):
+    alias = f"replica{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": path.strip(),
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(alias)
+
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ["main.replicas.ReplicaRouter"]
+
+# 書き込んだユーザーはこの秒数だけプライマリから読む。レプリカから読んだ結果は
+# ユーザーごとのキャッシュに残るので、レプリカの遅れより長くしておくこと
+REPLICA_STICKY_SECONDS = 5
+
+
+# Cache
+# 既定はプロセス内メモリ。複数プロセスで動かすときは共有キャッシュを指定する
+# 例: DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#     DJANGO_CACHE_LOCATION=redis://127.0.0.1:6379
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", ""),
+    }
+}
+
+
+# Sessions
+# 既定はキャッシュに載せ、キャッシュになければ DB から読む。DB を使わないなら
+# DJANGO_SESSION_ENGINE=django.contrib.sessions.backends.signed_cookies
+# (その場合ログアウトしても同じ Cookie の写しは期限まで無効にできない)
+SESSION_ENGINE = os.environ.get(
+    "DJANGO_SESSION_ENGINE", "django.contrib.sessions.backends.cached_db"
+)
+
+# ログインユーザーをプロセス内に持つ秒数 (main/auth.py)。0 なら毎回 DB から読む
+AUTH_USER_CACHE_SECONDS = 30
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -117,6 +215,11 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# plotly.js はパッケージ同梱のものを静的ファイルとして配信する
+STATICFILES_DIRS = [
+    ("plotly", Path(plotly.__file__).resolve().parent / "package_data"),
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
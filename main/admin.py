@@ -1,15 +1,161 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Max
+from django.utils.functional import cached_property
 
+from main import bulk, purge
 from main.models import Category, Todo, User
 
+
+def estimated_row_count(model, using="default"):
+    """テーブルの行数の推定値を返す (COUNT(*) で全件を数えない)"""
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [table],
+                )
+                row = cursor.fetchone()
+                if row and row[0] >= 0:
+                    return row[0]
+            elif connection.vendor == "sqlite":
+                # ANALYZE 済みなら sqlite_stat1 の先頭の数値がおおよその行数。
+                # 部分インデックスの行は条件に合う行しか数えないので使わない
+                cursor.execute(
+                    "SELECT stat FROM sqlite_stat1 WHERE tbl = %s AND (idx IS NULL "
+                    "OR idx IN (SELECT name FROM pragma_index_list(%s) "
+                    "WHERE NOT partial)) LIMIT 1",
+                    [table, table],
+                )
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    except DatabaseError:
+        pass
+    # 統計がなければ主キーの最大値で代用する (インデックスの端を読むだけ)
+    manager = model._default_manager.using(using)
+    return manager.aggregate(max_pk=Max("pk"))["max_pk"] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """件数を数え切らない Paginator
+
+    既定のマネージャー以上の絞り込みがなければテーブルの統計から推定し (削除待ちの
+    行も数に入る)、絞り込みがあれば count_limit 件で数えるのをやめる。推定値が
+    小さいときは正確に数える。
+    """
+
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        base = queryset.model._default_manager.all()
+        if queryset.query.where == base.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate > self.count_limit:
+                return estimate
+        return queryset.values("pk").order_by()[: self.count_limit].count()
+
+
+class FastChangeListMixin:
+    """大きなテーブルでも一覧画面で全件の COUNT(*) を走らせない"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
-    pass
+class UserAdmin(FastChangeListMixin, BaseUserAdmin):
+    list_display = ("username", "email", "is_staff", "is_active", "date_joined")
+    list_select_related = ("todo_rollup",)
+
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
-    pass
+class CategoryAdmin(FastChangeListMixin, admin.ModelAdmin):
+    list_display = (
+        "name",
+        "user",
+        "rollup__unfinished_count",
+        "rollup__finished_count",
+        "rollup__total_hours",
+    )
+    list_select_related = ("user", "rollup")
+    ordering = ("name",)
+    autocomplete_fields = ("user",)
+    search_fields = ("name", "=user__username")
+    search_help_text = "カテゴリ名の一部、またはユーザー名 (完全一致) で検索"
+    # 保存のたびにシグナルで払い出すので、手では書き換えさせない
+    readonly_fields = ("sync_seq",)
+    actions = ("delete_categories",)
+
+    def get_actions(self, request):
+        # 既定の一括削除は Todo まで読み込んで消すので、削除待ちにするだけの
+        # delete_categories に置き換える (行は purge_deleted コマンドが消す)
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    def delete_model(self, request, obj):
+        purge.delete_categories(Category.objects.filter(pk=obj.pk))
+
+    @admin.action(description="選択したカテゴリを削除する", permissions=["delete"])
+    def delete_categories(self, request, queryset):
+        count = purge.delete_categories(queryset)
+        self.message_user(request, "%d 件を削除しました" % count, messages.SUCCESS)
+
 
 @admin.register(Todo)
-class TodoAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+class TodoAdmin(FastChangeListMixin, admin.ModelAdmin):
+    list_display = (
+        "title",
+        "category",
+        "category__user",
+        "deadline_time",
+        "hour_spent",
+        "is_finished",
+    )
+    # __str__ と一覧の列が参照するカテゴリ・ユーザーを 1 本のクエリで取る
+    list_select_related = ("category__user",)
+    list_filter = ("is_finished",)
+    date_hierarchy = "deadline_time"
+    autocomplete_fields = ("category",)
+    # 親タスクの選択肢に全 Todo を並べないよう、ID の入力欄にする
+    raw_id_fields = ("parent",)
+    search_fields = ("=category__user__username",)
+    search_help_text = "ユーザー名 (完全一致) で検索"
+    readonly_fields = ("sync_seq",)
+    actions = ("mark_finished", "mark_unfinished", "delete_todos")
+
+    def get_actions(self, request):
+        # 既定の一括削除は 1 件ずつ読み込んで消すので、set-based な delete_todos に置き換える
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    def run_bulk_action(self, request, queryset, action, message):
+        count = bulk.update_todos(queryset, action)
+        self.message_user(request, message % count, messages.SUCCESS)
+
+    @admin.action(description="選択した Todo を完了済みにする", permissions=["change"])
+    def mark_finished(self, request, queryset):
+        self.run_bulk_action(
+            request, queryset, bulk.ACTION_FINISH, "%d 件を完了済みにしました"
+        )
+
+    @admin.action(description="選択した Todo を未完了に戻す", permissions=["change"])
+    def mark_unfinished(self, request, queryset):
+        self.run_bulk_action(
+            request, queryset, bulk.ACTION_REOPEN, "%d 件を未完了に戻しました"
+        )
+
+    @admin.action(description="選択した Todo を削除する", permissions=["delete"])
+    def delete_todos(self, request, queryset):
+        self.run_bulk_action(
+            request, queryset, bulk.ACTION_DELETE, "%d 件を削除しました"
+        )
@@ -0,0 +1,196 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import AccessMixin
+from django.core.exceptions import BadRequest
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.shortcuts import aget_object_or_404, render
+from django.views.generic import View
+
+from main import replicas, user_cache
+from main.conditional import ConditionalGetMixin, set_validators
+from main.charts import aget_category_hours_chart, aget_period_hours_chart
+from main.forms import CategoryCreateForm, TimeRangeForm, TodoBulkActionForm
+from main.models import Category
+from main.pagination import InvalidCursor, apaginate_keyset
+from main.replicas import ReplicaReadMixin
+from main.views import (
+    CalendarMixin,
+    DailyMixin,
+    HomeView,
+    TodoListMixin,
+    aget_category_list,
+    aget_category_summaries,
+)
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """LoginRequiredMixin の非同期版。ユーザーは request.auser() で読み込む"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        # 以降 request.user を触っても同期 DB アクセスが起きないように差し替える
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncConditionalGetMixin(ConditionalGetMixin):
+    """ConditionalGetMixin の非同期版"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return await super(ConditionalGetMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+        etag = self.get_etag(await user_cache.aget_version(request.user.pk))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await super(ConditionalGetMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+        return set_validators(response, etag)
+
+
+class AsyncReplicaReadMixin(ReplicaReadMixin):
+    """ReplicaReadMixin の非同期版
+
+    非同期の ORM は sync_to_async でコンテキストを引き継ぐので、振り分け先も伝わる。
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        alias = await replicas.achoose_replica(request)
+        if alias is None:
+            return await super(ReplicaReadMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+        with replicas.reading_from(alias):
+            return await super(ReplicaReadMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+
+
+class HomeAsyncView(
+    AsyncLoginRequiredMixin,
+    DailyMixin,
+    AsyncConditionalGetMixin,
+    AsyncReplicaReadMixin,
+    View,
+):
+    template_name = "main/home.html"
+
+    async def get(self, request, *args, **kwargs):
+        context = {
+            "form": CategoryCreateForm(),
+            "view": self,
+            "category_list": await aget_category_summaries(request.user),
+        }
+        return render(request, self.template_name, context)
+
+    async def post(self, request, *args, **kwargs):
+        # カテゴリ作成は書き込みなので同期版にそのまま任せる
+        return await sync_to_async(HomeView.as_view())(request, *args, **kwargs)
+
+
+class TodoListAsyncView(
+    AsyncLoginRequiredMixin,
+    TodoListMixin,
+    AsyncConditionalGetMixin,
+    AsyncReplicaReadMixin,
+    View,
+):
+    async def get(self, request, *args, **kwargs):
+        queryset, ordering = self.get_filtered_queryset()
+
+        async def load_page():
+            try:
+                page, next_cursor = await apaginate_keyset(
+                    queryset, ordering, request.GET.get("cursor"), self.page_size
+                )
+            except InvalidCursor:
+                raise BadRequest("invalid cursor")
+            if page:
+                category = page[0].category
+            else:
+                category = await aget_object_or_404(
+                    Category,
+                    id=self.kwargs["category_id"],
+                    user=request.user,
+                )
+            return page, next_cursor, category
+
+        page, next_cursor, category = await user_cache.aget_or_set(
+            request.user.pk, self.get_cache_name(), load_page
+        )
+        bulk_form = TodoBulkActionForm(user=request.user)
+        bulk_form.set_category_choices(await aget_category_list(request.user))
+
+        context = {
+            "view": self,
+            "paginator": None,
+            "page_obj": None,
+            "is_paginated": False,
+            "object_list": page,
+            "todo_list": page,
+            "bulk_form": bulk_form,
+            **self.get_page_context(category, next_cursor),
+        }
+        return render(request, self.template_name, context)
+
+
+class CalendarAsyncView(
+    AsyncLoginRequiredMixin,
+    CalendarMixin,
+    AsyncConditionalGetMixin,
+    AsyncReplicaReadMixin,
+    View,
+):
+    async def get(self, request, *args, **kwargs):
+        context = {"view": self, **self.get_calendar_context()}
+
+        weeks = context["calendar_weeks"]
+        day_counts = [row async for row in self.get_day_counts_queryset(weeks)]
+        context["calendar_weeks"] = self.annotate_weeks(weeks, day_counts)
+
+        todos = []
+        if context["selected_day"]:
+            todos = [
+                todo
+                async for todo in self.get_selected_day_queryset(context["selected_day"])
+            ]
+        context["todos"] = todos
+
+        return render(request, self.template_name, context)
+
+
+class MypageAsyncView(
+    AsyncLoginRequiredMixin, AsyncConditionalGetMixin, AsyncReplicaReadMixin, View
+):
+    template_name = "main/mypage.html"
+
+    async def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, {"view": self})
+
+
+class MypageChartAsyncView(
+    AsyncLoginRequiredMixin, AsyncConditionalGetMixin, AsyncReplicaReadMixin, View
+):
+    async def get(self, request, *args, **kwargs):
+        return JsonResponse(await aget_category_hours_chart(request.user))
+
+
+class MypageTimeChartAsyncView(
+    AsyncLoginRequiredMixin,
+    DailyMixin,
+    AsyncConditionalGetMixin,
+    AsyncReplicaReadMixin,
+    View,
+):
+    async def get(self, request, *args, **kwargs):
+        form = TimeRangeForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        return JsonResponse(
+            await aget_period_hours_chart(
+                request.user, form.cleaned_data["start"], form.cleaned_data["end"]
+            )
+        )
@@ -0,0 +1,108 @@
+"""セッションとログインユーザーの読み込みを減らす認証ミドルウェア
+
+Django の AuthenticationMiddleware はリクエストごとに main_user を 1 回読む。
+CachedAuthenticationMiddleware は読み込んだユーザーをプロセス内に
+AUTH_USER_CACHE_SECONDS 秒だけ持ち、(セッションキー, パスワード由来のハッシュ)
+をキーに使い回す。
+
+ユーザーを保存する (パスワード変更・管理画面での編集・ログイン) とユーザーごとの
+キャッシュのバージョン (main/user_cache.py) が上がるので、ほかのプロセスが持って
+いるユーザーも次のリクエストで読み直す。ログアウトではセッションごと消えるので、
+古いセッションキーでは引けなくなる。
+
+セッション自体は SESSION_ENGINE (既定は cached_db) でキャッシュから読む。
+"""
+
+import copy
+import time
+from functools import partial
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from main import user_cache
+
+# プロセス内に持つユーザーの上限 (超えたら全部捨てる)
+MAX_ENTRIES = 10000
+
+# {(セッションキー, ハッシュ): (期限, バージョン, ユーザー)}
+_users = {}
+
+
+def _lookup(key, version):
+    entry = _users.get(key)
+    if entry is None:
+        return None
+    expires, cached_version, user = entry
+    if expires < time.monotonic() or cached_version != version:
+        _users.pop(key, None)
+        return None
+    # 同じインスタンスを複数のリクエストから書き換えないよう複製して返す
+    return copy.deepcopy(user)
+
+
+def _store(key, version, user):
+    if not user.is_authenticated or settings.AUTH_USER_CACHE_SECONDS <= 0:
+        return
+    if len(_users) >= MAX_ENTRIES:
+        _users.clear()
+    expires = time.monotonic() + settings.AUTH_USER_CACHE_SECONDS
+    _users[key] = (expires, version, copy.deepcopy(user))
+
+
+def clear():
+    _users.clear()
+
+
+def load_user(request):
+    """セッションのユーザーを返す。プロセス内に持っていれば DB を読まない"""
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        # 未ログイン。auth.get_user もクエリを出さずに AnonymousUser を返す
+        return auth.get_user(request)
+    key = (request.session.session_key, request.session.get(HASH_SESSION_KEY))
+    # バージョンは読み込みより先に取る (読み込み中の書き込みは次で読み直す)
+    version = user_cache.get_version(user_id)
+    user = _lookup(key, version)
+    if user is None:
+        # セッションのハッシュの検証 (合わなければログアウト) も Django に任せる
+        user = auth.get_user(request)
+        _store(key, version, user)
+    return user
+
+
+async def aload_user(request):
+    user_id = await request.session.aget(SESSION_KEY)
+    if user_id is None:
+        return await auth.aget_user(request)
+    key = (request.session.session_key, await request.session.aget(HASH_SESSION_KEY))
+    version = await user_cache.aget_version(user_id)
+    user = _lookup(key, version)
+    if user is None:
+        user = await auth.aget_user(request)
+        _store(key, version, user)
+    return user
+
+
+def get_user(request):
+    if not hasattr(request, "_cached_user"):
+        request._cached_user = load_user(request)
+    return request._cached_user
+
+
+async def auser(request):
+    if not hasattr(request, "_acached_user"):
+        request._acached_user = await aload_user(request)
+    return request._acached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware と同じく request.user / request.auser を用意する"""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(auser, request)
@@ -0,0 +1,325 @@
+import json
+import math
+import random
+import re
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from main import ranking
+from main.models import CalendarFeedToken, Category, SyncState, Todo, User
+from main.pagination import encode_cursor
+from main.querybudget import QueryRecorder
+from main.rollups import rebuild_rollups
+
+# ベンチマークは書き込みの URL も叩くので、計測用に作ったユーザーにだけ向ける。
+# seed_data (既定の接頭辞) と各 bench コマンドが作るユーザー名
+BENCH_USERNAME_RE = re.compile(r"seed\d+|bench_\w+")
+
+
+def is_bench_username(username):
+    return BENCH_USERNAME_RE.fullmatch(username) is not None
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def latency_summary(seconds):
+    """秒のリストを ms 単位の p50/p95/p99 にまとめる"""
+    return {
+        f"p{pct}_ms": round(percentile(seconds, pct) * 1000, 2) for pct in (50, 95, 99)
+    }
+
+
+def bench_client(user):
+    # DEBUG 時の ALLOWED_HOSTS に含まれる名前でリクエストを送る
+    client = Client(SERVER_NAME="localhost")
+    client.force_login(user)
+    return client
+
+
+def ensure_bench_user(username, categories=5, todos_per_category=200):
+    """ベンチマーク用のユーザーとデータを用意する (既にあれば作り直さない)"""
+    user, created = User.objects.get_or_create(username=username)
+    if not created and user.categories.exists():
+        return user
+    now = timezone.now()
+    with transaction.atomic():
+        category_objs = Category.objects.bulk_create(
+            [Category(user=user, name=f"bench-{i}") for i in range(categories)]
+        )
+        ranks = ranking.spread_keys(todos_per_category)
+        Todo.objects.bulk_create(
+            [
+                Todo(
+                    category=category,
+                    title=f"todo-{j}",
+                    deadline_time=now + timedelta(hours=j * 7),
+                    hour_spent=j % 5,
+                    is_finished=j % 3 == 0,
+                    rank=ranks[j],
+                )
+                for category in category_objs
+                for j in range(todos_per_category)
+            ],
+            batch_size=1000,
+        )
+        rebuild_rollups(users=[user.pk])
+    return user
+
+
+def deadline_offset(rng):
+    """現在からの締め切りのずれを返す。期限切れ 2 割・2 週間以内 5 割・半年以内 3 割"""
+    bucket = rng.random()
+    if bucket < 0.2:
+        return -timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+    if bucket < 0.7:
+        return timedelta(minutes=rng.randint(1, 60 * 24 * 14))
+    return timedelta(minutes=rng.randint(60 * 24 * 14, 60 * 24 * 180))
+
+
+def generate_todos(categories, todos_per_category, rng, now):
+    ranks = ranking.spread_keys(todos_per_category)
+    for category in categories:
+        for j in range(todos_per_category):
+            offset = deadline_offset(rng)
+            # 期限切れのものほど完了済みが多い
+            finished_ratio = 0.8 if offset < timedelta(0) else 0.2
+            yield Todo(
+                category=category,
+                title=f"todo-{j}",
+                description="" if rng.random() < 0.5 else f"{category.name} の作業 {j}",
+                deadline_time=now + offset,
+                hour_spent=rng.choice((0, 0, 1, 1, 2, 3, 5, 8)),
+                is_finished=rng.random() < finished_ratio,
+                rank=ranks[j],
+            )
+
+
+def seed_users(
+    users,
+    categories_per_user,
+    todos_per_category,
+    prefix="seed",
+    password="password",
+    batch_size=2000,
+    seed=0,
+):
+    """users 人分のユーザー・カテゴリ・Todo をまとめて INSERT する
+
+    シグナルを通さない bulk_create で入れるので、集計テーブルは最後に作り直す。
+    作ったユーザーのリストを返す。
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    hashed = make_password(password)
+    with transaction.atomic():
+        user_objs = User.objects.bulk_create(
+            [User(username=f"{prefix}{i}", password=hashed) for i in range(users)],
+            batch_size=batch_size,
+        )
+        SyncState.objects.bulk_create([SyncState(user=user) for user in user_objs])
+        category_objs = Category.objects.bulk_create(
+            [
+                Category(user=user, name=f"{prefix}-category-{i}")
+                for user in user_objs
+                for i in range(categories_per_user)
+            ],
+            batch_size=batch_size,
+        )
+        # Todo は件数が多いので batch_size 件ずつ作ってはメモリから手放す
+        todos = generate_todos(category_objs, todos_per_category, rng, now)
+        while batch := list(islice(todos, batch_size)):
+            Todo.objects.bulk_create(batch)
+        rebuild_rollups(users=[user.pk for user in user_objs], batch_size=batch_size)
+    return user_objs
+
+
+def route_requests(user):
+    """main/urls.py の全 URL を 1 回ずつ叩くためのリクエストの一覧を返す
+
+    (URL 名, メソッド, パス, データ, ログインが必要か) のタプルのリスト。
+    """
+    category = user.categories.order_by("id").first()
+    todo = category.todos.order_by("id").first()
+    todo_ids = list(category.todos.values_list("id", flat=True)[:100])
+    todo_args = {"category_id": category.id, "todo_id": todo.id}
+    category_args = {"category_id": category.id}
+    today = timezone.localdate()
+    feed_token, _ = CalendarFeedToken.objects.get_or_create(user=user)
+    feed_args = {"token": feed_token.token}
+    sync_row = {
+        "id": todo.id,
+        "category_id": category.id,
+        "title": todo.title,
+        "description": todo.description or "",
+        "deadline_time": todo.deadline_time.isoformat(),
+        "hour_spent": todo.hour_spent,
+        "is_finished": todo.is_finished,
+    }
+    return [
+        ("signup", "get", reverse("signup"), None, False),
+        ("login", "get", reverse("login"), None, False),
+        ("logout", "post", reverse("logout"), {}, True),
+        ("home", "get", reverse("home"), None, True),
+        ("todo_list", "get", reverse("todo_list", kwargs=category_args), None, True),
+        (
+            "todo_list",
+            "get",
+            reverse("todo_list", kwargs=category_args) + "?order=status&status=open",
+            None,
+            True,
+        ),
+        (
+            "todo_create",
+            "get",
+            reverse("todo_create", kwargs=category_args),
+            None,
+            True,
+        ),
+        (
+            "todo_bulk",
+            "post",
+            reverse("todo_bulk", kwargs=category_args),
+            {"todo_ids": todo_ids, "action": "finish"},
+            True,
+        ),
+        ("todo_detail", "get", reverse("todo_detail", kwargs=todo_args), None, True),
+        ("todo_update", "get", reverse("todo_update", kwargs=todo_args), None, True),
+        ("todo_delete", "get", reverse("todo_delete", kwargs=todo_args), None, True),
+        (
+            "time_entry_create",
+            "post",
+            reverse("time_entry_create", kwargs=todo_args),
+            {"hours": 1, "spent_on": today.isoformat()},
+            True,
+        ),
+        (
+            "todo_reorder",
+            "post",
+            reverse("todo_reorder", kwargs=todo_args),
+            {"direction": "down"},
+            True,
+        ),
+        (
+            "todo_move",
+            "post",
+            reverse("todo_move", kwargs=todo_args),
+            {"parent": ""},
+            True,
+        ),
+        ("calendar", "get", reverse("calendar") + f"?day={today:%Y-%m-%d}", None, True),
+        ("mypage", "get", reverse("mypage"), None, True),
+        ("category_summary", "get", reverse("category_summary"), None, True),
+        ("mypage_chart", "get", reverse("mypage_chart"), None, True),
+        ("mypage_time_chart", "get", reverse("mypage_time_chart"), None, True),
+        ("todo_export", "get", reverse("todo_export") + "?format=csv", None, True),
+        ("todo_import", "get", reverse("todo_import"), None, True),
+        ("todo_search", "get", reverse("todo_search") + "?q=todo", None, True),
+        (
+            "calendar_feed_settings",
+            "get",
+            reverse("calendar_feed_settings"),
+            None,
+            True,
+        ),
+        (
+            "calendar_feed",
+            "get",
+            reverse("calendar_feed", kwargs=feed_args),
+            None,
+            False,
+        ),
+        ("sync_changes", "get", reverse("sync_changes"), None, True),
+        (
+            "sync_changes",
+            "get",
+            reverse("sync_changes") + f"?cursor={encode_cursor([0, 0, 0])}&limit=100",
+            None,
+            True,
+        ),
+        (
+            "sync_push",
+            "post",
+            reverse("sync_push"),
+            json.dumps({"todos": [sync_row]}),
+            True,
+        ),
+    ]
+
+
+def send_request(client, method, url, data):
+    """route_requests の 1 件を送る。data が文字列なら JSON の本文として送る"""
+    if isinstance(data, str):
+        return getattr(client, method)(url, data, content_type="application/json")
+    return getattr(client, method)(url, data)
+
+
+def response_size(response):
+    """レスポンス本文のバイト数 (ストリーミングなら最後まで読む)"""
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def bench_routes(user, iterations=20, warmup=2):
+    """全 URL を iterations 回ずつ叩き、URL ごとの遅延・クエリ数・バイト数を返す"""
+    client = Client(SERVER_NAME="localhost")
+    results = {}
+    for url_name, method, url, data, login in route_requests(user):
+        latencies = []
+        queries = []
+        sizes = []
+        for i in range(warmup + iterations):
+            # ログアウトでセッションが消えるので毎回ログインし直す
+            if login and (i == 0 or url_name == "logout"):
+                client.force_login(user)
+            elif not login and i == 0:
+                client.logout()
+            with QueryRecorder() as recorder:
+                started = time.perf_counter()
+                response = send_request(client, method, url, data)
+                size = response_size(response)
+                elapsed = time.perf_counter() - started
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            queries.append(recorder.count)
+            sizes.append(size)
+        results[url] = {
+            "name": url_name,
+            "method": method.upper(),
+            "status": response.status_code,
+            **latency_summary(latencies),
+            "queries": max(queries),
+            "bytes": max(sizes),
+        }
+    return results
+
+
+def compare_reports(baseline, current, tolerance=0.2):
+    """前回の結果と比べて悪くなった URL を (URL, 指標, 前回, 今回) のリストで返す
+
+    p95 は tolerance の割合まで、クエリ数は 1 本も増えることを許さない。
+    """
+    regressions = []
+    for url, result in current.items():
+        before = baseline.get(url)
+        if before is None:
+            continue
+        if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append((url, "p95_ms", before["p95_ms"], result["p95_ms"]))
+        if result["queries"] > before["queries"]:
+            regressions.append((url, "queries", before["queries"], result["queries"]))
+    return regressions
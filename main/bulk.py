@@ -0,0 +1,115 @@
+from datetime import timedelta
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+
+from main import changelog, rollups, timelog, tree, user_cache
+from main.models import TimeEntry, Todo
+
+ACTION_FINISH = "finish"
+ACTION_REOPEN = "reopen"
+ACTION_MOVE = "move"
+ACTION_SHIFT = "shift"
+ACTION_DELETE = "delete"
+
+
+def owned_todos(user, todo_ids):
+    return Todo.objects.filter(pk__in=todo_ids, category__user=user)
+
+
+def raw_delete(queryset):
+    """シグナルや関連オブジェクトの収集をせずに 1 本の DELETE 文で消す"""
+    return queryset._raw_delete(queryset.db)
+
+
+def delete_todos(queryset, seq=None):
+    """Todo を削除待ちにする (行は purge_deleted コマンドが後から消す)
+
+    読み込みからはすぐに外れる。差分同期のための削除の記録と、作業時間の
+    日別・週別の集計からの差し引きはここで済ませる。
+    """
+    changelog.record_deletions(
+        changelog.KIND_TODO, queryset.values_list("category__user_id", "id"), seq=seq
+    )
+    timelog.subtract_entries(TimeEntry.objects.filter(todo__in=queryset))
+    return queryset.update(is_deleted=True)
+
+
+def bulk_update_todos(user, todo_ids, action, category=None, shift_days=0):
+    """user の Todo のうち todo_ids に含まれるものへ action をまとめて適用し、件数を返す
+
+    所有者の確認は UPDATE/DELETE 文自体の条件に含める。
+    """
+    return update_todos(
+        owned_todos(user, todo_ids), action, category=category, shift_days=shift_days
+    )
+
+
+def contributions_after(before, action, category=None):
+    """更新前のカテゴリごとの寄与から、action 適用後の寄与を計算する
+
+    更新後に queryset を引き直すと、絞り込み条件 (is_finished など) 自体が
+    変わった行を取りこぼすので、SELECT せずに組み立てる。
+    """
+    if action == ACTION_DELETE:
+        return {}
+    after = {}
+    for category_id, values in before.items():
+        total = values["finished_count"] + values["unfinished_count"]
+        if action == ACTION_FINISH:
+            values = {**values, "finished_count": total, "unfinished_count": 0}
+        elif action == ACTION_REOPEN:
+            values = {**values, "finished_count": 0, "unfinished_count": total}
+        if action == ACTION_MOVE:
+            category_id = category.pk
+        rollups.add_contribution_values(after, category_id, values)
+    return after
+
+
+def update_todos(queryset, action, category=None, shift_days=0, seq=None):
+    """queryset の Todo へ action を 1 本の UPDATE/DELETE 文で適用し、件数を返す
+
+    queryset.update() はシグナルを発行しないので、集計テーブルは前後の寄与の
+    差分で更新し、影響のあったユーザーのキャッシュのバージョンを上げる。
+    seq は呼び出し側が同じトランザクションで払い出した同期番号 (なければ払い出す)。
+    """
+    with transaction.atomic():
+        if action == ACTION_DELETE:
+            # サブタスクも一緒に消す
+            queryset = tree.with_descendants(queryset)
+        before = rollups.queryset_contributions(queryset)
+        after = contributions_after(before, action, category)
+        owners = rollups.category_owners(before.keys() | after.keys())
+
+        if action == ACTION_FINISH:
+            changes = {"is_finished": True}
+        elif action == ACTION_REOPEN:
+            changes = {"is_finished": False}
+        elif action == ACTION_MOVE:
+            changes = {"category": category}
+        elif action == ACTION_SHIFT:
+            changes = {
+                "deadline_time": F("deadline_time") + timedelta(days=shift_days)
+            }
+        elif action == ACTION_DELETE:
+            changes = None
+        else:
+            raise ValueError(f"unknown bulk action: {action}")
+
+        if changes is None:
+            count = delete_todos(queryset, seq=seq)
+        elif owners:
+            # 1 本の UPDATE 文なので、持ち主が複数いても同じ同期番号を付ける
+            if seq is None:
+                seq = changelog.next_seq(*owners.values())
+            count = queryset.update(**changes, sync_seq=seq)
+        else:
+            count = 0
+
+        user_ids = rollups.apply_category_deltas(
+            rollups.diff_contributions(before, after), owners
+        )
+        for user_id in user_ids:
+            transaction.on_commit(partial(user_cache.bump_version, user_id))
+    return count
@@ -0,0 +1,91 @@
+"""差分同期のための変更の記録 (同期番号と削除の記録)
+
+Category / Todo に書き込むたびに、持ち主のユーザーの同期番号 (SyncState.last_seq)
+を進めて、書き込んだ行の sync_seq に入れる。番号の行を UPDATE で先にロックする
+ので、同じユーザーへの書き込みは番号の順にコミットされる。読み手はカーソルの
+番号より後の行だけを読めば取りこぼさない (main/sync.py)。
+
+削除は行が残らないので、同じ番号で SyncTombstone に記録する。
+"""
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+
+from main.models import SyncState, SyncTombstone, User
+
+KIND_CATEGORY = "category"
+KIND_TODO = "todo"
+
+
+def next_seq(*user_ids):
+    """user_ids のユーザーの書き込みに付ける同期番号を払い出す
+
+    複数のユーザーの行を 1 本の UPDATE 文で書き換えるときのため、全員の番号を
+    全員の現在の番号より大きい同じ値にそろえて払い出す (番号が飛ぶのは構わない)。
+    """
+    user_ids = sorted(set(user_ids))
+    states = SyncState.objects.filter(user_id__in=user_ids)
+    if states.update(last_seq=F("last_seq") + 1) < len(user_ids):
+        SyncState.objects.bulk_create(
+            [SyncState(user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        states.update(last_seq=F("last_seq") + 1)
+    seqs = list(states.values_list("last_seq", flat=True))
+    seq = max(seqs)
+    if min(seqs) < seq:
+        states.filter(last_seq__lt=seq).update(last_seq=seq)
+    return seq
+
+
+def record_deletions(kind, rows, seq=None):
+    """(user_id, 削除した行の ID) の組を削除の記録に残す
+
+    seq を渡せば、同じトランザクションで払い出し済みのその番号で記録する。
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    if seq is None:
+        seq = next_seq(*{user_id for user_id, _ in rows})
+    SyncTombstone.objects.bulk_create(
+        [
+            SyncTombstone(user_id=user_id, kind=kind, object_id=object_id, sync_seq=seq)
+            for user_id, object_id in rows
+        ],
+        batch_size=1000,
+    )
+
+
+def deleting_user(origin):
+    """削除の起点がユーザーなら True (記録の持ち主ごと消えるので記録しない)"""
+    return isinstance(origin, User) or getattr(origin, "model", None) is User
+
+
+def purge_tombstones(before, batch_size=1000):
+    """before より前の削除の記録を消し、消した件数を返す
+
+    消した範囲より前のカーソルは削除を取りこぼすので、SyncState.purged_seq を
+    進めて使えなくする (クライアントは全件を取り直す)。
+    """
+    purged = 0
+    while True:
+        batch = list(
+            SyncTombstone.objects.filter(created_at__lt=before)
+            .values("user_id")
+            .annotate(max_seq=Max("sync_seq"))
+            .order_by("user_id")
+            .values_list("user_id", "max_seq")[:batch_size]
+        )
+        if not batch:
+            return purged
+        for user_id, max_seq in batch:
+            with transaction.atomic():
+                SyncState.objects.filter(user_id=user_id).update(
+                    purged_seq=Greatest("purged_seq", max_seq)
+                )
+                tombstones = SyncTombstone.objects.filter(
+                    user_id=user_id, sync_seq__lte=max_seq
+                )
+                purged += tombstones._raw_delete(tombstones.db)
@@ -0,0 +1,86 @@
+from main import profiling, timelog, user_cache
+from main.models import Category
+
+
+def _category_hours_rows(user):
+    return (
+        Category.objects.filter(user=user)
+        .order_by("name")
+        .values_list("name", "rollup__total_hours")
+    )
+
+
+@profiling.span("chart")
+def _category_hours_figure(rows):
+    """カテゴリごとの経過時間グラフを Plotly.newPlot にそのまま渡せる dict で返す"""
+    category_names = []
+    total_hours = []
+    for name, hours in rows:
+        category_names.append(name)
+        total_hours.append(hours or 0)
+
+    return {
+        "data": [{"type": "bar", "x": category_names, "y": total_hours}],
+        "layout": {
+            "title": {"text": "カテゴリごとの経過時間(h)"},
+            "xaxis": {"title": {"text": "カテゴリ"}},
+            "yaxis": {"title": {"text": "経過時間(h)"}, "rangemode": "tozero"},
+        },
+    }
+
+
+def build_category_hours_chart(user):
+    return _category_hours_figure(_category_hours_rows(user))
+
+
+def get_category_hours_chart(user):
+    return user_cache.get_or_set(
+        user.pk, "mypage_chart", lambda: build_category_hours_chart(user)
+    )
+
+
+async def aget_category_hours_chart(user):
+    async def build():
+        rows = [row async for row in _category_hours_rows(user)]
+        return _category_hours_figure(rows)
+
+    return await user_cache.aget_or_set(user.pk, "mypage_chart", build)
+
+
+@profiling.span("chart")
+def _period_hours_figure(granularity, rows):
+    """期間別・カテゴリ別の作業時間の積み上げ棒グラフ"""
+    series = {}
+    for period, name, hours in rows:
+        x, y = series.setdefault(name, ([], []))
+        x.append(period.isoformat())
+        y.append(hours)
+    unit = "日" if granularity == "day" else "週"
+    return {
+        "data": [
+            {"type": "bar", "name": name, "x": x, "y": y}
+            for name, (x, y) in series.items()
+        ],
+        "layout": {
+            "title": {"text": f"{unit}ごとの作業時間(h)"},
+            "barmode": "stack",
+            "xaxis": {"title": {"text": unit}, "type": "date"},
+            "yaxis": {"title": {"text": "作業時間(h)"}, "rangemode": "tozero"},
+        },
+    }
+
+
+def get_period_hours_chart(user, start, end):
+    def build():
+        granularity, rows = timelog.period_rows(user, start, end)
+        return _period_hours_figure(granularity, rows)
+
+    return user_cache.get_or_set(user.pk, f"time_chart:{start}:{end}", build)
+
+
+async def aget_period_hours_chart(user, start, end):
+    async def build():
+        granularity, queryset = timelog.period_rows(user, start, end)
+        return _period_hours_figure(granularity, [row async for row in queryset])
+
+    return await user_cache.aget_or_set(user.pk, f"time_chart:{start}:{end}", build)
@@ -0,0 +1,172 @@
+"""期限切れ・締め切り間近の Todo を見つけて通知先 (sink) に渡すスキャナ
+
+(is_finished, deadline_time) のインデックスを締め切り順に読む。期限切れは読み
+終えた位置 (締め切り日時, ID) を DeadlineScanState に保存し、次の tick はその
+続きから読むので、1 回の tick で読む行数は新しく範囲に入った分だけになる。
+締め切りを読み終えた位置より前に動かした Todo は通知されない。
+
+締め切り間近は後から作られた・締め切りを動かした Todo も拾えるよう、tick の
+たびに [now, now + window] を読み直す。通知済みかどうかは DeadlineNotification
+に記録し (一意制約で重複しない)、まだ記録のない行だけを sink に渡す。
+
+位置・通知の記録をコミットしてから sink に渡す (Webhook の通信の間に書き込みの
+ロックを握らない)。渡すのは各 sink に 1 回だけで、失敗した sink にはログを
+残して次のバッチへ進む (ほかの sink には届く)。
+"""
+
+import json
+import logging
+import urllib.request
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from main.models import DeadlineNotification, DeadlineScanState, Todo
+
+KIND_OVERDUE = "overdue"
+KIND_UPCOMING = "upcoming"
+KINDS = (KIND_OVERDUE, KIND_UPCOMING)
+
+logger = logging.getLogger(__name__)
+
+
+class LogSink:
+    def emit(self, kind, rows):
+        for todo_id, deadline_time in rows:
+            logger.info("todo %s is %s (deadline %s)", todo_id, kind, deadline_time)
+
+
+class NotificationSink:
+    """DeadlineNotification に書き込む。読み直しで重複した行は無視する"""
+
+    def emit(self, kind, rows):
+        DeadlineNotification.objects.bulk_create(
+            [
+                DeadlineNotification(
+                    todo_id=todo_id, kind=kind, deadline_time=deadline_time
+                )
+                for todo_id, deadline_time in rows
+            ],
+            ignore_conflicts=True,
+        )
+
+
+class WebhookSink:
+    """バッチごとに JSON を POST する (ローカルの受け口を想定)"""
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def emit(self, kind, rows):
+        body = json.dumps(
+            {
+                "kind": kind,
+                "todos": [
+                    {"id": todo_id, "deadline_time": deadline_time.isoformat()}
+                    for todo_id, deadline_time in rows
+                ],
+            }
+        ).encode()
+        request = urllib.request.Request(
+            self.url, data=body, headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+def scan_range_end(kind, now, window):
+    """kind ごとに、今回の tick でどこまでの締め切りを読むか"""
+    if kind == KIND_OVERDUE:
+        return now
+    return now + window
+
+
+def get_state(kind, now):
+    # 初回は現在時刻から始める (過去の期限切れをまとめて通知しない)
+    state, _ = DeadlineScanState.objects.get_or_create(
+        name=kind, defaults={"high_water_time": now}
+    )
+    return state
+
+
+def open_deadlines_after(high_water_time, high_water_id, end, limit):
+    """(high_water_time, high_water_id) より後で end までの未完了の締め切りを返す"""
+    # is_finished=False は "NOT is_finished" になりインデックスの等価条件に
+    # ならないので、IN で書いて (is_finished, deadline_time) を範囲で読ませる
+    return list(
+        Todo.objects.filter(
+            is_finished__in=[False],
+            deadline_time__gte=high_water_time,
+            deadline_time__lte=end,
+        )
+        .filter(
+            Q(deadline_time__gt=high_water_time)
+            | Q(deadline_time=high_water_time, id__gt=high_water_id)
+        )
+        .order_by("deadline_time", "id")
+        .values_list("id", "deadline_time")[:limit]
+    )
+
+
+def record_notifications(kind, rows):
+    """rows のうちまだ通知を記録していない行を記録して返す"""
+    notified = set(
+        DeadlineNotification.objects.filter(
+            todo_id__in=[todo_id for todo_id, _ in rows], kind=kind
+        ).values_list("todo_id", "deadline_time")
+    )
+    rows = [row for row in rows if row not in notified]
+    NotificationSink().emit(kind, rows)
+    return rows
+
+
+def emit(sinks, kind, rows):
+    """コミット済みのバッチを各 sink に渡す。失敗した sink はログに残して飛ばす"""
+    for sink in sinks:
+        try:
+            sink.emit(kind, rows)
+        except Exception:
+            logger.exception("%s failed to emit %d %s todos", sink, len(rows), kind)
+
+
+def scan(
+    kind,
+    sinks,
+    now=None,
+    window=timedelta(hours=1),
+    batch_size=1000,
+    max_batches=100,
+):
+    """kind の範囲に新しく入った Todo を batch_size 件ずつ sinks に渡し、件数を返す
+
+    1 回の呼び出しで読むのは max_batches バッチまで。残りは次の呼び出しで読む。
+    """
+    now = now or timezone.now()
+    end = scan_range_end(kind, now, window)
+    position = (now, 0)
+    emitted = 0
+    for _ in range(max_batches):
+        with transaction.atomic():
+            if kind == KIND_OVERDUE:
+                state = get_state(kind, now)
+                position = (state.high_water_time, state.high_water_id)
+            rows = open_deadlines_after(*position, end, batch_size)
+            if not rows:
+                break
+            new_rows = rows
+            if kind == KIND_UPCOMING:
+                new_rows = record_notifications(kind, rows)
+            todo_id, deadline_time = rows[-1]
+            position = (deadline_time, todo_id)
+            if kind == KIND_OVERDUE:
+                state.high_water_time, state.high_water_id = position
+                state.save()
+        if new_rows:
+            emit(sinks, kind, new_rows)
+        emitted += len(new_rows)
+        if len(rows) < batch_size:
+            break
+    return emitted
@@ -1,7 +1,12 @@
+from datetime import timedelta
+
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
+from django.core.exceptions import ValidationError
+from django.utils import timezone
 
-from main.models import Category, Todo, User
+from main import bulk, tree
+from main.models import Category, TimeEntry, Todo, User
 
 
 class SignUpForm(UserCreationForm):
@@ -20,6 +25,12 @@ class CategoryCreateForm(forms.ModelForm):
         fields = ("name",)
 
 
+def check_depth(parent):
+    """parent の下にサブタスクを作っても MAX_DEPTH を超えないか確かめる"""
+    if parent is not None and tree.depth(parent.path) >= tree.MAX_DEPTH:
+        raise ValidationError(f"階層は{tree.MAX_DEPTH}段までです。", code="max_depth")
+
+
 class TodoCreateForm(forms.ModelForm):
     class Meta:
         model = Todo
@@ -27,6 +38,7 @@ class TodoCreateForm(forms.ModelForm):
             "title",
             "description",
             "deadline_time",
+            "parent",
         )
         widgets = {
             "deadline_time": forms.DateTimeInput(
@@ -34,8 +46,19 @@ class TodoCreateForm(forms.ModelForm):
                     "type": "datetime-local",
                 }
             ),
+            # サブタスクを作るときだけ、詳細画面のリンクから親の ID を受け取る
+            "parent": forms.HiddenInput,
         }
 
+    def __init__(self, *args, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["parent"].queryset = Todo.objects.filter(category__user=user)
+
+    def clean_parent(self):
+        parent = self.cleaned_data["parent"]
+        check_depth(parent)
+        return parent
+
 
 class TodoUpdateForm(forms.ModelForm):
     class Meta:
@@ -57,3 +80,304 @@ class TodoUpdateForm(forms.ModelForm):
     # def __init__(self, *args, **kwargs):
     #     super().__init__(*args, **kwargs)
     #     self.fields["deadline_time"].input_formats = ["%Y-%m-%dT%H:%M"]
+
+
+class TodoFilterForm(forms.Form):
+    STATUS_CHOICES = (
+        ("", "すべて"),
+        ("open", "未完了"),
+        ("done", "完了済み"),
+    )
+    ORDER_CHOICES = (
+        ("deadline", "締め切り順"),
+        ("status", "未完了を先に"),
+        ("manual", "手動"),
+    )
+
+    status = forms.ChoiceField(label="状態", choices=STATUS_CHOICES, required=False)
+    deadline_from = forms.DateField(
+        label="締め切り(から)",
+        required=False,
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    deadline_to = forms.DateField(
+        label="締め切り(まで)",
+        required=False,
+        widget=forms.DateInput(attrs={"type": "date"}),
+    )
+    order = forms.ChoiceField(label="並び順", choices=ORDER_CHOICES, required=False)
+
+
+class IntegerListField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def __init__(self, *, max_length=None, **kwargs):
+        self.max_length = max_length
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            values = sorted({int(v) for v in value})
+        except (TypeError, ValueError):
+            raise ValidationError("不正なIDが含まれています。", code="invalid")
+        if self.max_length is not None and len(values) > self.max_length:
+            raise ValidationError(
+                f"一度に操作できるのは{self.max_length}件までです。", code="max_length"
+            )
+        return values
+
+
+class TodoBulkActionForm(forms.Form):
+    ACTION_CHOICES = (
+        (bulk.ACTION_FINISH, "完了にする"),
+        (bulk.ACTION_REOPEN, "未完了に戻す"),
+        (bulk.ACTION_MOVE, "カテゴリを移動"),
+        (bulk.ACTION_SHIFT, "締め切りをずらす"),
+        (bulk.ACTION_DELETE, "削除"),
+    )
+
+    todo_ids = IntegerListField(max_length=1000)
+    action = forms.ChoiceField(label="一括操作", choices=ACTION_CHOICES)
+    category = forms.ModelChoiceField(
+        label="移動先", queryset=Category.objects.none(), required=False
+    )
+    # 締め切りが日付の範囲を超えないよう、前後 10 年までにする
+    shift_days = forms.IntegerField(
+        label="ずらす日数", min_value=-3650, max_value=3650, required=False
+    )
+
+    def __init__(self, *args, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["category"].queryset = Category.objects.filter(
+            user=user
+        ).order_by("name")
+
+    def set_category_choices(self, categories):
+        """移動先の選択肢を読み込み済みのカテゴリから作り、描画時にクエリを出さないようにする"""
+        field = self.fields["category"]
+        field.choices = [("", field.empty_label)] + [
+            (category.pk, category.name) for category in categories
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        action = cleaned_data.get("action")
+        if action == bulk.ACTION_MOVE and not cleaned_data.get("category"):
+            self.add_error("category", "移動先のカテゴリを選んでください。")
+        if action == bulk.ACTION_SHIFT and not cleaned_data.get("shift_days"):
+            self.add_error("shift_days", "ずらす日数を入力してください。")
+        return cleaned_data
+
+
+class TodoMoveForm(forms.Form):
+    parent = forms.ModelChoiceField(
+        label="親タスクのID",
+        queryset=Todo.objects.none(),
+        required=False,
+        widget=forms.NumberInput,
+        help_text="空にすると最上位のタスクになります。",
+    )
+
+    def __init__(self, *args, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["parent"].queryset = Todo.objects.filter(category__user=user)
+
+
+class TodoReorderForm(forms.Form):
+    """手動の並び順での移動先
+
+    ドラッグ&ドロップでは落とした位置の前後の Todo の ID を after / before に
+    (片方だけでもよい)、ボタンでは direction に 1 つ上 / 下を指定する。
+    """
+
+    DIRECTION_CHOICES = (
+        ("up", "上へ"),
+        ("down", "下へ"),
+    )
+
+    after = forms.IntegerField(required=False)
+    before = forms.IntegerField(required=False)
+    direction = forms.ChoiceField(choices=DIRECTION_CHOICES, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not any(cleaned_data.get(name) for name in ("after", "before", "direction")):
+            raise ValidationError("移動先を指定してください。")
+        return cleaned_data
+
+
+class TodoImportRowForm(forms.Form):
+    category = forms.CharField(max_length=50)
+    title = forms.CharField(max_length=50, required=False)
+    description = forms.CharField(required=False)
+    deadline_time = forms.DateTimeField(required=False)
+    hour_spent = forms.IntegerField(min_value=0, required=False)
+    is_finished = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (
+            cleaned_data.get("title")
+            and not cleaned_data.get("deadline_time")
+            and "deadline_time" not in self.errors
+        ):
+            self.add_error("deadline_time", "締め切り日時は必須です。")
+        return cleaned_data
+
+
+class TodoImportForm(forms.Form):
+    FORMAT_CHOICES = (
+        ("csv", "CSV"),
+        ("jsonl", "JSON Lines"),
+    )
+
+    file = forms.FileField(label="ファイル")
+    format = forms.ChoiceField(label="形式", choices=FORMAT_CHOICES)
+
+
+class TodoSearchForm(forms.Form):
+    q = forms.CharField(label="キーワード", max_length=100, required=False)
+    page = forms.IntegerField(min_value=1, max_value=100, required=False)
+
+
+class CalendarForm(forms.Form):
+    """カレンダーの表示月と選んだ日。年・月を省略すると今月"""
+
+    MIN_YEAR = 1900
+    MAX_YEAR = 2999
+
+    year = forms.IntegerField(min_value=MIN_YEAR, max_value=MAX_YEAR, required=False)
+    month = forms.IntegerField(min_value=1, max_value=12, required=False)
+    day = forms.DateField(input_formats=["%Y-%m-%d"], required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        today = timezone.localdate()
+        if cleaned_data.get("year") is None:
+            cleaned_data["year"] = today.year
+        if cleaned_data.get("month") is None:
+            cleaned_data["month"] = today.month
+        return cleaned_data
+
+
+class CalendarFeedForm(forms.Form):
+    """ICS フィードの期間。省略時は今日の DEFAULT_PAST_DAYS 日前から DEFAULT_FUTURE_DAYS 日後まで"""
+
+    DEFAULT_PAST_DAYS = 30
+    DEFAULT_FUTURE_DAYS = 365
+    MAX_DAYS = 366 * 5
+
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        today = timezone.localdate()
+        start = cleaned_data.get("start") or today - timedelta(
+            days=self.DEFAULT_PAST_DAYS
+        )
+        end = cleaned_data.get("end") or today + timedelta(
+            days=self.DEFAULT_FUTURE_DAYS
+        )
+        if start > end:
+            raise ValidationError("開始日は終了日より前にしてください。")
+        if (end - start).days > self.MAX_DAYS:
+            raise ValidationError(f"期間は {self.MAX_DAYS} 日以内にしてください。")
+        cleaned_data["start"], cleaned_data["end"] = start, end
+        return cleaned_data
+
+
+class TimeEntryForm(forms.ModelForm):
+    hours = forms.IntegerField(label="時間数(h)", min_value=1)
+
+    class Meta:
+        model = TimeEntry
+        fields = ("hours", "spent_on")
+        widgets = {"spent_on": forms.DateInput(attrs={"type": "date"})}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["spent_on"].initial = timezone.localdate
+
+
+class TimeRangeForm(forms.Form):
+    """マイページの期間別グラフの期間。省略時は今日までの DEFAULT_DAYS 日間"""
+
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 366 * 3
+
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        end = cleaned_data.get("end") or timezone.localdate()
+        start = cleaned_data.get("start") or end - timedelta(days=self.DEFAULT_DAYS - 1)
+        if start > end:
+            raise ValidationError("開始日は終了日より前にしてください。")
+        if (end - start).days > self.MAX_DAYS:
+            raise ValidationError(f"期間は {self.MAX_DAYS} 日以内にしてください。")
+        cleaned_data["start"], cleaned_data["end"] = start, end
+        return cleaned_data
+
+
+class SyncPullForm(forms.Form):
+    cursor = forms.CharField(max_length=200, required=False)
+    limit = forms.IntegerField(min_value=1, max_value=1000, required=False)
+
+
+class SyncRowForm(forms.Form):
+    """差分同期で送られてくる 1 行。id があれば更新、なければ作成"""
+
+    id = forms.IntegerField(min_value=1, required=False)
+    client_id = forms.CharField(max_length=64, required=False)
+    base_seq = forms.IntegerField(min_value=0, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("id") and not cleaned_data.get("client_id"):
+            raise ValidationError("id か client_id を指定してください。")
+        return cleaned_data
+
+
+class SyncCategoryForm(SyncRowForm):
+    name = forms.CharField(max_length=50)
+
+
+class SyncTodoForm(SyncRowForm):
+    """差分同期で送られてくる Todo の 1 行
+
+    category_id の代わりに、同じリクエストで作るカテゴリの client_id を
+    category_client_id に指定してもよい。
+    """
+
+    category_id = forms.IntegerField(min_value=1, required=False)
+    category_client_id = forms.CharField(max_length=64, required=False)
+    title = forms.CharField(max_length=50)
+    description = forms.CharField(required=False)
+    deadline_time = forms.DateTimeField()
+    hour_spent = forms.IntegerField(min_value=0, required=False)
+    is_finished = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get("category_id") and not cleaned_data.get(
+            "category_client_id"
+        ):
+            self.add_error(
+                "category_id", "category_id か category_client_id を指定してください。"
+            )
+        return cleaned_data
+
+
+class SyncDeletionForm(forms.Form):
+    TYPE_CHOICES = (
+        ("category", "カテゴリ"),
+        ("todo", "Todo"),
+    )
+
+    type = forms.ChoiceField(choices=TYPE_CHOICES)
+    id = forms.IntegerField(min_value=1)
+    base_seq = forms.IntegerField(min_value=0, required=False)
@@ -0,0 +1,105 @@
+"""Todo の締め切りを iCalendar (RFC 5545) 形式で書き出す
+
+1 件ずつ VEVENT を組み立てて返すジェネレータなので、件数によらずメモリは一定。
+"""
+
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+
+from main.models import Todo
+
+CONTENT_TYPE = "text/calendar; charset=utf-8"
+PRODID = "-//be_en_todo//todo deadlines//JA"
+
+
+def escape_text(value):
+    return (
+        (value or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold(line):
+    """75 オクテットを超える行を折り返す (マルチバイト文字の途中では切らない)"""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    current = ""
+    limit = 75
+    for char in line:
+        if len((current + char).encode()) > limit:
+            parts.append(current)
+            current = char
+            limit = 74  # 続きの行は先頭に空白が入る
+        else:
+            current += char
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def format_datetime(value):
+    return value.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def feed_rows(user_id, start, end, chunk_size=2000):
+    return (
+        Todo.objects.filter(
+            category__user_id=user_id,
+            deadline_time__gte=start,
+            deadline_time__lt=end,
+        )
+        .order_by("deadline_time", "id")
+        .values_list(
+            "id",
+            "category_id",
+            "title",
+            "description",
+            "deadline_time",
+            "is_finished",
+            "category__name",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def iter_calendar(rows, name, host, url_for=None):
+    """feed_rows() の行を ICS の文字列の断片にして返す
+
+    url_for を渡すと (category_id, todo_id) から詳細画面の URL を作って URL 欄に入れる。
+    """
+    stamp = format_datetime(timezone.now())
+    yield "".join(
+        fold(line)
+        for line in (
+            "BEGIN:VCALENDAR",
+            "VERSION:2.0",
+            f"PRODID:{PRODID}",
+            "CALSCALE:GREGORIAN",
+            "METHOD:PUBLISH",
+            f"X-WR-CALNAME:{escape_text(name)}",
+        )
+    )
+    for row in rows:
+        todo_id, category_id, title, description, deadline, is_finished, category = row
+        summary = f"[完了] {title}" if is_finished else title
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:todo-{todo_id}@{host}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{format_datetime(deadline)}",
+            f"SUMMARY:{escape_text(summary)}",
+            f"CATEGORIES:{escape_text(category)}",
+        ]
+        if description:
+            lines.append(f"DESCRIPTION:{escape_text(description)}")
+        if url_for:
+            lines.append(f"URL:{url_for(category_id, todo_id)}")
+        lines.append("END:VEVENT")
+        yield "".join(fold(line) for line in lines)
+    yield fold("END:VCALENDAR")
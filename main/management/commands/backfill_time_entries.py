@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from main.models import TimeEntry, Todo
+from main.timelog import rebuild_time_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "作業時間の記録がない Todo の所要時間 (hour_spent) から記録を作り、"
+        "日別・週別の集計を作り直す"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="対象ユーザーID (複数指定可。省略時は全ユーザー)",
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--rebuild-only",
+            action="store_true",
+            help="記録は作らず、集計だけを作り直す",
+        )
+
+    def handle(self, *args, **options):
+        users = options["users"]
+        if not options["rebuild_only"]:
+            created = self.backfill(users, options["batch_size"])
+            self.stdout.write(f"created {created} time entries")
+        daily, weekly = rebuild_time_rollups(users)
+        self.stdout.write(f"rebuilt {daily} daily, {weekly} weekly rollups")
+
+    def backfill(self, users, batch_size):
+        todos = Todo.objects.exclude(hour_spent=0).filter(
+            ~Exists(TimeEntry.objects.filter(todo=OuterRef("pk")))
+        )
+        if users is not None:
+            todos = todos.filter(category__user__in=users)
+        today = timezone.localdate()
+        created = 0
+        last_id = 0
+        while True:
+            batch = list(
+                todos.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "category_id", "hour_spent", "deadline_time")[
+                    :batch_size
+                ]
+            )
+            if not batch:
+                return created
+            # いつ作業したかは分からないので、締め切り日 (未来なら今日) の作業とみなす
+            entries = [
+                TimeEntry(
+                    todo_id=todo_id,
+                    category_id=category_id,
+                    hours=hours,
+                    spent_on=min(timezone.localdate(deadline), today),
+                )
+                for todo_id, category_id, hours, deadline in batch
+            ]
+            # シグナルを通さずに入れ、集計は最後にまとめて作り直す
+            with transaction.atomic():
+                TimeEntry.objects.bulk_create(entries)
+            created += len(entries)
+            last_id = batch[-1][0]
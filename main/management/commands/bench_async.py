@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+from types import ModuleType
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+from django.urls import include, path, reverse
+
+from main.benchmarking import ensure_bench_user, latency_summary
+from main.models import Category
+from main.urls import build_urlpatterns
+
+
+def bench_urlconf(use_async):
+    """同期版/非同期版の読み取りビューを使う ROOT_URLCONF 用のモジュールを作る"""
+    urlconf = ModuleType(f"bench_urlconf_{'async' if use_async else 'sync'}")
+    urlconf.urlpatterns = [path("", include(build_urlpatterns(use_async)))]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = (
+        "ASGI ハンドラ経由で読み取り画面を同時に叩き、"
+        "同期ビューと非同期ビューのスループットと p99 を比べる"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--username", default="bench_async")
+
+    def handle(self, *args, **options):
+        user = ensure_bench_user(options["username"])
+        category_id = Category.objects.filter(user=user).values_list(
+            "id", flat=True
+        )[0]
+        report = {}
+        for mode in ("sync", "async"):
+            with override_settings(
+                ROOT_URLCONF=bench_urlconf(mode == "async"),
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            ):
+                urls = [
+                    reverse("home"),
+                    reverse("todo_list", kwargs={"category_id": category_id}),
+                    reverse("calendar"),
+                    reverse("mypage_chart"),
+                ]
+                report[mode] = asyncio.run(self.run_mode(user, urls, options))
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run_mode(self, user, urls, options):
+        queue = asyncio.Queue()
+        for i in range(options["requests"]):
+            queue.put_nowait(urls[i % len(urls)])
+        latencies = []
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            client = AsyncClient()
+            await client.aforce_login(user)
+            while not queue.empty():
+                url = queue.get_nowait()
+                started = time.monotonic()
+                response = await client.get(url)
+                latencies.append(time.monotonic() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker() for _ in range(options["concurrency"])))
+        elapsed = time.monotonic() - started
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "seconds": round(elapsed, 2),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            **latency_summary(latencies),
+        }
@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from main.benchmarking import bench_routes
+from main.management.commands.bench_routes import Command as BenchRoutesCommand
+
+DEFAULT_MIDDLEWARE = "django.contrib.auth.middleware.AuthenticationMiddleware"
+CACHED_MIDDLEWARE = "main.auth.CachedAuthenticationMiddleware"
+
+
+class Command(BaseCommand):
+    help = (
+        "DB のセッション + AuthenticationMiddleware (変更前) と今の設定 (変更後) で "
+        "全 URL を叩き、1 リクエストあたりのクエリ数を比べる"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username", help="計測に使う既存ユーザー (seed_data で作ったもの)"
+        )
+        parser.add_argument("--categories", type=int, default=5)
+        parser.add_argument("--todos", type=int, default=200, help="1 カテゴリあたり")
+        parser.add_argument("--iterations", type=int, default=5)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--output", help="結果の JSON を書き出すファイル")
+
+    def handle(self, *args, **options):
+        user = BenchRoutesCommand().get_user(options)
+        middleware = [
+            name
+            for name in settings.MIDDLEWARE
+            if name != "main.middleware.QueryBudgetMiddleware"
+        ]
+        before_middleware = [
+            DEFAULT_MIDDLEWARE if name == CACHED_MIDDLEWARE else name
+            for name in middleware
+        ]
+        bench = {"iterations": options["iterations"], "warmup": options["warmup"]}
+        with override_settings(
+            MIDDLEWARE=before_middleware,
+            SESSION_ENGINE="django.contrib.sessions.backends.db",
+        ):
+            before = bench_routes(user, **bench)
+        with override_settings(MIDDLEWARE=middleware):
+            after = bench_routes(user, **bench)
+
+        routes = {
+            url: {
+                "name": result["name"],
+                "before": before[url]["queries"],
+                "after": result["queries"],
+            }
+            for url, result in after.items()
+        }
+        report = {
+            "session_engine": settings.SESSION_ENGINE,
+            "routes": routes,
+            "total": {
+                "before": sum(route["before"] for route in routes.values()),
+                "after": sum(route["after"] for route in routes.values()),
+            },
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n", encoding="utf-8")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,105 @@
+import json
+import platform
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from main.benchmarking import (
+    bench_routes,
+    compare_reports,
+    is_bench_username,
+    seed_users,
+)
+from main import user_cache
+from main.models import Todo, User
+
+
+class Command(BaseCommand):
+    help = (
+        "main/urls.py の全 URL をテストクライアントで叩き、"
+        "p50/p95/p99・クエリ数・レスポンスサイズを JSON で出力する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username", help="計測に使う既存ユーザー (seed_data で作ったもの)"
+        )
+        parser.add_argument("--categories", type=int, default=5)
+        parser.add_argument("--todos", type=int, default=200, help="1 カテゴリあたり")
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--output", help="結果の JSON を書き出すファイル")
+        parser.add_argument(
+            "--baseline", help="比較対象の JSON。悪化した URL があれば失敗扱いにする"
+        )
+        parser.add_argument(
+            "--tolerance", type=float, default=0.2, help="p95 の悪化を許す割合"
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options)
+        # ログ出力やクエリ数チェックのミドルウェアで計測がぶれないようにする
+        middleware = [
+            name
+            for name in settings.MIDDLEWARE
+            if name != "main.middleware.QueryBudgetMiddleware"
+        ]
+        user_cache.reset_stats()
+        with override_settings(MIDDLEWARE=middleware):
+            routes = bench_routes(
+                user, iterations=options["iterations"], warmup=options["warmup"]
+            )
+        report = {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": settings.DATABASES["default"]["ENGINE"],
+                "categories": user.categories.count(),
+                "todos": Todo.objects.filter(category__user=user).count(),
+                "iterations": options["iterations"],
+            },
+            "routes": routes,
+            # ユーザーごとのキャッシュのヒット・ミスの回数 (ウォームアップを含む)
+            "user_cache": user_cache.stats(),
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options["output"]:
+            Path(options["output"]).write_text(output + "\n", encoding="utf-8")
+        else:
+            self.stdout.write(output)
+
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text("utf-8"))
+            regressions = compare_reports(
+                baseline["routes"], routes, tolerance=options["tolerance"]
+            )
+            for url, metric, before, after in regressions:
+                self.stderr.write(f"{url} {metric}: {before} -> {after}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s)")
+
+    def get_user(self, options):
+        if options["username"]:
+            # 全 URL の書き込みを流すので、計測用に作ったユーザー以外は断る
+            if not is_bench_username(options["username"]):
+                raise CommandError(
+                    f"user {options['username']!r} is not a bench user; "
+                    "use one created by seed_data"
+                )
+            try:
+                return User.objects.get(username=options["username"])
+            except User.DoesNotExist:
+                raise CommandError(f"user {options['username']!r} does not exist")
+        # 指定がなければサイズごとの計測用ユーザーを作って使い回す
+        prefix = f"bench_routes_{options['categories']}x{options['todos']}_"
+        user = User.objects.filter(username=f"{prefix}0").first()
+        if user is None:
+            [user] = seed_users(
+                1, options["categories"], options["todos"], prefix=prefix
+            )
+        return user
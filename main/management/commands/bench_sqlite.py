@@ -0,0 +1,160 @@
+import json
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.urls import reverse
+from django.utils import timezone
+
+from main.benchmarking import bench_client, ensure_bench_user, latency_summary
+from main.models import Category, Todo
+
+WRITE_STATEMENTS = ("BEGIN", "INSERT", "UPDATE", "DELETE")
+
+
+class ThreadStats:
+    def __init__(self):
+        self.latencies = []
+        self.requests = {"read": 0, "write": 0}
+        self.errors = 0
+        self.lock_errors = 0
+        self.lock_waits = 0
+
+
+class Command(BaseCommand):
+    help = (
+        "複数スレッドから Todo の画面に読み書きを混ぜて投げ、"
+        "スループットとロック待ち回数を計測する (設定中の DB にデータを書き込む)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=10.0)
+        parser.add_argument(
+            "--write-ratio", type=float, default=0.2, help="書き込みリクエストの割合"
+        )
+        parser.add_argument(
+            "--wait-threshold-ms",
+            type=float,
+            default=50.0,
+            help="書き込み文がこれより長くかかったらロック待ちとして数える",
+        )
+        parser.add_argument("--username", default="bench_sqlite")
+
+    def handle(self, *args, **options):
+        # ロックエラーは集計するのでリクエストごとのトレースバックは出さない
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        user = ensure_bench_user(options["username"])
+        category_ids = list(
+            Category.objects.filter(user=user).values_list("id", flat=True)
+        )
+        self.todo_ids = list(
+            Todo.objects.filter(category__user=user).values_list("id", flat=True)[:2000]
+        )
+        deadline = time.monotonic() + options["seconds"]
+        stats = [ThreadStats() for _ in range(options["threads"])]
+        threads = [
+            threading.Thread(
+                target=self.worker,
+                args=(user, category_ids, deadline, s, options),
+            )
+            for s in stats
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        latencies = [value for s in stats for value in s.latencies]
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ("journal_mode", "synchronous", "busy_timeout"):
+                cursor.execute(f"PRAGMA {name}")
+                pragmas[name] = cursor.fetchone()[0]
+        report = {
+            "profile": "production"
+            if settings.DATABASES["default"].get("OPTIONS")
+            else "default",
+            "pragmas": pragmas,
+            "threads": options["threads"],
+            "seconds": round(elapsed, 2),
+            "reads": sum(s.requests["read"] for s in stats),
+            "writes": sum(s.requests["write"] for s in stats),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "errors": sum(s.errors for s in stats),
+            "lock_errors": sum(s.lock_errors for s in stats),
+            "lock_waits": sum(s.lock_waits for s in stats),
+            **latency_summary(latencies),
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def worker(self, user, category_ids, deadline, stats, options):
+        client = bench_client(user)
+        threshold = options["wait_threshold_ms"] / 1000
+        rng = random.Random()
+
+        def count_lock_waits(execute, sql, params, many, context):
+            started = time.monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                if (
+                    sql.lstrip().upper().startswith(WRITE_STATEMENTS)
+                    and time.monotonic() - started > threshold
+                ):
+                    stats.lock_waits += 1
+
+        try:
+            with connection.execute_wrapper(count_lock_waits):
+                while time.monotonic() < deadline:
+                    category_id = rng.choice(category_ids)
+                    kind = "write" if rng.random() < options["write_ratio"] else "read"
+                    started = time.monotonic()
+                    try:
+                        if kind == "write":
+                            response = self.write(client, rng, category_id)
+                        else:
+                            response = self.read(client, rng, category_id)
+                        if response.status_code >= 400:
+                            stats.errors += 1
+                    except OperationalError as e:
+                        stats.errors += 1
+                        if "locked" in str(e):
+                            stats.lock_errors += 1
+                    stats.latencies.append(time.monotonic() - started)
+                    stats.requests[kind] += 1
+        finally:
+            connections.close_all()
+
+    def read(self, client, rng, category_id):
+        url = rng.choice(
+            (
+                reverse("home"),
+                reverse("todo_list", kwargs={"category_id": category_id}),
+                reverse("calendar"),
+            )
+        )
+        return client.get(url)
+
+    def write(self, client, rng, category_id):
+        if rng.random() < 0.5:
+            return client.post(
+                reverse("todo_create", kwargs={"category_id": category_id}),
+                {
+                    "title": "bench",
+                    "deadline_time": timezone.localtime().strftime("%Y-%m-%dT%H:%M"),
+                },
+            )
+        return client.post(
+            reverse("todo_bulk", kwargs={"category_id": category_id}),
+            {
+                "todo_ids": rng.sample(self.todo_ids, min(20, len(self.todo_ids))),
+                "action": rng.choice(("finish", "reopen")),
+            },
+        )
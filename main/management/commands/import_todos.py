@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main import transfer
+from main.models import User
+
+
+class Command(BaseCommand):
+    help = "CSV / JSON Lines から指定ユーザーのカテゴリと Todo を一括で取り込む"
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("path", type=Path)
+        parser.add_argument(
+            "--format",
+            choices=(transfer.FORMAT_CSV, transfer.FORMAT_JSONL),
+            help="省略時は拡張子から判定する",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"user {options['username']!r} does not exist")
+
+        path = options["path"]
+        format = options["format"] or (
+            transfer.FORMAT_CSV if path.suffix == ".csv" else transfer.FORMAT_JSONL
+        )
+        with path.open("rb") as f:
+            rows = transfer.read_rows(transfer.text_stream(f), format)
+            result = transfer.import_rows(
+                user, rows, batch_size=options["batch_size"]
+            )
+
+        for line, message in result.errors:
+            self.stderr.write(f"line {line}: {message}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"created {result.categories_created} categories, "
+                f"{result.todos_created} todos ({len(result.errors)} rows skipped)"
+            )
+        )
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main import purge
+
+
+class Command(BaseCommand):
+    help = (
+        "削除待ちのカテゴリ・Todo を、--chunk-size 件ずつ別々のトランザクションで消す "
+        "(--interval を付けるとその秒数ごとに繰り返す)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=purge.DEFAULT_CHUNK_SIZE,
+            help="1 回のトランザクションで消す Todo の上限",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            help="1 回消すごとにこの秒数だけ休み、ほかの書き込みに譲る",
+        )
+        parser.add_argument(
+            "--interval", type=float, help="消し終えたらこの秒数ごとに見直し続ける"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            todos = categories = chunks = 0
+            while True:
+                purged_todos, purged_categories = purge.purge_chunk(
+                    options["chunk_size"]
+                )
+                if not purged_todos and not purged_categories:
+                    break
+                todos += purged_todos
+                categories += purged_categories
+                chunks += 1
+                time.sleep(options["pause"])
+            self.stdout.write(
+                f"purged {todos} todos and {categories} categories "
+                f"in {chunks} chunks ({time.perf_counter() - started:.3f}s)"
+            )
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
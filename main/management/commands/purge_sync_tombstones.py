@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main import changelog
+
+
+class Command(BaseCommand):
+    help = (
+        "差分同期の削除の記録のうち古いものを消す "
+        "(それより前のカーソルを持つクライアントは全件を取り直す)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=90, help="この日数より前の記録を消す"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["days"])
+        purged = changelog.purge_tombstones(before, batch_size=options["batch_size"])
+        self.stdout.write(f"purged {purged} tombstones")
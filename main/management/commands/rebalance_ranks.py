@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main import ranking, rollups, user_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "手動の並び順のキーが長くなったカテゴリと、順位が未設定の Todo がある"
+        "カテゴリに、今の並び順のままキーを振り直す"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-length",
+            type=int,
+            default=ranking.REBALANCE_LENGTH,
+            help="この長さを超えるキーがあれば振り直す",
+        )
+
+    def handle(self, *args, **options):
+        category_ids = list(ranking.categories_to_rebalance(options["max_length"]))
+        owners = rollups.category_owners(category_ids)
+        for category_id in category_ids:
+            # カテゴリごとにコミットして、書き込みのロックを長く持たない
+            with transaction.atomic():
+                ranking.rebalance(category_id)
+            user_cache.bump_version(owners[category_id])
+        self.stdout.write(f"rebalanced {len(category_ids)} categories")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.rollups import rebuild_rollups, verify_rollups
+
+
+class Command(BaseCommand):
+    help = "カテゴリ・ユーザーごとの所要時間/件数の集計テーブルを再構築・検証する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="users",
+            help="対象ユーザーID (複数指定可。省略時は全ユーザー)",
+        )
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="再構築せず、ずれの有無だけを確認する",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users = options["users"]
+        if not options["verify_only"]:
+            with transaction.atomic():
+                categories, user_count = rebuild_rollups(
+                    users, batch_size=options["batch_size"]
+                )
+            self.stdout.write(
+                f"rebuilt {categories} category rollups, {user_count} user rollups"
+            )
+
+        mismatches = verify_rollups(users)
+        for kind, pk, expected, stored in mismatches:
+            self.stderr.write(f"{kind} {pk}: expected {expected}, stored {stored}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} rollup(s) out of sync")
+        self.stdout.write(self.style.SUCCESS("rollups are in sync"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main import search
+
+
+class Command(BaseCommand):
+    help = "Todo の全文検索の索引 (FTS5) を作り直す・検証する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="作り直さず、索引と Todo の件数が一致するかだけを確認する",
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("full-text search index requires SQLite FTS5")
+        if not options["verify_only"]:
+            count = search.rebuild_index()
+            self.stdout.write(f"indexed {count} todos")
+
+        indexed, todos = search.verify_index()
+        if indexed != todos:
+            raise CommandError(f"index has {indexed} rows for {todos} todos")
@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+
+from main import deadlines
+
+
+class Command(BaseCommand):
+    help = (
+        "期限切れになった・締め切りが近づいた未完了の Todo を定期的に探し、"
+        "ログ・通知テーブル・Webhook に渡すワーカー"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sink",
+            action="append",
+            choices=("log", "db", "webhook"),
+            dest="sinks",
+            help="通知先 (複数指定可。省略時は log)",
+        )
+        parser.add_argument("--webhook-url", help="--sink webhook の送信先")
+        parser.add_argument(
+            "--window-minutes",
+            type=int,
+            default=60,
+            help="この分数以内に締め切りが来るものを「締め切り間近」とする",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=60.0, help="tick の間隔(秒)"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--max-batches", type=int, default=100, help="1 tick で読むバッチ数の上限"
+        )
+        parser.add_argument("--once", action="store_true", help="1 tick だけ実行する")
+
+    def handle(self, *args, **options):
+        sinks = self.build_sinks(options)
+        window = timedelta(minutes=options["window_minutes"])
+        try:
+            while True:
+                close_old_connections()
+                now = timezone.now()
+                for kind in deadlines.KINDS:
+                    count = deadlines.scan(
+                        kind,
+                        sinks,
+                        now=now,
+                        window=window,
+                        batch_size=options["batch_size"],
+                        max_batches=options["max_batches"],
+                    )
+                    if count:
+                        self.stdout.write(f"{now:%Y-%m-%d %H:%M:%S} {kind}: {count}")
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+
+    def build_sinks(self, options):
+        sinks = []
+        for name in options["sinks"] or ["log"]:
+            if name == "log":
+                sinks.append(deadlines.LogSink())
+            elif name == "db":
+                sinks.append(deadlines.NotificationSink())
+            elif name == "webhook":
+                if not options["webhook_url"]:
+                    raise CommandError("--sink webhook requires --webhook-url")
+                sinks.append(deadlines.WebhookSink(options["webhook_url"]))
+        return sinks
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmarking import seed_users
+from main.models import User
+
+
+class Command(BaseCommand):
+    help = "負荷試験用にユーザー・カテゴリ・Todo をまとめて作る"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--categories", type=int, default=5, help="1 ユーザーあたり")
+        parser.add_argument("--todos", type=int, default=200, help="1 カテゴリあたり")
+        parser.add_argument("--prefix", default="seed", help="ユーザー名の接頭辞")
+        parser.add_argument("--password", default="password")
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f"users starting with {prefix!r} already exist; use another --prefix"
+            )
+        started = time.monotonic()
+        users = seed_users(
+            options["users"],
+            options["categories"],
+            options["todos"],
+            prefix=prefix,
+            password=options["password"],
+            batch_size=options["batch_size"],
+            seed=options["seed"],
+        )
+        todos = len(users) * options["categories"] * options["todos"]
+        self.stdout.write(
+            f"created {len(users)} users, {todos} todos "
+            f"in {time.monotonic() - started:.1f}s"
+        )
@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "プライマリの SQLite を読み取り専用レプリカ (REPLICA_DATABASES) に複製する "
+        "(--interval を付けるとその秒数ごとに繰り返す)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, help="この秒数ごとに複製し続ける"
+        )
+        parser.add_argument(
+            "--pages", type=int, default=1024, help="1 回のステップで写すページ数"
+        )
+
+    def handle(self, *args, **options):
+        if not settings.REPLICA_DATABASES:
+            raise CommandError("DJANGO_DB_REPLICAS にレプリカが指定されていません")
+        while True:
+            started = time.perf_counter()
+            for alias in settings.REPLICA_DATABASES:
+                self.copy(alias, options["pages"])
+            self.stdout.write(
+                f"synced {len(settings.REPLICA_DATABASES)} replicas "
+                f"in {time.perf_counter() - started:.3f}s"
+            )
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
+
+    def copy(self, alias, pages):
+        # バックアップ API はページ単位で写すので、途中でもプライマリへの書き込みを
+        # 止めない。書き込まれたら最初から写し直す
+        source = sqlite3.connect(settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"])
+        target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,141 @@
+import cProfile
+import logging
+import random
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from main import profiling
+from main.querybudget import QueryRecorder, get_budget
+
+logger = logging.getLogger(__name__)
+
+
+def wrap_connections(stack, wrapper):
+    """このスレッドのすべての接続に execute_wrapper を付け、stack を閉じると外す
+
+    接続はスレッドごとなので、非同期のリクエストでは ORM が動くスレッドで
+    (sync_to_async で) 呼ぶ。
+    """
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+class AsyncCapableMiddleware:
+    """クエリを数えるミドルウェアの基底。同期・非同期のどちらのチェーンにも入る
+
+    非同期版がないと ASGI ではチェーン全体が SyncToAsync で包まれ、非同期ビューも
+    スレッドで動いてしまう。サブクラスは measuring (execute_wrapper を渡す
+    コンテキストマネージャ) と end (レスポンスの仕上げ) を実装する。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with self.measuring(request) as wrapper, ExitStack() as stack:
+            wrap_connections(stack, wrapper)
+            response = self.get_response(request)
+        return self.end(request, response)
+
+    async def __acall__(self, request):
+        with self.measuring(request) as wrapper:
+            stack = ExitStack()
+            await sync_to_async(wrap_connections)(stack, wrapper)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        return self.end(request, response)
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+    """開発用: リクエストごとのクエリ数を数え、上限超えや同じクエリの繰り返しを警告する
+
+    StreamingHttpResponse の中身を返す間のクエリは数えない。
+    """
+
+    @contextmanager
+    def measuring(self, request):
+        request._query_recorder = QueryRecorder()
+        yield request._query_recorder
+
+    def end(self, request, response):
+        recorder = request._query_recorder
+        match = request.resolver_match
+        url_name = match.url_name if match else None
+        budget = get_budget(url_name, request.method)
+        response["X-Query-Count"] = str(recorder.count)
+        if budget is not None and recorder.count > budget:
+            logger.warning(
+                "%s %s (%s) ran %d queries, over its budget of %d\n%s",
+                request.method,
+                request.path,
+                url_name,
+                recorder.count,
+                budget,
+                recorder.report(),
+            )
+        elif recorder.duplicates():
+            logger.warning(
+                "%s %s (%s) repeated queries\n%s",
+                request.method,
+                request.path,
+                url_name,
+                recorder.report(),
+            )
+        return response
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """リクエストの時間の内訳を Server-Timing ヘッダーで返す (main/profiling.py)
+
+    PROFILE_SAMPLE_RATE の割合で cProfile を取り、PROFILE_SLOW_MS を超えた
+    リクエストはスタックのサンプリング結果を PROFILE_DIR に残す。非同期の
+    リクエストはイベントループのスレッドで並行して動き、プロファイルもスタックも
+    ほかのリクエストと混ざるので、Server-Timing だけを返す。
+    """
+
+    @contextmanager
+    def measuring(self, request):
+        profiler = None
+        if not self.async_mode and random.random() < settings.PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        samples = None
+        if profiler is None and not self.async_mode and settings.PROFILE_SLOW_MS > 0:
+            samples = profiling.get_sampler().watch()
+        timings = profiling.Timings(
+            record_sql=profiler is not None or samples is not None
+        )
+        request._timing = (timings, profiler, samples)
+        try:
+            with profiling.measure(timings):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield timings
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            if samples is not None:
+                profiling.get_sampler().unwatch(samples)
+
+    def end(self, request, response):
+        timings, profiler, samples = request._timing
+        timings.finish()
+        response["Server-Timing"] = timings.header()
+        slow = timings.total * 1000 >= settings.PROFILE_SLOW_MS
+        if profiler is not None or (samples is not None and slow):
+            profiling.write_profile(request, timings, profiler, samples)
+        return response
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_rollups(apps, schema_editor):
+    Category = apps.get_model('main', 'Category')
+    CategoryRollup = apps.get_model('main', 'CategoryRollup')
+    User = apps.get_model('main', 'User')
+    UserRollup = apps.get_model('main', 'UserRollup')
+
+    def annotations(prefix):
+        return {
+            'sum_hours': Coalesce(Sum(f'{prefix}hour_spent'), 0),
+            'sum_finished': Count(f'{prefix}id', filter=Q(**{f'{prefix}is_finished': True})),
+            'sum_unfinished': Count(f'{prefix}id', filter=Q(**{f'{prefix}is_finished': False})),
+        }
+
+    CategoryRollup.objects.bulk_create(
+        [
+            CategoryRollup(category_id=pk, total_hours=hours, finished_count=finished, unfinished_count=unfinished)
+            for pk, hours, finished, unfinished in Category.objects.annotate(**annotations('todos__')).values_list(
+                'id', 'sum_hours', 'sum_finished', 'sum_unfinished'
+            )
+        ],
+        batch_size=1000,
+    )
+    UserRollup.objects.bulk_create(
+        [
+            UserRollup(user_id=pk, total_hours=hours, finished_count=finished, unfinished_count=unfinished)
+            for pk, hours, finished, unfinished in User.objects.annotate(**annotations('categories__todos__')).values_list(
+                'id', 'sum_hours', 'sum_finished', 'sum_unfinished'
+            )
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_remove_todo_rank_range_check_remove_todo_parent_todo_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRollup',
+            fields=[
+                ('total_hours', models.IntegerField(default=0, verbose_name='合計所要時間数(h)')),
+                ('finished_count', models.IntegerField(default=0, verbose_name='完了済み件数')),
+                ('unfinished_count', models.IntegerField(default=0, verbose_name='未完了件数')),
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='main.category')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='UserRollup',
+            fields=[
+                ('total_hours', models.IntegerField(default=0, verbose_name='合計所要時間数(h)')),
+                ('finished_count', models.IntegerField(default=0, verbose_name='完了済み件数')),
+                ('unfinished_count', models.IntegerField(default=0, verbose_name='未完了件数')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='todo_rollup', serialize=False, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_todo_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['category', 'deadline_time', 'is_finished'], name='todo_category_deadline_idx'),
+        ),
+    ]
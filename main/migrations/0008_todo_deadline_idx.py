@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_todo_category_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['deadline_time', 'is_finished'], name='todo_deadline_idx'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+
+OWNER = "'[' || (SELECT user_id FROM main_category WHERE id = {row}.category_id) || ']'"
+
+# SQLite で main_todo / main_category を作り直すマイグレーション (NOT NULL の列の
+# 追加など) ではトリガーが消えるので、そのマイグレーションからも使う
+TRIGGERS_SQL = [
+    f"""
+    CREATE TRIGGER main_todo_fts_insert AFTER INSERT ON main_todo BEGIN
+        INSERT INTO main_todo_fts (rowid, title, description, owner)
+        VALUES (new.id, new.title, COALESCE(new.description, ''),
+                {OWNER.format(row="new")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER main_todo_fts_update
+    AFTER UPDATE OF title, description, category_id ON main_todo BEGIN
+        UPDATE main_todo_fts
+        SET title = new.title,
+            description = COALESCE(new.description, ''),
+            owner = {OWNER.format(row="new")}
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER main_todo_fts_delete AFTER DELETE ON main_todo BEGIN
+        DELETE FROM main_todo_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER main_category_fts_owner AFTER UPDATE OF user_id ON main_category
+    BEGIN
+        UPDATE main_todo_fts SET owner = '[' || new.user_id || ']'
+        WHERE rowid IN (SELECT id FROM main_todo WHERE category_id = new.id);
+    END
+    """,
+]
+
+DROP_TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS main_category_fts_owner",
+    "DROP TRIGGER IF EXISTS main_todo_fts_delete",
+    "DROP TRIGGER IF EXISTS main_todo_fts_update",
+    "DROP TRIGGER IF EXISTS main_todo_fts_insert",
+]
+
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE main_todo_fts USING fts5(
+        title, description, owner, tokenize = 'trigram'
+    )
+    """,
+    *TRIGGERS_SQL,
+    """
+    INSERT INTO main_todo_fts (rowid, title, description, owner)
+    SELECT t.id, t.title, COALESCE(t.description, ''), '[' || c.user_id || ']'
+    FROM main_todo t JOIN main_category c ON c.id = t.category_id
+    """,
+]
+
+DROP_SQL = [
+    *DROP_TRIGGERS_SQL,
+    "DROP TABLE IF EXISTS main_todo_fts",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        # FTS5 は SQLite 専用。他の DB では main.search が部分一致検索で代用する
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0008_todo_deadline_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
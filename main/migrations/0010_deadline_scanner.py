@@ -0,0 +1,45 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_todo_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadlineNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('overdue', '期限切れ'), ('upcoming', '締め切り間近')], max_length=10, verbose_name='種類')),
+                ('deadline_time', models.DateTimeField(verbose_name='締め切り日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeadlineScanState',
+            fields=[
+                ('name', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('high_water_time', models.DateTimeField()),
+                ('high_water_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['is_finished', 'deadline_time'], name='todo_status_deadline_idx'),
+        ),
+        migrations.AddField(
+            model_name='deadlinenotification',
+            name='todo',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deadline_notifications', to='main.todo'),
+        ),
+        migrations.AddConstraint(
+            model_name='deadlinenotification',
+            constraint=models.UniqueConstraint(fields=('todo', 'kind', 'deadline_time'), name='deadline_notification_unique'),
+        ),
+    ]
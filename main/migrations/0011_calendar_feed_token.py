@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:22
+
+import django.db.models.deletion
+import main.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_deadline_scanner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarFeedToken',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_token', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('token', models.CharField(default=main.models.new_feed_token, max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
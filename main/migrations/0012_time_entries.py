@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_calendar_feed_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimeEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.IntegerField(verbose_name='時間数(h)')),
+                ('spent_on', models.DateField(verbose_name='作業日')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_entries', to='main.category')),
+                ('todo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_entries', to='main.todo')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyTimeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.IntegerField(default=0, verbose_name='時間数(h)')),
+                ('day', models.DateField(verbose_name='日付')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'day'], name='daily_time_rollup_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('category', 'day'), name='daily_time_rollup_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='WeeklyTimeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hours', models.IntegerField(default=0, verbose_name='時間数(h)')),
+                ('week_start', models.DateField(verbose_name='週の初日 (月曜)')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'week_start'], name='weekly_time_rollup_user_idx')],
+                'constraints': [models.UniqueConstraint(fields=('category', 'week_start'), name='weekly_time_rollup_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:32
+
+import importlib
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+fts = importlib.import_module("main.migrations.0009_todo_fts")
+
+# NOT NULL の列を足すと SQLite は main_category / main_todo を作り直す。
+# 全文検索のトリガーが残っているとテーブルの差し替えに失敗し、差し替えた後は
+# トリガーが消えているので、前後で外して張り直す (戻すときも同じ)
+drop_fts_triggers = fts.run(fts.DROP_TRIGGERS_SQL)
+create_fts_triggers = fts.run(fts.TRIGGERS_SQL)
+
+
+def create_sync_states(apps, schema_editor):
+    User = apps.get_model("main", "User")
+    SyncState = apps.get_model("main", "SyncState")
+    SyncState.objects.bulk_create(
+        [SyncState(user_id=pk) for pk in User.objects.values_list("pk", flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_time_entries'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_triggers, create_fts_triggers),
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seq', models.BigIntegerField(default=0)),
+                ('purged_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('category', 'カテゴリ'), ('todo', 'Todo')], max_length=10, verbose_name='種類')),
+                ('object_id', models.BigIntegerField(verbose_name='削除した行の ID')),
+                ('sync_seq', models.BigIntegerField(verbose_name='同期番号')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='sync_seq',
+            field=models.BigIntegerField(default=0, verbose_name='同期番号'),
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='sync_seq',
+            field=models.BigIntegerField(default=0, verbose_name='同期番号'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['user', 'sync_seq'], name='category_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['category', 'sync_seq'], name='todo_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='synctombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='synctombstone',
+            index=models.Index(fields=['user', 'sync_seq'], name='sync_tombstone_idx'),
+        ),
+        migrations.RunPython(create_fts_triggers, drop_fts_triggers),
+        migrations.RunPython(create_sync_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:45
+
+import importlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+fts = importlib.import_module("main.migrations.0009_todo_fts")
+
+# path (NOT NULL) を足すと main_todo が作り直されるので、全文検索のトリガーを
+# 前後で外して張り直す (0013_sync と同じ)
+drop_fts_triggers = fts.run(fts.DROP_TRIGGERS_SQL)
+create_fts_triggers = fts.run(fts.TRIGGERS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_triggers, create_fts_triggers),
+        migrations.AddField(
+            model_name='todo',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='main.todo', verbose_name='親タスク'),
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255, verbose_name='階層パス'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['path'], name='todo_path_idx'),
+        ),
+        migrations.RunPython(create_fts_triggers, drop_fts_triggers),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:49
+
+import importlib
+
+from django.db import migrations, models
+
+fts = importlib.import_module("main.migrations.0009_todo_fts")
+
+# rank (NOT NULL) を足すと main_todo が作り直されるので、全文検索のトリガーを
+# 前後で外して張り直す (0013_sync と同じ)。既存の行の rank は空文字列のままで、
+# rebalance_ranks コマンドが今の並び順 (ID 順) でキーを振る
+drop_fts_triggers = fts.run(fts.DROP_TRIGGERS_SQL)
+create_fts_triggers = fts.run(fts.TRIGGERS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_todo_tree'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_triggers, create_fts_triggers),
+        migrations.AddField(
+            model_name='todo',
+            name='rank',
+            field=models.CharField(default='', editable=False, max_length=64, verbose_name='並び順'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['category', 'rank'], name='todo_category_rank_idx'),
+        ),
+        migrations.RunPython(create_fts_triggers, drop_fts_triggers),
+    ]
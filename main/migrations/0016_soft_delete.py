@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 14:01
+
+import importlib
+
+from django.db import migrations, models
+
+fts = importlib.import_module("main.migrations.0009_todo_fts")
+
+# is_deleted (NOT NULL) を足すと main_category と main_todo が作り直されるので、
+# 全文検索のトリガーを前後で外して張り直す (0013_sync と同じ)
+drop_fts_triggers = fts.run(fts.DROP_TRIGGERS_SQL)
+create_fts_triggers = fts.run(fts.TRIGGERS_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_todo_rank'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_fts_triggers, create_fts_triggers),
+        migrations.AddField(
+            model_name='category',
+            name='is_deleted',
+            field=models.BooleanField(default=False, editable=False, verbose_name='削除待ち'),
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='is_deleted',
+            field=models.BooleanField(default=False, editable=False, verbose_name='削除待ち'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['id'], name='category_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['id'], name='todo_pending_idx'),
+        ),
+        migrations.RunPython(create_fts_triggers, drop_fts_triggers),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-18 14:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['category', 'deadline_time', 'id'], name='todo_category_deadline_id_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+def mark_pending_category_todos(apps, schema_editor):
+    # Todo.objects はカテゴリを結合しなくなったので、削除待ちのカテゴリにある
+    # Todo にも is_deleted を立てておく
+    Todo = apps.get_model("main", "Todo")
+    Todo._base_manager.filter(category__is_deleted=True, is_deleted=False).update(
+        is_deleted=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_todo_category_deadline_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_pending_category_todos, migrations.RunPython.noop),
+    ]
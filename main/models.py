@@ -1,14 +1,48 @@
+import secrets
+
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
 
 
 class User(AbstractUser):
     pass
 
 
+class LiveManager(models.Manager):
+    """削除待ち (purge_deleted コマンドが消す前) の行を除く既定のマネージャー
+
+    関連からたどる user.categories・category.todos もこれを使う。削除待ちの行も
+    読むときは all_objects を使う。カテゴリを削除待ちにするときは Todo にも
+    is_deleted を立てるので、Todo の読み込みでカテゴリを結合する必要はない。
+    """
+
+    live_filter = {"is_deleted": False}
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**self.live_filter)
+
+
 class Category(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="categories")
     name = models.CharField("カテゴリ名", max_length=50)
+    sync_seq = models.BigIntegerField("同期番号", default=0)
+    # 削除待ち。行と Todo は purge_deleted コマンドが後から消す (main/purge.py)
+    is_deleted = models.BooleanField("削除待ち", default=False, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # 差分同期: ユーザーのカテゴリをカーソル以降の同期番号から読む
+            models.Index(fields=["user", "sync_seq"], name="category_sync_idx"),
+            # purge_deleted: 削除待ちのカテゴリだけを載せる部分インデックス
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_deleted=True),
+                name="category_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,6 +57,262 @@ class Todo(models.Model):
     deadline_time = models.DateTimeField("締め切り日時")
     hour_spent = models.IntegerField("所要時間数(h)", default=0)
     is_finished = models.BooleanField("完了済み", default=False)
+    sync_seq = models.BigIntegerField("同期番号", default=0)
+    # サブタスクの階層。path は祖先の ID を根から順に並べたもの (main/tree.py)
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        related_name="children",
+        verbose_name="親タスク",
+        blank=True,
+        null=True,
+    )
+    path = models.CharField("階層パス", max_length=255, default="", editable=False)
+    # カテゴリ内の手動の並び順 (main/ranking.py)
+    rank = models.CharField("並び順", max_length=64, default="", editable=False)
+    # 削除待ち。行は purge_deleted コマンドが後から消す (main/purge.py)
+    is_deleted = models.BooleanField("削除待ち", default=False, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # カレンダーの日別件数: カテゴリごとの締め切り範囲スキャン
+            models.Index(
+                fields=["category", "deadline_time", "is_finished"],
+                name="todo_category_deadline_idx",
+            ),
+            # Todo 一覧の締め切り順の並び (キーセットページングのカーソルで途中から読む)
+            models.Index(
+                fields=["category", "deadline_time", "id"],
+                name="todo_category_deadline_id_idx",
+            ),
+            # Todo 一覧の状態絞り込み・「未完了を先に」の並び
+            models.Index(
+                fields=["category", "is_finished", "deadline_time"],
+                name="todo_category_status_idx",
+            ),
+            # 管理画面の日付ドリルダウン・完了状態での絞り込み (カテゴリをまたぐ)
+            models.Index(
+                fields=["deadline_time", "is_finished"],
+                name="todo_deadline_idx",
+            ),
+            # 締め切りスキャナ: 未完了の Todo を締め切り順に読む (インデックスだけで済む)
+            models.Index(
+                fields=["is_finished", "deadline_time"],
+                name="todo_status_deadline_idx",
+            ),
+            # 差分同期: カテゴリごとにカーソル以降の同期番号を範囲で読む
+            models.Index(fields=["category", "sync_seq"], name="todo_sync_idx"),
+            # 手動の並び順の一覧・並べ替えの隣の行の読み込み
+            models.Index(fields=["category", "rank"], name="todo_category_rank_idx"),
+            # サブタスク: 部分木をパスの範囲で読む
+            models.Index(fields=["path"], name="todo_path_idx"),
+            # purge_deleted: 削除待ちの Todo だけを載せる部分インデックス
+            models.Index(
+                fields=["id"],
+                condition=models.Q(is_deleted=True),
+                name="todo_pending_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.category.name})"
+
+    def save(self, *args, **kwargs):
+        # 集計テーブルの更新をシグナル内で同じトランザクションに載せる
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
+
+
+class TodoRollup(models.Model):
+    total_hours = models.IntegerField("合計所要時間数(h)", default=0)
+    finished_count = models.IntegerField("完了済み件数", default=0)
+    unfinished_count = models.IntegerField("未完了件数", default=0)
+
+    class Meta:
+        abstract = True
+
+
+class CategoryRollup(TodoRollup):
+    category = models.OneToOneField(
+        Category, on_delete=models.CASCADE, primary_key=True, related_name="rollup"
+    )
+
+    def __str__(self):
+        return f"{self.category_id}: {self.total_hours}h"
+
+
+class UserRollup(TodoRollup):
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="todo_rollup"
+    )
+
+    def __str__(self):
+        return f"{self.user_id}: {self.total_hours}h"
+
+
+class DeadlineScanState(models.Model):
+    """締め切りスキャナがどこまで読んだか (締め切り日時, Todo の ID)"""
+
+    name = models.CharField(max_length=20, primary_key=True)
+    high_water_time = models.DateTimeField()
+    high_water_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.high_water_time} #{self.high_water_id}"
+
+
+class DeadlineNotification(models.Model):
+    KIND_CHOICES = (
+        ("overdue", "期限切れ"),
+        ("upcoming", "締め切り間近"),
+    )
+
+    todo = models.ForeignKey(
+        Todo, on_delete=models.CASCADE, related_name="deadline_notifications"
+    )
+    kind = models.CharField("種類", max_length=10, choices=KIND_CHOICES)
+    deadline_time = models.DateTimeField("締め切り日時")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # スキャナが同じ範囲を読み直しても通知が重複しないようにする
+            models.UniqueConstraint(
+                fields=["todo", "kind", "deadline_time"],
+                name="deadline_notification_unique",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.todo_id} {self.kind} {self.deadline_time}"
+
+
+def new_feed_token():
+    return secrets.token_urlsafe(32)
+
+
+class CalendarFeedToken(models.Model):
+    """カレンダーアプリから ICS フィードを読むための、ユーザーごとの秘密のトークン"""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="feed_token"
+    )
+    token = models.CharField(max_length=64, unique=True, default=new_feed_token)
+    created_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.token[:8]}…"
+
+
+class TimeEntry(models.Model):
+    """Todo に費やした時間の記録 (追記のみ)
+
+    category は記録した時点の Todo のカテゴリ。集計テーブルはこれを使うので、
+    後で Todo を別のカテゴリに移しても過去の記録の集計先は変わらない。
+    """
+
+    todo = models.ForeignKey(
+        Todo, on_delete=models.CASCADE, related_name="time_entries"
+    )
+    category = models.ForeignKey(
+        Category, on_delete=models.CASCADE, related_name="time_entries"
+    )
+    hours = models.IntegerField("時間数(h)")
+    spent_on = models.DateField("作業日")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.todo_id}: {self.hours}h ({self.spent_on})"
+
+
+class PeriodTimeRollup(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="+")
+    hours = models.IntegerField("時間数(h)", default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailyTimeRollup(PeriodTimeRollup):
+    day = models.DateField("日付")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["category", "day"], name="daily_time_rollup_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "day"], name="daily_time_rollup_user_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} {self.day}: {self.hours}h"
+
+
+class WeeklyTimeRollup(PeriodTimeRollup):
+    week_start = models.DateField("週の初日 (月曜)")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["category", "week_start"], name="weekly_time_rollup_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "week_start"], name="weekly_time_rollup_user_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.category_id} {self.week_start}〜: {self.hours}h"
+
+
+class SyncState(models.Model):
+    """ユーザーごとの同期番号の払い出し状況
+
+    last_seq は最後に払い出した番号、purged_seq は消した削除の記録の最大の番号。
+    purged_seq より前のカーソルでは削除を取りこぼすので使えない。
+    """
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="sync_state"
+    )
+    last_seq = models.BigIntegerField(default=0)
+    purged_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.last_seq}"
+
+
+class SyncTombstone(models.Model):
+    """差分同期で削除を伝えるための、消した Category / Todo の記録"""
+
+    KIND_CHOICES = (
+        ("category", "カテゴリ"),
+        ("todo", "Todo"),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    kind = models.CharField("種類", max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField("削除した行の ID")
+    sync_seq = models.BigIntegerField("同期番号")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "sync_seq"], name="sync_tombstone_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} #{self.sync_seq}"
@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_values(cursor):
+    """encode_cursor で作ったカーソルを値のリストに戻す (型の変換はしない)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return values
+
+
+def decode_cursor(model, ordering, cursor):
+    """encode_cursor で作ったカーソルを ordering の各フィールドの値に戻す"""
+    raw_values = decode_values(cursor)
+    if len(raw_values) != len(ordering):
+        raise InvalidCursor(cursor)
+    try:
+        return [
+            model._meta.get_field(name).to_python(value)
+            for name, value in zip(ordering, raw_values)
+        ]
+    except (TypeError, ValidationError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def keyset_filter(ordering, values):
+    """(a, b, c) > (x, y, z) を Q に展開する (昇順のみ)
+
+    OR だけでは SQLite がインデックスの途中から読み始められないので、先頭の
+    フィールドの a >= x を AND で足しておく。
+    """
+    conditions = []
+    for i, name in enumerate(ordering):
+        equal = {field: value for field, value in zip(ordering[:i], values[:i])}
+        conditions.append(Q(**equal, **{f"{name}__gt": values[i]}))
+    return Q(**{f"{ordering[0]}__gte": values[0]}) & reduce(or_, conditions)
+
+
+def _keyset_page(queryset, ordering, cursor, size):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = decode_cursor(queryset.model, ordering, cursor)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    return queryset[: size + 1]
+
+
+def _split_page(rows, ordering, size):
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    last = rows[-1]
+    next_cursor = encode_cursor(
+        [getattr(last, last._meta.get_field(name).attname) for name in ordering]
+    )
+    return rows, next_cursor
+
+
+def paginate_keyset(queryset, ordering, cursor=None, size=50):
+    """カーソル以降の size 件と、次ページのカーソル (なければ None) を返す"""
+    rows = list(_keyset_page(queryset, ordering, cursor, size))
+    return _split_page(rows, ordering, size)
+
+
+async def apaginate_keyset(queryset, ordering, cursor=None, size=50):
+    rows = [row async for row in _keyset_page(queryset, ordering, cursor, size)]
+    return _split_page(rows, ordering, size)
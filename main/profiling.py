@@ -0,0 +1,243 @@
+"""リクエストごとの時間の内訳 (Server-Timing) と遅いリクエストのプロファイル
+
+ServerTimingMiddleware (main/middleware.py) がリクエストごとに Timings を用意し、
+SQL・テンプレートの描画・グラフの組み立て (span("chart")) とそれ以外のビューの
+コード (app) の時間を、入れ子を除いた正味の時間で数える。たとえばテンプレートの
+中で評価されたクエリは db に入り、template には入らない。
+
+PROFILE_SAMPLE_RATE の割合のリクエストは cProfile で記録し、PROFILE_SLOW_MS を
+超えたリクエストはスタックのサンプリング結果を、どちらも実行した SQL と一緒に
+PROFILE_DIR へ書き出す (同期のリクエストだけ)。どちらも無効なら、1 リクエストあたりの追加の処理は
+クエリごとの時刻の読み取りとヘッダーの組み立てだけ。
+"""
+
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+# Server-Timing に載せる順 (ここにない span はその後ろに並ぶ)
+METRICS = ("db", "template", "chart", "app")
+
+_timings = ContextVar("timings", default=None)
+
+
+class Timings:
+    """span ごとの正味の時間。span が入れ子になると外側の時計は止まる"""
+
+    def __init__(self, record_sql=False):
+        self.started = time.perf_counter()
+        self.total = None
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        self.queries = [] if record_sql else None
+        self._stack = [["app", self.started]]
+
+    def push(self, name):
+        now = time.perf_counter()
+        top = self._stack[-1]
+        self.durations[top[0]] += now - top[1]
+        self._stack.append([name, now])
+
+    def pop(self):
+        """いちばん内側の span を閉じ、その span の時間を返す"""
+        now = time.perf_counter()
+        name, started = self._stack.pop()
+        self.durations[name] += now - started
+        self.counts[name] += 1
+        self._stack[-1][1] = now
+        return now - started
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper として SQL の時間を数える
+        self.push("db")
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = self.pop()
+            if self.queries is not None:
+                self.queries.append((sql, duration))
+
+    def finish(self):
+        while len(self._stack) > 1:
+            self.pop()
+        now = time.perf_counter()
+        self.durations["app"] += now - self._stack[0][1]
+        self._stack[0][1] = now
+        self.total = now - self.started
+
+    def header(self):
+        names = [name for name in METRICS if name in self.durations]
+        names += sorted(set(self.durations) - set(METRICS))
+        entries = []
+        for name in names:
+            entry = f"{name};dur={self.durations[name] * 1000:.1f}"
+            if name == "db":
+                entry += f';desc="{self.counts["db"]} queries"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def measure(timings):
+    """ブロック内の span をこの timings に記録する"""
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def span(name):
+    """ブロックの時間を name として Server-Timing に載せる (デコレーターにも使える)
+
+    計測中のリクエストの外では何もしない。
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    timings.push(name)
+    try:
+        yield
+    finally:
+        timings.pop()
+
+
+class TimedTemplate:
+    """描画の時間を template として数える DjangoTemplates のテンプレート"""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with span("template"):
+            return self._template.render(context, request)
+
+
+class TimedTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+def _collapse(frame):
+    """フレームを根から順に ; でつないだ 1 行 (flamegraph.pl の入力形式)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = Path(code.co_filename).name
+        names.append(f"{code.co_name} ({filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """登録したスレッドのスタックを interval 秒ごとに数えるデーモンスレッド
+
+    登録はリクエストごと (watch が返す Counter ごと) なので、同じスレッドで登録が
+    重なっても互いの記録を上書き・解除しない。登録中のリクエストがなければ
+    サンプリングはしない。
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def watch(self):
+        """呼び出したスレッドを登録し、{スタック: 回数} の Counter を返す
+
+        記録をやめるときは、その Counter を unwatch に渡す。
+        """
+        samples = Counter()
+        with self._lock:
+            self._watched[id(samples)] = (threading.get_ident(), samples)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stack-sampler", daemon=True
+                )
+                self._thread.start()
+        return samples
+
+    def unwatch(self, samples):
+        with self._lock:
+            self._watched.pop(id(samples), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._watched:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._watched.values():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+
+_sampler = None
+
+
+def get_sampler():
+    global _sampler
+    if _sampler is None:
+        _sampler = StackSampler(settings.PROFILE_STACK_INTERVAL)
+    return _sampler
+
+
+def write_profile(request, timings, profiler=None, samples=None):
+    """プロファイルと SQL を PROFILE_DIR に書き出し、テキストのパスを返す"""
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    match = request.resolver_match
+    stem = "-".join(
+        [
+            time.strftime("%Y%m%d-%H%M%S"),
+            (match.url_name if match else None) or "unknown",
+            f"{timings.total * 1000:.0f}ms",
+            uuid.uuid4().hex[:6],
+        ]
+    )
+    lines = [
+        f"{request.method} {request.get_full_path()}",
+        f"Server-Timing: {timings.header()}",
+        "",
+    ]
+    if profiler is not None:
+        profiler.dump_stats(directory / f"{stem}.prof")
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+        lines += ["# cProfile", stream.getvalue()]
+    if samples is not None:
+        interval = settings.PROFILE_STACK_INTERVAL * 1000
+        lines.append(f"# stack samples (every {interval:g}ms)")
+        lines += [f"{stack} {count}" for stack, count in samples.most_common()]
+        lines.append("")
+    lines.append(f"# SQL ({len(timings.queries)} queries)")
+    lines += [f"{duration * 1000:8.2f}ms  {sql}" for sql, duration in timings.queries]
+    path = directory / f"{stem}.txt"
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    logger.info("profiled %s in %s", request.path, path)
+    return path
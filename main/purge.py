@@ -0,0 +1,144 @@
+"""カテゴリ・Todo の削除 (削除待ちの印) と、削除待ちの行の後片付け
+
+Django の削除は CASCADE をたどって関連する行をすべて読み込んでから消すので、
+Todo の多いカテゴリを消すとリクエストが長く書き込みロックを握る。そこで
+リクエストの中では is_deleted を立てるだけにして、既定のマネージャー
+(Category.objects / Todo.objects) で読み込みから外す。集計・差分同期の削除の
+記録・作業時間の集計からの差し引きもその場で済ませるので、残った行は画面にも
+API にも現れない。
+
+行そのものは purge_deleted コマンドが purge_chunk を繰り返して消す。1 回で消すのは
+chunk_size 件までで、参照している行から順に 1 本ずつの DELETE 文で消し、
+1 回ごとにコミットする。
+"""
+
+from functools import partial
+
+from django.db import transaction
+
+from main import bulk, changelog, rollups, timelog, user_cache
+from main.models import (
+    Category,
+    CategoryRollup,
+    DailyTimeRollup,
+    DeadlineNotification,
+    TimeEntry,
+    Todo,
+    WeeklyTimeRollup,
+)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def delete_categories(queryset, seq=None):
+    """queryset のカテゴリを Todo ごと削除待ちにし、件数を返す
+
+    Todo にも同じトランザクションで is_deleted を立て、bulk.delete_todos と同じく
+    削除の記録もここで残す。Todo.objects はカテゴリを結合せずに外せる。
+    カテゴリと Todo の削除の記録には同じ同期番号 (seq か、ここで払い出す) を付ける。
+    """
+    with transaction.atomic():
+        owners = dict(queryset.values_list("id", "user_id"))
+        if not owners:
+            return 0
+        if seq is None:
+            seq = changelog.next_seq(*owners.values())
+        # カテゴリの分をユーザーの集計から引く (カテゴリの集計は 0 になる)
+        deltas = {
+            category_id: {
+                field: -value for field, value in zip(rollups.ROLLUP_FIELDS, values)
+            }
+            for category_id, *values in CategoryRollup.objects.filter(
+                category_id__in=owners
+            ).values_list("category_id", *rollups.ROLLUP_FIELDS)
+        }
+        rollups.apply_category_deltas(deltas, owners)
+        # 作業時間の集計はカテゴリの行ごと消し、このカテゴリの Todo を別のカテゴリで
+        # 記録した分はそのカテゴリの集計から引く
+        for model in (DailyTimeRollup, WeeklyTimeRollup):
+            bulk.raw_delete(model.objects.filter(category_id__in=owners))
+        timelog.subtract_entries(
+            TimeEntry.objects.filter(todo__category_id__in=owners).exclude(
+                category_id__in=owners
+            )
+        )
+        changelog.record_deletions(
+            changelog.KIND_CATEGORY,
+            [(user_id, category_id) for category_id, user_id in owners.items()],
+            seq=seq,
+        )
+        todos = Todo.objects.filter(category_id__in=owners)
+        changelog.record_deletions(
+            changelog.KIND_TODO,
+            [
+                (owners[category_id], todo_id)
+                for category_id, todo_id in todos.values_list("category_id", "id")
+            ],
+            seq=seq,
+        )
+        todos.update(is_deleted=True)
+        count = Category.all_objects.filter(pk__in=owners).update(is_deleted=True)
+        for user_id in set(owners.values()):
+            transaction.on_commit(partial(user_cache.bump_version, user_id))
+    return count
+
+
+def purge_todos(todo_ids):
+    """削除待ちの Todo (todo_ids) を、参照している行から順に消す"""
+    # 別のカテゴリにある生きたサブタスクは、CASCADE と同じく削除待ちにしておく
+    children = Todo.objects.filter(parent_id__in=todo_ids)
+    if children.exists():
+        bulk.update_todos(children, bulk.ACTION_DELETE)
+    Todo.all_objects.filter(parent_id__in=todo_ids).exclude(pk__in=todo_ids).update(
+        parent=None
+    )
+    bulk.raw_delete(DeadlineNotification.objects.filter(todo_id__in=todo_ids))
+    # 作業時間の集計からは削除待ちにしたときに引いてある
+    bulk.raw_delete(TimeEntry.objects.filter(todo_id__in=todo_ids))
+    return bulk.raw_delete(Todo.all_objects.filter(pk__in=todo_ids))
+
+
+def purge_category(category_id):
+    """Todo を消し終えた削除待ちのカテゴリを消す"""
+    # 別のカテゴリへ移した Todo の、このカテゴリでの作業時間の記録
+    bulk.raw_delete(TimeEntry.objects.filter(category_id=category_id))
+    for model in (DailyTimeRollup, WeeklyTimeRollup, CategoryRollup):
+        bulk.raw_delete(model.objects.filter(category_id=category_id))
+    return bulk.raw_delete(Category.all_objects.filter(pk=category_id))
+
+
+def purge_chunk(chunk_size=DEFAULT_CHUNK_SIZE):
+    """削除待ちの行を chunk_size 件まで消し、(消した Todo の数, 消したカテゴリの数) を返す
+
+    1 回の呼び出しが 1 つのトランザクション。(0, 0) なら削除待ちの行は残っていない。
+    """
+    with transaction.atomic():
+        todo_ids = list(
+            Todo.all_objects.filter(is_deleted=True)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if todo_ids:
+            return purge_todos(todo_ids), 0
+
+        category = (
+            Category.all_objects.filter(is_deleted=True)
+            .order_by("id")
+            .values_list("id", "user_id")
+            .first()
+        )
+        if category is None:
+            return 0, 0
+        category_id, user_id = category
+        todo_ids = list(
+            Todo.all_objects.filter(category_id=category_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if todo_ids:
+            # 削除待ちにした後でこのカテゴリに書き込まれた Todo は、ここで記録を残す
+            changelog.record_deletions(
+                changelog.KIND_TODO, [(user_id, todo_id) for todo_id in todo_ids]
+            )
+            return purge_todos(todo_ids), 0
+        return 0, purge_category(category_id)
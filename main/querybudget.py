@@ -0,0 +1,128 @@
+"""リクエストごとのクエリ数の計測と上限 (クエリバジェット) のチェック
+
+開発時はミドルウェアとして、テストではコンテキストマネージャとして使う。
+"""
+
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection as default_connection
+
+# (URL 名, メソッド) ごとの 1 リクエストあたりのクエリ数の上限 (セッション・ユーザー
+# 取得を含む)。ここにない組み合わせは数えるだけで上限を確かめない
+QUERY_BUDGETS = {
+    ("signup", "GET"): 0,
+    ("login", "GET"): 0,
+    ("logout", "POST"): 4,
+    ("home", "GET"): 3,
+    ("todo_list", "GET"): 4,
+    ("todo_create", "GET"): 2,
+    # 一括削除はサブタスク・削除の記録・作業時間の差し引きの分多い
+    ("todo_bulk", "POST"): 15,
+    ("todo_detail", "GET"): 4,
+    ("todo_update", "GET"): 3,
+    # 所要時間を変えると作業時間の記録と集計の行も書く (time_entry_create と同じ)
+    ("todo_update", "POST"): 24,
+    ("todo_delete", "GET"): 3,
+    # その日・その週の最初の記録では集計の行を作るので、SAVEPOINT の分も含めて多め
+    ("time_entry_create", "POST"): 21,
+    ("todo_move", "POST"): 12,
+    ("todo_reorder", "POST"): 10,
+    ("calendar", "GET"): 4,
+    ("mypage", "GET"): 3,
+    ("mypage_chart", "GET"): 3,
+    ("mypage_time_chart", "GET"): 3,
+    ("todo_export", "GET"): 3,
+    ("todo_import", "GET"): 2,
+    ("todo_search", "GET"): 4,
+    ("calendar_feed_settings", "GET"): 3,
+    ("calendar_feed", "GET"): 2,
+    ("category_summary", "GET"): 3,
+    ("sync_changes", "GET"): 6,
+    # カテゴリ・Todo の作成・更新・削除と作業時間の記録をすべて含む push の分
+    # (集計の行を作る SAVEPOINT を含む)
+    ("sync_push", "POST"): 50,
+}
+
+# 同じ形のクエリがこの回数以上出たら N+1 を疑う
+DUPLICATE_THRESHOLD = 3
+
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+
+
+def get_budget(url_name, method="GET"):
+    budgets = {**QUERY_BUDGETS, **getattr(settings, "QUERY_BUDGETS", {})}
+    return budgets.get((url_name, method))
+
+
+def normalize_sql(sql):
+    """パラメータの個数だけが違う IN (...) をまとめ、同じ形のクエリを同一視する"""
+    return _IN_LIST.sub("IN (...)", sql)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """with ブロック内で発行された SQL と所要時間を記録する"""
+
+    def __init__(self, connection=None):
+        self.connection = connection or default_connection
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self, threshold=DUPLICATE_THRESHOLD):
+        """threshold 回以上発行された同じ形のクエリ (N+1 の疑い) を {SQL: 回数} で返す"""
+        counts = Counter(normalize_sql(sql) for sql, _ in self.queries)
+        return {sql: count for sql, count in counts.items() if count >= threshold}
+
+    def report(self):
+        lines = [f"{self.count} queries"]
+        lines += [f"  {sql}" for sql, _ in self.queries]
+        for sql, count in self.duplicates().items():
+            lines.append(f"  duplicated x{count}: {sql}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def query_budget(url_name=None, budget=None, method="GET", allow_duplicates=False):
+    """ブロック内のクエリ数が上限を超えたら QueryBudgetExceeded を送出する"""
+    if budget is None:
+        budget = get_budget(url_name, method)
+    with QueryRecorder() as recorder:
+        yield recorder
+    if budget is not None and recorder.count > budget:
+        raise QueryBudgetExceeded(
+            f"{url_name or 'block'} ran over its query budget of {budget}:\n"
+            f"{recorder.report()}"
+        )
+    if not allow_duplicates and recorder.duplicates():
+        raise QueryBudgetExceeded(
+            f"{url_name or 'block'} repeated queries:\n{recorder.report()}"
+        )
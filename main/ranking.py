@@ -0,0 +1,182 @@
+"""カテゴリ内の Todo の手動の並び順 (辞書順で比べる順位キー)
+
+Todo.rank は 0-9a-z の文字列で、小数 0.xxx (36 進) のように辞書順で比べる。
+2 つのキーの間には必ず別のキーを作れるので、並べ替えでは動かした 1 行の rank
+だけを書き換え、ほかの行は振り直さない。同じ場所への挿入を繰り返すとキーが
+伸びていくので、新しいキーが REBALANCE_LENGTH を超えたら move がその場で
+カテゴリを振り直す (それより前からある長いキーは rebalance_ranks コマンドで
+まとめて振り直す)。
+
+キーは末尾が "0" にならないようにする (それより前に入れる余地がなくなるため)。
+空文字列は順位が未設定の行 (このフィールドを足す前からある行など) で、先頭に
+ID 順で並ぶ。振り直しても今の並び順は変えない。
+"""
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.functions import Length
+
+from main import rollups, user_cache
+from main.models import Todo
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+# これより長いキーを持つカテゴリは振り直す
+REBALANCE_LENGTH = 16
+# 末尾への追加で進める桁。36 ** 4 回ほど追加してもキーは伸びない
+APPEND_WIDTH = 4
+
+
+def key_between(before, after):
+    """before < キー < after になる短いキーを返す (before は "" 、after は None で端)"""
+    before = before or ""
+    if after is not None and after <= before:
+        raise ValueError(f"no room between {before!r} and {after!r}")
+    key = []
+    for i in range(len(before) + (len(after) if after is not None else 0) + 1):
+        low = DIGITS.index(before[i]) if i < len(before) else 0
+        high = (
+            DIGITS.index(after[i])
+            if after is not None and i < len(after)
+            else len(DIGITS)
+        )
+        if high - low > 1:
+            key.append(DIGITS[(low + high) // 2])
+            return "".join(key)
+        key.append(DIGITS[low])
+        if high > low:
+            # ここで before 側の桁を取ったので、この先は after に縛られない
+            after = None
+    raise AssertionError("unreachable")
+
+
+def key_after(before):
+    """before より後ろの短いキー (末尾に追加するとき用)
+
+    中点を取ると追加のたびにキーが伸びるので、APPEND_WIDTH 桁目 (before の方が
+    長ければ最後の桁) を 1 つ進める。繰り上がりで 0 になった桁は切り捨てる。
+    """
+    padded = before.ljust(APPEND_WIDTH, DIGITS[0])
+    for i in reversed(range(len(padded))):
+        digit = DIGITS.index(padded[i])
+        if digit < len(DIGITS) - 1:
+            return padded[:i] + DIGITS[digit + 1]
+    return before + DIGITS[1]
+
+
+def spread_keys(count):
+    """count 個の昇順のキーを、後から間に入れる余地が均等に残るように作る"""
+    width = 1
+    while len(DIGITS) ** width <= count * 2:
+        width += 1
+    step = len(DIGITS) ** width // (count + 1)
+    keys = []
+    for i in range(1, count + 1):
+        value, digits = i * step, []
+        for _ in range(width):
+            value, digit = divmod(value, len(DIGITS))
+            digits.append(DIGITS[digit])
+        keys.append("".join(reversed(digits)).rstrip(DIGITS[0]))
+    return keys
+
+
+def last_ranks(category_ids):
+    """{category_id: 末尾の rank} を返す (Todo がなければ含まない)"""
+    return dict(
+        Todo.objects.filter(category_id__in=category_ids)
+        .values("category_id")
+        .annotate(last=Max("rank"))
+        .order_by()
+        .values_list("category_id", "last")
+    )
+
+
+def append_ranks(todos):
+    """保存前の todos に、それぞれのカテゴリの末尾に並ぶ rank を付ける"""
+    last = last_ranks({todo.category_id for todo in todos})
+    for todo in todos:
+        todo.rank = last[todo.category_id] = key_after(last.get(todo.category_id, ""))
+
+
+def key_for(low, high):
+    """low と high (None なら末尾) の間のキー"""
+    return key_between(low, high) if high is not None else key_after(low)
+
+
+def neighbor(todo, previous, of=None):
+    """並び順で of (省略時は todo) の直前 / 直後の行。todo 自身は飛ばす"""
+    of = of or todo
+    siblings = Todo.objects.filter(category_id=todo.category_id).exclude(pk=todo.pk)
+    # 外側の rank の範囲条件でインデックスの途中から読み始める
+    if previous:
+        condition = Q(rank__lte=of.rank) & (
+            Q(rank__lt=of.rank) | Q(rank=of.rank, id__lt=of.pk)
+        )
+        ordering = ("-rank", "-id")
+    else:
+        condition = Q(rank__gte=of.rank) & (
+            Q(rank__gt=of.rank) | Q(rank=of.rank, id__gt=of.pk)
+        )
+        ordering = ("rank", "id")
+    return siblings.filter(condition).order_by(*ordering).only("id", "rank").first()
+
+
+def move(todo, after=None, before=None):
+    """todo を after の直後 (または before の直前) に置き、新しい rank を返す
+
+    片方だけ渡せば、もう片方の隣はインデックスで 1 件だけ読む。書き込むのは
+    todo の 1 行だけで、隣どうしのキーの間に余地がないときか、新しいキーが
+    REBALANCE_LENGTH を超えるときだけカテゴリ全体を振り直す。
+    """
+    if (
+        after is not None
+        and before is not None
+        and (before.rank, before.pk) <= (after.rank, after.pk)
+    ):
+        # 隣の情報が古く前後が入れ替わっていたら、after の直後に置く
+        before = None
+    with transaction.atomic():
+        if before is None and after is not None:
+            before = neighbor(todo, previous=False, of=after)
+        elif after is None and before is not None:
+            after = neighbor(todo, previous=True, of=before)
+        low = after.rank if after is not None else ""
+        high = before.rank if before is not None else None
+        rank = None if high is not None and high <= low else key_for(low, high)
+        if rank is None or len(rank) > REBALANCE_LENGTH:
+            # 先頭への挿入を繰り返すなどでキーが伸びたら、max_length に届く前に振り直す
+            ranks = rebalance(todo.category_id)
+            low = ranks[after.pk] if after is not None else ""
+            high = ranks[before.pk] if before is not None else None
+            rank = key_for(low, high)
+        Todo.objects.filter(pk=todo.pk).update(rank=rank)
+        owner_id = rollups.category_owners([todo.category_id])[todo.category_id]
+        transaction.on_commit(partial(user_cache.bump_version, owner_id))
+    todo.rank = rank
+    return rank
+
+
+def rebalance(category_id):
+    """カテゴリの Todo に今の並び順のまま均等なキーを振り直し、{id: rank} を返す"""
+    ids = list(
+        Todo.objects.filter(category_id=category_id)
+        .order_by("rank", "id")
+        .values_list("id", flat=True)
+    )
+    ranks = dict(zip(ids, spread_keys(len(ids))))
+    Todo.objects.bulk_update(
+        [Todo(pk=pk, rank=rank) for pk, rank in ranks.items()], ["rank"], batch_size=500
+    )
+    return ranks
+
+
+def categories_to_rebalance(max_length=REBALANCE_LENGTH):
+    """キーが max_length より長いか、順位が未設定の行があるカテゴリの ID"""
+    return (
+        Todo.objects.annotate(rank_length=Length("rank"))
+        .filter(Q(rank="") | Q(rank_length__gt=max_length))
+        .values_list("category_id", flat=True)
+        .distinct()
+        .order_by("category_id")
+    )
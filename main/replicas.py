@@ -0,0 +1,103 @@
+"""読み取り専用レプリカへの振り分け
+
+ReplicaRouter は reading_from() の中の読み込みだけをレプリカに送り、書き込みと
+それ以外の読み込みはすべてプライマリ (default) に送る。振り分け先はリクエスト
+ごとに contextvars で持つので、ルーターの判定はクエリごとに変数を 1 つ読むだけ。
+
+書き込んだ直後のユーザーは、レプリカにまだ反映されていない自分の変更が見えなく
+ならないよう、REPLICA_STICKY_SECONDS 秒のあいだ読み込みもプライマリから行う。
+最後に書き込んだ時刻はユーザーごとのキャッシュのバージョン (main/user_cache.py)
+をそのまま使う。
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.template.response import SimpleTemplateResponse
+
+from main import user_cache
+
+_read_alias = ContextVar("read_alias", default=None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どの DB から読んだ行どうしでも関連づけてよい
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def _sticky(version):
+    """バージョン (最後に書き込んだ時刻 ns) が REPLICA_STICKY_SECONDS 秒以内か"""
+    window = settings.REPLICA_STICKY_SECONDS * 1_000_000_000
+    return time.time_ns() - version < window
+
+
+def _replica_for(request):
+    replicas = getattr(settings, "REPLICA_DATABASES", [])
+    if not replicas or request.method not in ("GET", "HEAD"):
+        return None
+    return random.choice(replicas)
+
+
+def choose_replica(request):
+    """request の読み込みに使うレプリカの alias。プライマリを使うなら None"""
+    alias = _replica_for(request)
+    if alias is None:
+        return None
+    if request.user.is_authenticated and _sticky(
+        user_cache.get_version(request.user.pk)
+    ):
+        return None
+    return alias
+
+
+async def achoose_replica(request):
+    alias = _replica_for(request)
+    if alias is None:
+        return None
+    if request.user.is_authenticated and _sticky(
+        await user_cache.aget_version(request.user.pk)
+    ):
+        return None
+    return alias
+
+
+class ReplicaReadMixin:
+    """GET/HEAD の読み込みをレプリカから行う
+
+    LoginRequiredMixin・ConditionalGetMixin より後ろに置く (304 を返すときは DB を
+    読まないので、振り分けの判定もしない)。
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        alias = choose_replica(request)
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        with reading_from(alias):
+            response = super().dispatch(request, *args, **kwargs)
+            # テンプレートの中で評価されるクエリもレプリカに送るため、ここで描画する
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+        return response
@@ -0,0 +1,195 @@
+from collections import namedtuple
+
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from main.models import Category, CategoryRollup, Todo, User, UserRollup
+
+ROLLUP_FIELDS = ("total_hours", "finished_count", "unfinished_count")
+
+TodoState = namedtuple("TodoState", "category_id hour_spent is_finished")
+
+
+def todo_state(todo):
+    return TodoState(todo.category_id, todo.hour_spent or 0, bool(todo.is_finished))
+
+
+def stored_todo_state(pk):
+    row = (
+        Todo.objects.filter(pk=pk)
+        .values_list("category_id", "hour_spent", "is_finished")
+        .first()
+    )
+    return TodoState(*row) if row else None
+
+
+def _contribution(state, sign):
+    return {
+        "total_hours": sign * (state.hour_spent or 0),
+        "finished_count": sign * int(state.is_finished),
+        "unfinished_count": sign * int(not state.is_finished),
+    }
+
+
+def _add(target, delta):
+    for field, value in delta.items():
+        target[field] = target.get(field, 0) + value
+
+
+def _apply(queryset, delta):
+    changes = {
+        field: F(field) + value for field, value in delta.items() if value != 0
+    }
+    if changes:
+        queryset.update(**changes)
+
+
+def apply_todo_change(old, new):
+    """Todo の変更前後の状態 (TodoState or None) の差分を集計テーブルに反映する"""
+    category_deltas = {}
+    if old is not None:
+        add_contribution(category_deltas, old, -1)
+    if new is not None:
+        add_contribution(category_deltas, new, 1)
+    apply_category_deltas(category_deltas)
+
+
+def add_contribution(category_deltas, state, sign=1):
+    _add(category_deltas.setdefault(state.category_id, {}), _contribution(state, sign))
+
+
+def add_contribution_values(category_deltas, category_id, values):
+    _add(category_deltas.setdefault(category_id, {}), values)
+
+
+def category_owners(category_ids):
+    """{category_id: user_id} を返す"""
+    return dict(
+        Category.objects.filter(pk__in=category_ids).values_list("id", "user_id")
+    )
+
+
+def apply_category_deltas(category_deltas, owners=None):
+    """{category_id: {フィールド: 増減}} をカテゴリと持ち主ユーザーの集計に反映する
+
+    影響のあったユーザーの ID の集合を返す。持ち主 ({category_id: user_id}) が
+    分かっていれば owners に渡すと引き直さない。
+    """
+    if owners is None:
+        owners = category_owners(category_deltas)
+    user_deltas = {}
+    for category_id, delta in category_deltas.items():
+        if category_id not in owners:
+            continue
+        _apply(CategoryRollup.objects.filter(category_id=category_id), delta)
+        _add(user_deltas.setdefault(owners[category_id], {}), delta)
+    for user_id, delta in user_deltas.items():
+        _apply(UserRollup.objects.filter(user_id=user_id), delta)
+    return set(user_deltas)
+
+
+def queryset_contributions(queryset):
+    """queryset の Todo がカテゴリごとの集計にどれだけ寄与しているかを 1 クエリで返す"""
+    rows = (
+        queryset.values("category_id")
+        .annotate(**_rollup_annotations(""))
+        .values_list("category_id", "sum_hours", "sum_finished", "sum_unfinished")
+        .order_by()
+    )
+    return {row[0]: dict(zip(ROLLUP_FIELDS, row[1:])) for row in rows}
+
+
+def diff_contributions(before, after):
+    deltas = {}
+    for category_id, values in before.items():
+        _add(deltas.setdefault(category_id, {}), {k: -v for k, v in values.items()})
+    for category_id, values in after.items():
+        _add(deltas.setdefault(category_id, {}), values)
+    return deltas
+
+
+def _rollup_annotations(prefix, live=Q()):
+    """prefix の先の Todo の集計。削除待ちの Todo と live に合わない行は数えない"""
+    live &= Q(**{f"{prefix}is_deleted": False})
+    return {
+        "sum_hours": Coalesce(Sum(f"{prefix}hour_spent", filter=live), 0),
+        "sum_finished": Count(
+            f"{prefix}id", filter=live & Q(**{f"{prefix}is_finished": True})
+        ),
+        "sum_unfinished": Count(
+            f"{prefix}id", filter=live & Q(**{f"{prefix}is_finished": False})
+        ),
+    }
+
+
+def compute_category_rollups(users=None):
+    categories = Category.objects.all()
+    if users is not None:
+        categories = categories.filter(user__in=users)
+    rows = categories.annotate(**_rollup_annotations("todos__")).values_list(
+        "id", "sum_hours", "sum_finished", "sum_unfinished"
+    )
+    return {row[0]: row[1:] for row in rows}
+
+
+def compute_user_rollups(users=None):
+    queryset = User.objects.all()
+    if users is not None:
+        queryset = queryset.filter(pk__in=users)
+    annotations = _rollup_annotations(
+        "categories__todos__", live=Q(categories__is_deleted=False)
+    )
+    rows = queryset.annotate(**annotations).values_list(
+        "id", "sum_hours", "sum_finished", "sum_unfinished"
+    )
+    return {row[0]: row[1:] for row in rows}
+
+
+def rebuild_rollups(users=None, batch_size=1000):
+    """集計テーブルを Todo から作り直す。users を渡すとそのユーザー分だけ"""
+    category_rollups = [
+        CategoryRollup(category_id=pk, **dict(zip(ROLLUP_FIELDS, values)))
+        for pk, values in compute_category_rollups(users).items()
+    ]
+    user_rollups = [
+        UserRollup(user_id=pk, **dict(zip(ROLLUP_FIELDS, values)))
+        for pk, values in compute_user_rollups(users).items()
+    ]
+    CategoryRollup.objects.bulk_create(
+        category_rollups,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["category"],
+        update_fields=ROLLUP_FIELDS,
+    )
+    UserRollup.objects.bulk_create(
+        user_rollups,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=ROLLUP_FIELDS,
+    )
+    return len(category_rollups), len(user_rollups)
+
+
+def verify_rollups(users=None):
+    """集計テーブルと実データのずれを (種類, pk, 期待値, 保存値) のリストで返す"""
+    category_rollups = CategoryRollup.objects.all()
+    user_rollups = UserRollup.objects.all()
+    if users is not None:
+        category_rollups = category_rollups.filter(category__user__in=users)
+        user_rollups = user_rollups.filter(user__in=users)
+
+    mismatches = []
+    checks = (
+        ("category", compute_category_rollups(users), category_rollups, "category_id"),
+        ("user", compute_user_rollups(users), user_rollups, "user_id"),
+    )
+    for kind, expected, queryset, key in checks:
+        stored = {
+            row[0]: row[1:] for row in queryset.values_list(key, *ROLLUP_FIELDS)
+        }
+        for pk, values in expected.items():
+            if stored.get(pk) != tuple(values):
+                mismatches.append((kind, pk, tuple(values), stored.get(pk)))
+    return mismatches
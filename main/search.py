@@ -0,0 +1,130 @@
+"""Todo のタイトル・説明の全文検索
+
+SQLite では FTS5 の仮想テーブル main_todo_fts (trigram トークナイザ) を使う。
+索引は main_todo / main_category のトリガーで同期するので、bulk_create や
+queryset.update() での書き込みも反映される。各行の owner 列に "[ユーザーID]" を
+入れておき、MATCH の条件でユーザーを絞り込んでから順位付けする。
+"""
+
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from main.models import Todo
+
+FTS_TABLE = "main_todo_fts"
+
+# trigram は 3 文字未満の語を索引から引けないので、短い語は LIKE で絞り込む
+MIN_TERM_LENGTH = 3
+
+# bm25 の列ごとの重み (title, description, owner)
+RANK_WEIGHTS = (10.0, 1.0, 0.0)
+
+# 削除待ちの Todo は purge_deleted コマンドが消すまで索引に残るので、
+# 部分インデックス (todo_pending_idx) で引いて外す。カテゴリごと削除待ちにした
+# Todo にも is_deleted が立っている
+EXCLUDE_PENDING_SQL = "AND rowid NOT IN (SELECT id FROM main_todo WHERE is_deleted)"
+
+SearchPage = namedtuple("SearchPage", "todos page has_next")
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def owner_token(user_id):
+    return f"[{user_id}]"
+
+
+def _phrase(term):
+    return '"{}"'.format(term.replace('"', '""'))
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def parse_query(query):
+    """空白区切りの検索語を (索引で引く語, LIKE で絞る語) に分ける"""
+    terms = query.split()
+    long_terms = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    return long_terms, short_terms
+
+
+def match_expression(user_id, long_terms):
+    parts = [f"owner:{_phrase(owner_token(user_id))}"]
+    parts += [f"{{title description}}:{_phrase(term)}" for term in long_terms]
+    return " AND ".join(parts)
+
+
+def search_todo_ids(user_id, query, limit, offset=0):
+    """user_id のユーザーの Todo から query に合うものの ID を関連度順に返す"""
+    long_terms, short_terms = parse_query(query)
+    if not long_terms and not short_terms:
+        return []
+    sql = [f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"]
+    params = [match_expression(user_id, long_terms)]
+    for term in short_terms:
+        sql.append(
+            "AND (title LIKE %s ESCAPE '\\' OR description LIKE %s ESCAPE '\\')"
+        )
+        pattern = f"%{_escape_like(term)}%"
+        params += [pattern, pattern]
+    sql.append(EXCLUDE_PENDING_SQL)
+    weights = ", ".join(str(weight) for weight in RANK_WEIGHTS)
+    sql.append(f"ORDER BY bm25({FTS_TABLE}, {weights}), rowid LIMIT %s OFFSET %s")
+    params += [limit, offset]
+    with connection.cursor() as cursor:
+        cursor.execute(" ".join(sql), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _fallback_todo_ids(user_id, query, limit, offset):
+    # FTS5 のない DB 向け。ユーザーの Todo を部分一致で走査する
+    queryset = Todo.objects.filter(category__user_id=user_id)
+    for term in query.split():
+        queryset = queryset.filter(
+            Q(title__icontains=term) | Q(description__icontains=term)
+        )
+    ids = queryset.order_by("id").values_list("id", flat=True)
+    return list(ids[offset : offset + limit])
+
+
+def search_todos(user, query, page=1, page_size=20):
+    """検索結果の 1 ページ分を SearchPage で返す (Todo は category を取得済み)"""
+    offset = (page - 1) * page_size
+    find = search_todo_ids if is_available() else _fallback_todo_ids
+    # 1 件余分に取って次のページがあるかを判定する
+    ids = find(user.pk, query, page_size + 1, offset)
+    has_next = len(ids) > page_size
+    ids = ids[:page_size]
+    todos = Todo.objects.select_related("category").in_bulk(ids)
+    return SearchPage([todos[pk] for pk in ids if pk in todos], page, has_next)
+
+
+def rebuild_index():
+    """索引を main_todo から作り直し、件数を返す"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, description, owner) "
+            "SELECT t.id, t.title, COALESCE(t.description, ''), "
+            "'[' || c.user_id || ']' "
+            "FROM main_todo t JOIN main_category c ON c.id = t.category_id"
+        )
+        count = cursor.rowcount
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def verify_index():
+    """索引と main_todo の行数が一致するかを (索引の行数, Todo の行数) で返す
+
+    削除待ちの Todo も索引に残っているので数に含める。
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+        indexed = cursor.fetchone()[0]
+    return indexed, Todo.all_objects.count()
@@ -0,0 +1,140 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from main import changelog, ranking, rollups, timelog, tree, user_cache
+from main.models import (
+    Category,
+    CategoryRollup,
+    SyncState,
+    TimeEntry,
+    Todo,
+    User,
+    UserRollup,
+)
+
+
+def todo_owner_id(todo):
+    """Todo の持ち主の user_id を返す (category がキャッシュ済みなら追加クエリなし)"""
+    if Todo.category.is_cached(todo):
+        return todo.category.user_id
+    return (
+        Category.objects.filter(pk=todo.category_id)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+def data_changed(user_id):
+    """ユーザーのデータが変わったのでキャッシュのバージョンを上げる (コミット後)"""
+    if user_id is not None:
+        transaction.on_commit(lambda: user_cache.bump_version(user_id))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserRollup.objects.get_or_create(user=instance)
+        SyncState.objects.get_or_create(user=instance)
+    # プロセス内に持っているログインユーザー (main/auth.py) も読み直させる
+    data_changed(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    data_changed(instance.pk)
+
+
+@receiver(pre_save, sender=Category)
+def category_pre_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.sync_seq = changelog.next_seq(instance.user_id)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        CategoryRollup.objects.get_or_create(category=instance)
+        UserRollup.objects.get_or_create(user_id=instance.user_id)
+    data_changed(instance.user_id)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, origin=None, **kwargs):
+    if not changelog.deleting_user(origin):
+        changelog.record_deletions(
+            changelog.KIND_CATEGORY, [(instance.user_id, instance.pk)]
+        )
+    data_changed(instance.user_id)
+
+
+@receiver(pre_save, sender=Todo)
+def todo_pre_save(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance._rollup_old_state = None
+        if not raw and instance.parent_id is not None:
+            # 付け替えは tree.move_subtree で行い、ここでは作るときだけ path を決める
+            instance.path = tree.child_path(instance.parent)
+        if not raw and not instance.rank:
+            ranking.append_ranks([instance])
+    else:
+        instance._rollup_old_state = rollups.stored_todo_state(instance.pk)
+    if not raw:
+        instance._owner_id = todo_owner_id(instance)
+        instance.sync_seq = changelog.next_seq(instance._owner_id)
+
+
+@receiver(post_save, sender=Todo)
+def todo_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, "_rollup_old_state", None)
+    rollups.apply_todo_change(old, rollups.todo_state(instance))
+    if old is not None and old.category_id != instance.category_id:
+        # 別のユーザーのカテゴリへ移したら、元の持ち主からは削除に見せる
+        old_owner_id = rollups.category_owners([old.category_id]).get(
+            old.category_id
+        )
+        if old_owner_id not in (None, instance._owner_id):
+            changelog.record_deletions(
+                changelog.KIND_TODO, [(old_owner_id, instance.pk)]
+            )
+            data_changed(old_owner_id)
+    data_changed(instance._owner_id)
+
+
+@receiver(post_delete, sender=Todo)
+def todo_deleted(sender, instance, origin=None, **kwargs):
+    if instance.is_deleted:
+        # 削除待ち (main/purge.py) の Todo は、削除待ちにしたときに集計から引き、
+        # 削除の記録も残してある
+        return
+    rollups.apply_todo_change(rollups.todo_state(instance), None)
+    owner_id = todo_owner_id(instance)
+    if not changelog.deleting_user(origin):
+        changelog.record_deletions(changelog.KIND_TODO, [(owner_id, instance.pk)])
+    data_changed(owner_id)
+
+
+@receiver(post_save, sender=TimeEntry)
+def time_entry_saved(sender, instance, created, raw=False, **kwargs):
+    # 記録は追記のみなので、作られたときだけ日別・週別の集計に足す
+    if created and not raw:
+        user_id = timelog.entry_owner_id(instance)
+        timelog.apply_entry_deltas(
+            {(user_id, instance.category_id, instance.spent_on): instance.hours}
+        )
+        data_changed(user_id)
+
+
+@receiver(pre_delete, sender=TimeEntry)
+def time_entry_deleting(sender, instance, **kwargs):
+    # Todo やカテゴリの削除で連鎖したときも、集計の行がまだ残っている削除前に引く
+    if Todo.all_objects.filter(pk=instance.todo_id, is_deleted=True).exists():
+        return  # 削除待ちにしたときに引いてある
+    user_id = timelog.entry_owner_id(instance)
+    timelog.apply_entry_deltas(
+        {(user_id, instance.category_id, instance.spent_on): -instance.hours},
+        create=False,
+    )
+    data_changed(user_id)
@@ -0,0 +1,348 @@
+"""差分同期 API: カーソルより後に変わった Category / Todo と削除の記録
+
+同期番号の付け方は main/changelog.py を参照。カーソルは最後に返した行の
+(同期番号, 種類, ID) を encode_cursor したもの。1 回の書き込みで複数の行が同じ
+番号になるので、同じ番号の中はカテゴリ → Todo → 削除の順、その中は ID 順に読む。
+"""
+
+from functools import partial
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from main import bulk, changelog, purge, ranking, rollups, timelog, user_cache
+from main.forms import SyncCategoryForm, SyncDeletionForm, SyncTodoForm
+from main.models import (
+    Category,
+    CategoryRollup,
+    SyncState,
+    SyncTombstone,
+    Todo,
+)
+from main.pagination import InvalidCursor, decode_values, encode_cursor, keyset_filter
+
+DEFAULT_LIMIT = 500
+
+# 1 回の送信で受け付ける行数 (作成・更新・削除の合計)
+MAX_PUSH_ROWS = 500
+
+STATUS_OK = "ok"
+STATUS_CONFLICT = "conflict"
+STATUS_INVALID = "invalid"
+STATUS_NOT_FOUND = "not_found"
+
+TODO_FIELDS = (
+    "category_id",
+    "title",
+    "description",
+    "deadline_time",
+    "hour_spent",
+    "is_finished",
+)
+
+
+class CursorExpired(Exception):
+    """削除の記録を消した範囲より前のカーソル。クライアントは全件を取り直す"""
+
+
+class InvalidPush(ValueError):
+    pass
+
+
+def parse_cursor(cursor):
+    values = decode_values(cursor)
+    if len(values) != 3 or not all(isinstance(value, int) for value in values):
+        raise InvalidCursor(cursor)
+    return tuple(values)
+
+
+def _after(position, order):
+    """種類の順が order の行のうち、(同期番号, 種類の順, ID) が position より後のもの"""
+    seq, cursor_order, last_id = position
+    if order < cursor_order:
+        return Q(sync_seq__gt=seq)
+    if order > cursor_order:
+        return Q(sync_seq__gte=seq)
+    return keyset_filter(("sync_seq", "id"), (seq, last_id))
+
+
+def _category_row(row):
+    return {"id": row["id"], "name": row["name"], "seq": row["sync_seq"]}
+
+
+def _todo_row(row):
+    return {
+        "id": row["id"],
+        "category_id": row["category_id"],
+        "title": row["title"],
+        "description": row["description"] or "",
+        "deadline_time": timezone.localtime(row["deadline_time"]).isoformat(),
+        "hour_spent": row["hour_spent"],
+        "is_finished": row["is_finished"],
+        "seq": row["sync_seq"],
+    }
+
+
+def _deleted_row(row):
+    return {"type": row["kind"], "id": row["object_id"], "seq": row["sync_seq"]}
+
+
+def _streams(user):
+    """(結果のキー, 行の queryset, 行を dict にする関数) を同じ番号の中で読む順に返す"""
+    return (
+        (
+            "categories",
+            Category.objects.filter(user=user).values("id", "name", "sync_seq"),
+            _category_row,
+        ),
+        (
+            "todos",
+            Todo.objects.filter(category__user=user).values(
+                "id", *TODO_FIELDS, "sync_seq"
+            ),
+            _todo_row,
+        ),
+        (
+            "deleted",
+            SyncTombstone.objects.filter(user=user).values(
+                "id", "kind", "object_id", "sync_seq"
+            ),
+            _deleted_row,
+        ),
+    )
+
+
+def pull_changes(user, cursor=None, limit=DEFAULT_LIMIT):
+    """cursor より後の変更を最大 limit 行、JSON にできる dict で返す
+
+    cursor がなければ今ある行をすべて返す (削除の記録は含めない)。クライアントは
+    categories → todos → deleted の順に反映し、has_more が真なら返した cursor で
+    続きを読む。
+    """
+    position = parse_cursor(cursor) if cursor else None
+    if position is not None:
+        purged_seq = (
+            SyncState.objects.filter(user=user)
+            .values_list("purged_seq", flat=True)
+            .first()
+        )
+        if purged_seq and position[0] <= purged_seq:
+            raise CursorExpired(cursor)
+
+    # 種類ごとに limit + 1 行ずつ読み、(番号, 種類, ID) の順に並べて先頭を返す
+    keyed = []
+    for order, (name, queryset, serialize) in enumerate(_streams(user)):
+        if position is not None:
+            queryset = queryset.filter(_after(position, order))
+        elif name == "deleted":
+            continue
+        for row in queryset.order_by("sync_seq", "id")[: limit + 1]:
+            keyed.append(((row["sync_seq"], order, row["id"]), name, serialize, row))
+    keyed.sort(key=itemgetter(0))
+    page = keyed[:limit]
+
+    changes = {"categories": [], "todos": [], "deleted": []}
+    for _, name, serialize, row in page:
+        changes[name].append(serialize(row))
+    if page:
+        cursor = encode_cursor(list(page[-1][0]))
+    changes["cursor"] = cursor or encode_cursor([0, 0, 0])
+    changes["has_more"] = len(keyed) > limit
+    return changes
+
+
+def _result(data, status, **extra):
+    return {
+        "id": data.get("id"),
+        "client_id": data.get("client_id"),
+        "status": status,
+        **extra,
+    }
+
+
+def _check(form, existing):
+    """フォームの行を検証し、(既存の行 or None, 結果 or None) を返す
+
+    結果が None でなければ、その行は反映せずに結果だけを返す。
+    """
+    if not form.is_valid():
+        errors = form.errors.get_json_data()
+        return None, _result(form.data, STATUS_INVALID, errors=errors)
+    row = form.cleaned_data
+    if not row["id"]:
+        return None, None
+    obj = existing.get(row["id"])
+    if obj is None:
+        return None, _result(form.data, STATUS_NOT_FOUND)
+    if row["base_seq"] is not None and obj.sync_seq > row["base_seq"]:
+        # クライアントが最後に見た後で、ほかの端末が書き換えている
+        return None, _result(form.data, STATUS_CONFLICT, seq=obj.sync_seq)
+    return obj, None
+
+
+def _push_categories(user, seq, forms, categories, results):
+    """カテゴリの作成・更新を反映し、{client_id: 作ったカテゴリ} を返す"""
+    created, updated = [], []
+    for form in forms:
+        category, result = _check(form, categories)
+        if result is None:
+            result = _result(form.data, STATUS_OK, seq=seq)
+            if category is None:
+                category = Category(user=user, sync_seq=seq)
+                created.append((form, result, category))
+            else:
+                category.sync_seq = seq
+                updated.append(category)
+            category.name = form.cleaned_data["name"]
+        results.append(result)
+
+    Category.objects.bulk_create([category for _, _, category in created])
+    CategoryRollup.objects.bulk_create(
+        [CategoryRollup(category=category) for _, _, category in created]
+    )
+    Category.objects.bulk_update(updated, ["name", "sync_seq"])
+    client_categories = {}
+    for form, result, category in created:
+        result["id"] = category.pk
+        client_categories[form.cleaned_data["client_id"]] = category
+    return client_categories
+
+
+def _push_todos(user, seq, forms, categories, client_categories, todos, results):
+    """Todo の作成・更新を反映する
+
+    所要時間の増減は、フォームから書き換えたときと同じく作業時間の記録にも残す。
+    """
+    deltas = {}
+    created, updated, hours_changed = [], [], []
+    for form in forms:
+        todo, result = _check(form, todos)
+        if result is None:
+            row = form.cleaned_data
+            if row["category_id"]:
+                category = categories.get(row["category_id"])
+            else:
+                category = client_categories.get(row["category_client_id"])
+            if category is None:
+                error = {"message": "カテゴリが見つかりません。", "code": "not_found"}
+                result = _result(
+                    form.data, STATUS_NOT_FOUND, errors={"category_id": [error]}
+                )
+        if result is None:
+            result = _result(form.data, STATUS_OK, seq=seq)
+            hours_before = 0
+            if todo is None:
+                todo = Todo()
+                created.append((result, todo))
+            else:
+                rollups.add_contribution(deltas, rollups.todo_state(todo), -1)
+                hours_before = todo.hour_spent or 0
+                updated.append(todo)
+            todo.category = category
+            todo.title = row["title"]
+            todo.description = row["description"] or None
+            todo.deadline_time = row["deadline_time"]
+            todo.hour_spent = row["hour_spent"] or 0
+            todo.is_finished = row["is_finished"]
+            todo.sync_seq = seq
+            rollups.add_contribution(deltas, rollups.todo_state(todo))
+            hours_changed.append((todo, todo.hour_spent - hours_before))
+        results.append(result)
+
+    ranking.append_ranks([todo for _, todo in created])
+    Todo.objects.bulk_create([todo for _, todo in created])
+    Todo.objects.bulk_update(updated, [*TODO_FIELDS, "sync_seq"], batch_size=500)
+    for result, todo in created:
+        result["id"] = todo.pk
+    owners = {category_id: user.pk for category_id in deltas}
+    rollups.apply_category_deltas(deltas, owners)
+
+    timelog.record_hours(user.pk, hours_changed)
+
+
+def _push_deletions(seq, forms, categories, todos, results):
+    """削除を反映する。カテゴリの削除はそのカテゴリの Todo にも及ぶ"""
+    deleted = {changelog.KIND_CATEGORY: [], changelog.KIND_TODO: []}
+    for form in forms:
+        kind = form.cleaned_data["type"] if form.is_valid() else None
+        existing = categories if kind == changelog.KIND_CATEGORY else todos
+        obj, result = _check(form, existing)
+        if result is None:
+            deleted[kind].append(obj.pk)
+            result = _result(form.data, STATUS_OK)
+        results.append(result)
+
+    if deleted[changelog.KIND_TODO]:
+        bulk.update_todos(
+            Todo.objects.filter(pk__in=deleted[changelog.KIND_TODO]),
+            bulk.ACTION_DELETE,
+            seq=seq,
+        )
+    if deleted[changelog.KIND_CATEGORY]:
+        purge.delete_categories(
+            Category.objects.filter(pk__in=deleted[changelog.KIND_CATEGORY]), seq=seq
+        )
+
+
+def _bind(form_class, rows):
+    return [form_class(row if isinstance(row, dict) else {}) for row in rows]
+
+
+def push_changes(user, payload):
+    """クライアントの変更をまとめて反映し、行ごとの結果を返す
+
+    payload は {"categories": [...], "todos": [...], "deleted": [...]}。
+    categories / todos の行は pull_changes が返す形で、id があれば更新、なければ
+    作成 (結果は client_id で対応づける)。base_seq (クライアントが最後に見た seq)
+    より後にサーバー側で変わった行の更新・削除は、ほかの端末の変更を上書き
+    しないように conflict で拒否する。作成・更新が先、削除が後に反映される。
+    """
+    sections = {
+        name: payload.get(name) or [] for name in ("categories", "todos", "deleted")
+    }
+    if not all(isinstance(rows, list) for rows in sections.values()):
+        raise InvalidPush("categories, todos and deleted must be lists")
+    if sum(len(rows) for rows in sections.values()) > MAX_PUSH_ROWS:
+        raise InvalidPush(f"too many rows (max {MAX_PUSH_ROWS})")
+
+    category_forms = _bind(SyncCategoryForm, sections["categories"])
+    todo_forms = _bind(SyncTodoForm, sections["todos"])
+    deletion_forms = _bind(SyncDeletionForm, sections["deleted"])
+    # 更新・削除・参照される既存の行の ID を集め、種類ごとに 1 クエリで読む
+    category_ids, todo_ids = set(), set()
+    for form in category_forms:
+        if form.is_valid():
+            category_ids.add(form.cleaned_data["id"])
+    for form in todo_forms:
+        if form.is_valid():
+            todo_ids.add(form.cleaned_data["id"])
+            category_ids.add(form.cleaned_data["category_id"])
+    for form in deletion_forms:
+        if form.is_valid():
+            if form.cleaned_data["type"] == changelog.KIND_CATEGORY:
+                category_ids.add(form.cleaned_data["id"])
+            else:
+                todo_ids.add(form.cleaned_data["id"])
+
+    results = {"categories": [], "todos": [], "deleted": []}
+    with transaction.atomic():
+        seq = changelog.next_seq(user.pk)
+        categories = Category.objects.filter(user=user).in_bulk(category_ids - {None})
+        todos = Todo.objects.filter(category__user=user).in_bulk(todo_ids - {None})
+        client_categories = _push_categories(
+            user, seq, category_forms, categories, results["categories"]
+        )
+        _push_todos(
+            user,
+            seq,
+            todo_forms,
+            categories,
+            client_categories,
+            todos,
+            results["todos"],
+        )
+        _push_deletions(seq, deletion_forms, categories, todos, results["deleted"])
+        transaction.on_commit(partial(user_cache.bump_version, user.pk))
+    return {"results": results}
@@ -1 +1,1671 @@
-from django.test import TestCase
+import asyncio
+import json
+import re
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.db.utils import ConnectionHandler
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    TestCase,
+    modify_settings,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.views import View
+
+from main.management.commands.bench_async import bench_urlconf
+from main.benchmarking import (
+    is_bench_username,
+    response_size,
+    route_requests,
+    seed_users,
+    send_request,
+)
+from main import (
+    auth,
+    bulk,
+    changelog,
+    deadlines,
+    profiling,
+    purge,
+    ranking,
+    search,
+    sync,
+    timelog,
+    transfer,
+    tree,
+    user_cache,
+)
+from main.admin import EstimatedCountPaginator, estimated_row_count
+from main.bulk import ACTION_DELETE, bulk_update_todos
+from main.models import (
+    CalendarFeedToken,
+    Category,
+    CategoryRollup,
+    DailyTimeRollup,
+    DeadlineNotification,
+    SyncTombstone,
+    TimeEntry,
+    Todo,
+    User,
+    UserRollup,
+    WeeklyTimeRollup,
+)
+from main.pagination import paginate_keyset
+from main.querybudget import (
+    QUERY_BUDGETS,
+    QueryBudgetExceeded,
+    get_budget,
+    query_budget,
+)
+from main.replicas import ReplicaReadMixin, ReplicaRouter
+from main.rollups import rebuild_rollups, verify_rollups
+from main.urls import urlpatterns
+from main.views import TodoListMixin, get_category_summaries, local_day_range
+
+
+def seed_user(username, categories, todos_per_category):
+    """categories 個のカテゴリに todos_per_category 件ずつ Todo を持つユーザーを作る"""
+    user = User.objects.create_user(username, password="pass")
+    category_objs = Category.objects.bulk_create(
+        [Category(user=user, name=f"{username}-{i}") for i in range(categories)]
+    )
+    # 今日の正午に締め切りが集中するようにして、カレンダーの日別一覧も重くする
+    noon = timezone.localtime().replace(hour=12, minute=0, second=0, microsecond=0)
+    ranks = ranking.spread_keys(todos_per_category)
+    Todo.objects.bulk_create(
+        [
+            Todo(
+                category=category,
+                title=f"todo-{j}",
+                description="説明",
+                deadline_time=noon + timedelta(minutes=j % 60, days=j // 60),
+                hour_spent=j % 4,
+                is_finished=j % 3 == 0,
+                rank=ranks[j],
+            )
+            for category in category_objs
+            for j in range(todos_per_category)
+        ]
+    )
+    rebuild_rollups(users=[user.pk])
+    return user
+
+
+class QueryBudgetTests(TestCase):
+    """どの URL もデータ量によらず決まった数のクエリで返ることを確認する"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.small = seed_user("small", categories=2, todos_per_category=3)
+        cls.large = seed_user("large", categories=20, todos_per_category=120)
+
+    def setUp(self):
+        cache.clear()
+
+    def measure(self, user, url_name, method, url, data, login):
+        if login:
+            self.client.force_login(user)
+        else:
+            self.client.logout()
+        cache.clear()
+        with query_budget(url_name, method=method.upper()) as recorder:
+            response = send_request(self.client, method, url, data)
+            response_size(response)
+        self.assertLess(response.status_code, 400, url)
+        return recorder.count
+
+    def test_every_url_has_a_budget(self):
+        url_names = {pattern.name for pattern in urlpatterns}
+        self.assertEqual(url_names - {name for name, _ in QUERY_BUDGETS}, set())
+        measured = {(spec[0], spec[1].upper()) for spec in route_requests(self.small)}
+        self.assertEqual(url_names - {name for name, _ in measured}, set())
+        self.assertEqual(measured - set(QUERY_BUDGETS), set())
+
+    def test_query_count_does_not_grow_with_rows(self):
+        small_requests = route_requests(self.small)
+        large_requests = route_requests(self.large)
+        for small_spec, large_spec in zip(small_requests, large_requests):
+            with self.subTest(url=small_spec[2]):
+                small_count = self.measure(self.small, *small_spec)
+                large_count = self.measure(self.large, *large_spec)
+                self.assertEqual(small_count, large_count)
+                budget = QUERY_BUDGETS[small_spec[0], small_spec[1].upper()]
+                self.assertLessEqual(large_count, budget)
+
+    def test_cached_pages_use_fewer_queries(self):
+        self.client.force_login(self.large)
+        category = self.large.categories.first()
+        url = reverse("todo_list", kwargs={"category_id": category.id})
+        with query_budget("todo_list") as cold:
+            self.client.get(url)
+        with query_budget("todo_list") as warm:
+            self.client.get(url)
+        self.assertLess(warm.count, cold.count)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user("keyset", categories=2, todos_per_category=120)
+        cls.category = cls.user.categories.order_by("id").first()
+        # 締め切りの重なりを作り、id で順が決まるページの境目も通す
+        todos = cls.category.todos.order_by("id")[:40]
+        Todo.objects.filter(pk__in=[todo.pk for todo in todos]).update(
+            deadline_time=timezone.now()
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def collect(self, queryset, ordering, size):
+        rows, cursor, pages = [], None, 0
+        while True:
+            page, cursor = paginate_keyset(queryset, ordering, cursor, size)
+            rows += page
+            pages += 1
+            if cursor is None:
+                return rows, pages
+
+    def test_cursor_visits_every_row_once_in_order(self):
+        queryset = Todo.objects.filter(category=self.category)
+        for name, ordering in TodoListMixin.orderings.items():
+            with self.subTest(order=name):
+                rows, pages = self.collect(queryset, ordering, size=7)
+                expected = list(queryset.order_by(*ordering))
+                self.assertEqual(rows, expected)
+                self.assertEqual(pages, -(-len(expected) // 7))
+
+    def test_last_page(self):
+        queryset = Todo.objects.filter(category=self.category)
+        ordering = TodoListMixin.orderings["deadline"]
+        # ちょうど割り切れるときも、空のページを返さずに終わる
+        for size in (120, 119, 121, 40):
+            with self.subTest(size=size):
+                page, cursor = paginate_keyset(queryset, ordering, None, size)
+                while cursor is not None:
+                    page, cursor = paginate_keyset(queryset, ordering, cursor, size)
+                self.assertTrue(page)
+                self.assertEqual(len(page), 120 % size or size)
+
+    def view_pages(self, params):
+        url = reverse("todo_list", kwargs={"category_id": self.category.id})
+        rows, query = [], None
+        while True:
+            response = self.client.get(f"{url}?{query}" if query else url, params)
+            self.assertEqual(response.status_code, 200)
+            rows += response.context["todo_list"]
+            query = response.context["next_query"]
+            if query is None:
+                return rows
+            params = {}
+
+    def test_filters_combined_with_cursor(self):
+        deadline_from = timezone.localdate() + timedelta(days=1)
+        start, _ = local_day_range(deadline_from, deadline_from)
+        cases = [
+            ({"status": "open"}, Q(is_finished=False)),
+            ({"order": "manual"}, Q()),
+            ({"deadline_from": deadline_from.isoformat()}, Q(deadline_time__gte=start)),
+            ({"status": "open", "order": "status"}, Q(is_finished=False)),
+        ]
+        for params, condition in cases:
+            with self.subTest(params=params):
+                rows = self.view_pages(params)
+                ordering = TodoListMixin.orderings[params.get("order", "deadline")]
+                expected = list(
+                    Todo.objects.filter(condition, category=self.category).order_by(
+                        *ordering
+                    )
+                )
+                self.assertGreater(len(expected), TodoListMixin.page_size)
+                self.assertEqual([todo.pk for todo in rows], [t.pk for t in expected])
+
+    def test_invalid_cursor(self):
+        url = reverse("todo_list", kwargs={"category_id": self.category.id})
+        response = self.client.get(url, {"cursor": "broken"})
+        self.assertEqual(response.status_code, 400)
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("rollup", password="pass")
+        self.category, self.other = Category.objects.bulk_create(
+            [Category(user=self.user, name=name) for name in ("a", "b")]
+        )
+        rebuild_rollups(users=[self.user.pk])
+
+    def rollups(self):
+        def values(rollup):
+            return (rollup.total_hours, rollup.finished_count, rollup.unfinished_count)
+
+        return (
+            values(CategoryRollup.objects.get(category=self.category)),
+            values(CategoryRollup.objects.get(category=self.other)),
+            values(UserRollup.objects.get(user=self.user)),
+        )
+
+    def test_todo_changes_update_rollups(self):
+        todo = Todo.objects.create(
+            category=self.category,
+            title="todo",
+            deadline_time=timezone.now(),
+            hour_spent=3,
+        )
+        self.assertEqual(self.rollups(), ((3, 0, 1), (0, 0, 0), (3, 0, 1)))
+
+        todo.hour_spent = 5
+        todo.is_finished = True
+        todo.save()
+        self.assertEqual(self.rollups(), ((5, 1, 0), (0, 0, 0), (5, 1, 0)))
+
+        todo.category = self.other
+        todo.save()
+        self.assertEqual(self.rollups(), ((0, 0, 0), (5, 1, 0), (5, 1, 0)))
+
+        todo.delete()
+        self.assertEqual(self.rollups(), ((0, 0, 0), (0, 0, 0), (0, 0, 0)))
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+
+    def test_rebuild_fixes_drift(self):
+        Todo.objects.create(
+            category=self.category,
+            title="todo",
+            deadline_time=timezone.now(),
+            hour_spent=2,
+        )
+        CategoryRollup.objects.filter(category=self.category).update(total_hours=9)
+        self.assertEqual(
+            verify_rollups(users=[self.user.pk]),
+            [("category", self.category.pk, (2, 0, 1), (9, 0, 1))],
+        )
+        with self.assertRaises(CommandError):
+            call_command(
+                "rebuild_rollups", "--verify-only", stdout=StringIO(), stderr=StringIO()
+            )
+
+        out = StringIO()
+        call_command("rebuild_rollups", stdout=out)
+        self.assertIn("rollups are in sync", out.getvalue())
+        self.assertEqual(verify_rollups(), [])
+        self.assertEqual(self.rollups()[0], (2, 0, 1))
+
+
+class SeedUsersTests(TestCase):
+    def test_seed_users(self):
+        users = seed_users(2, categories_per_user=3, todos_per_category=4, batch_size=5)
+        self.assertEqual(len(users), 2)
+        for user in users:
+            self.assertTrue(user.check_password("password"))
+            self.assertEqual(user.categories.count(), 3)
+            rollup = user.todo_rollup
+            self.assertEqual(rollup.finished_count + rollup.unfinished_count, 12)
+        self.assertEqual(Todo.objects.count(), 24)
+
+    def test_bench_commands_refuse_other_users(self):
+        User.objects.create_user("alice", password="pass")
+        for command in ("bench_routes", "bench_auth"):
+            with self.subTest(command=command):
+                with self.assertRaisesMessage(CommandError, "not a bench user"):
+                    call_command(command, username="alice", stdout=StringIO())
+        self.assertTrue(is_bench_username("seed0"))
+        self.assertTrue(is_bench_username("bench_routes_5x200_0"))
+        self.assertFalse(is_bench_username("seedling"))
+
+    @override_settings(ALLOWED_HOSTS=["localhost"])
+    def test_bench_routes_reports_user_cache_stats(self):
+        out = StringIO()
+        call_command(
+            "bench_routes", categories=1, todos=3, iterations=2, warmup=0, stdout=out
+        )
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["routes"]["/mypage"]["status"], 200)
+        self.assertGreater(report["user_cache"]["hits"], 0)
+        self.assertGreater(report["user_cache"]["misses"], 0)
+
+
+class TodoSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("searcher", password="pass")
+        self.other = User.objects.create_user("other", password="pass")
+        self.category = Category.objects.create(user=self.user, name="仕事")
+        other_category = Category.objects.create(user=self.other, name="仕事")
+        deadline = timezone.now()
+        self.meeting = Todo.objects.create(
+            category=self.category, title="定例会議の資料作成", deadline_time=deadline
+        )
+        self.report = Todo.objects.create(
+            category=self.category,
+            title="週報",
+            description="定例会議の議事録をまとめる",
+            deadline_time=deadline,
+        )
+        Todo.objects.create(
+            category=other_category, title="定例会議の準備", deadline_time=deadline
+        )
+
+    def search(self, query):
+        return search.search_todos(self.user, query).todos
+
+    def test_ranks_title_matches_first_and_scopes_to_user(self):
+        self.assertEqual(self.search("定例会議"), [self.meeting, self.report])
+
+    def test_short_terms(self):
+        self.assertEqual(self.search("週報"), [self.report])
+        self.assertEqual(self.search("定例 資料"), [self.meeting])
+
+    def test_index_follows_writes(self):
+        self.meeting.title = "打ち合わせ"
+        self.meeting.save()
+        Todo.objects.filter(pk=self.report.pk).update(title="月次レポート")
+        self.assertEqual(self.search("打ち合わせ"), [self.meeting])
+        self.assertEqual(self.search("レポート"), [self.report])
+        self.report.delete()
+        self.assertEqual(self.search("レポート"), [])
+
+    def test_pagination(self):
+        now = timezone.now()
+        Todo.objects.bulk_create(
+            [
+                Todo(category=self.category, title=f"検索対象{i}", deadline_time=now)
+                for i in range(5)
+            ]
+        )
+        first = search.search_todos(self.user, "検索対象", page=1, page_size=3)
+        second = search.search_todos(self.user, "検索対象", page=2, page_size=3)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertEqual(len({todo.pk for todo in first.todos + second.todos}), 5)
+
+
+class ListSink:
+    def __init__(self):
+        self.batches = []
+
+    def emit(self, kind, rows):
+        self.batches.append((kind, [todo_id for todo_id, _ in rows]))
+
+
+class DeadlineScannerTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user("scanner", password="pass")
+        self.category = Category.objects.create(user=user, name="締め切り")
+        self.now = timezone.now()
+        deadlines.scan(deadlines.KIND_OVERDUE, [], now=self.now)
+
+    def create_todo(self, minutes, **kwargs):
+        return Todo.objects.create(
+            category=self.category,
+            title="todo",
+            deadline_time=self.now + timedelta(minutes=minutes),
+            **kwargs,
+        )
+
+    def test_each_todo_is_emitted_once_in_batches(self):
+        todos = [self.create_todo(minutes) for minutes in (1, 2, 2, 3, 90)]
+        self.create_todo(2, is_finished=True)
+        sink = ListSink()
+        later = self.now + timedelta(minutes=5)
+        count = deadlines.scan(deadlines.KIND_OVERDUE, [sink], now=later, batch_size=2)
+        self.assertEqual(count, 4)
+        self.assertEqual(
+            [ids for _, ids in sink.batches],
+            [[todos[0].pk, todos[1].pk], [todos[2].pk, todos[3].pk]],
+        )
+        self.assertEqual(deadlines.scan(deadlines.KIND_OVERDUE, [sink], now=later), 0)
+
+    def test_sinks_run_after_commit_and_failures_are_not_resent(self):
+        todo = self.create_todo(1)
+        later = self.now + timedelta(minutes=5)
+        depth = len(connection.atomic_blocks)
+
+        class FailingSink:
+            def emit(self, kind, rows):
+                raise ConnectionError
+
+        class AtomicDepthSink(ListSink):
+            def emit(self, kind, rows):
+                self.depth = len(connection.atomic_blocks)
+                super().emit(kind, rows)
+
+        sink = AtomicDepthSink()
+        with self.assertLogs("main.deadlines", "ERROR"):
+            count = deadlines.scan(
+                deadlines.KIND_OVERDUE, [FailingSink(), sink], now=later
+            )
+        self.assertEqual(count, 1)
+        self.assertEqual(sink.depth, depth)
+        self.assertEqual([ids for _, ids in sink.batches], [[todo.pk]])
+        self.assertEqual(deadlines.scan(deadlines.KIND_OVERDUE, [sink], now=later), 0)
+        self.assertEqual(len(sink.batches), 1)
+
+    def test_upcoming_rescans_the_window(self):
+        first = self.create_todo(10)
+        self.create_todo(90)
+        sink = ListSink()
+
+        def scan(now):
+            return deadlines.scan(deadlines.KIND_UPCOMING, [sink], now=now)
+
+        self.assertEqual(scan(self.now), 1)
+        # 前の tick の後に作られた、前の tick で読んだ位置より前の締め切り
+        later = self.now + timedelta(minutes=1)
+        second = self.create_todo(5)
+        self.assertEqual(scan(later), 1)
+        self.assertEqual(scan(later), 0)
+        self.assertEqual([ids for _, ids in sink.batches], [[first.pk], [second.pk]])
+        self.assertEqual(
+            DeadlineNotification.objects.filter(kind=deadlines.KIND_UPCOMING).count(), 2
+        )
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = seed_user("conditional", categories=2, todos_per_category=3)
+        self.category = self.user.categories.order_by("id").first()
+        self.urls = [
+            reverse("home"),
+            reverse("todo_list", kwargs={"category_id": self.category.id}),
+            reverse("calendar"),
+            reverse("mypage_chart"),
+        ]
+
+    def assert_not_modified_until_write(self, client):
+        for url in self.urls:
+            with self.subTest(url=url):
+                first = client.get(url)
+                self.assertEqual(first.status_code, 200)
+                headers = {"If-None-Match": first["ETag"]}
+                # セッションもユーザーもキャッシュから読むので、DB を読まずに返す
+                with self.assertNumQueries(0):
+                    second = client.get(url, headers=headers)
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second["ETag"], first["ETag"])
+
+                todo = self.category.todos.first()
+                todo.hour_spent += 1
+                with self.captureOnCommitCallbacks(execute=True):
+                    todo.save()
+                self.assertEqual(client.get(url, headers=headers).status_code, 200)
+
+    def test_sync_views(self):
+        self.client.force_login(self.user)
+        self.assert_not_modified_until_write(self.client)
+
+    def test_async_views(self):
+        self.client.force_login(self.user)
+        with override_settings(ROOT_URLCONF=bench_urlconf(use_async=True)):
+            self.assert_not_modified_until_write(self.client)
+
+    def test_default_time_chart_changes_the_next_day(self):
+        self.client.force_login(self.user)
+        url = reverse("mypage_time_chart")
+        tomorrow = timezone.now() + timedelta(days=1)
+        for use_async in (False, True):
+            with self.subTest(use_async=use_async), override_settings(
+                ROOT_URLCONF=bench_urlconf(use_async=use_async)
+            ):
+                first = self.client.get(url)
+                headers = {"If-None-Match": first["ETag"]}
+                self.assertEqual(self.client.get(url, headers=headers).status_code, 304)
+                # 日付が変わると既定の期間 (今日までの 30 日) がずれる
+                with mock.patch("django.utils.timezone.now", return_value=tomorrow):
+                    response = self.client.get(url, headers=headers)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], first["ETag"])
+
+    def test_writes_in_the_same_second_change_the_validator(self):
+        self.client.force_login(self.user)
+        url = reverse("home")
+        todo = self.category.todos.first()
+        second = user_cache.get_version(self.user.pk) // 10**9 + 1
+        etags = []
+        for offset in (1, 2):
+            with mock.patch.object(
+                user_cache.time, "time_ns", return_value=second * 10**9 + offset
+            ):
+                todo.hour_spent += 1
+                with self.captureOnCommitCallbacks(execute=True):
+                    todo.save()
+            response = self.client.get(url)
+            self.assertNotIn("Last-Modified", response)
+            etags.append(response["ETag"])
+        self.assertNotEqual(etags[0], etags[1])
+        # 秒単位の If-Modified-Since では同じ秒の 2 回目の書き込みを見落とすので使わない
+        response = self.client.get(
+            url, headers={"If-Modified-Since": http_date(second)}
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class AsyncViewTests(TestCase):
+    """非同期版の読み取りビューが同期版と同じ応答を返すことを確かめる"""
+
+    def setUp(self):
+        self.user = seed_user("async", categories=3, todos_per_category=70)
+        timelog.log_time(Todo.objects.first(), 2, timezone.localdate())
+        self.client.force_login(self.user)
+
+    def get(self, url, use_async):
+        cache.clear()
+        with override_settings(ROOT_URLCONF=bench_urlconf(use_async=use_async)):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        # CSRF トークンはリクエストごとにマスクが変わる
+        content = re.sub(
+            r'name="csrfmiddlewaretoken" value="[^"]+"',
+            'name="csrfmiddlewaretoken"',
+            response.content.decode(),
+        )
+        return content, response["Content-Type"]
+
+    def test_same_output_as_sync_views(self):
+        category = self.user.categories.order_by("id").first()
+        today = timezone.localdate()
+        with override_settings(ROOT_URLCONF=bench_urlconf(use_async=False)):
+            todo_list = reverse("todo_list", kwargs={"category_id": category.id})
+            cursor = self.client.get(todo_list).context["next_query"]
+            urls = [
+                reverse("home"),
+                todo_list,
+                f"{todo_list}?{cursor}",
+                f"{todo_list}?order=status&status=open",
+                reverse("calendar") + f"?day={today:%Y-%m-%d}",
+                reverse("mypage"),
+                reverse("mypage_chart"),
+                reverse("mypage_time_chart")
+                + f"?start={today - timedelta(days=7)}&end={today}",
+            ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url, False), self.get(url, True))
+
+
+class CategorySummaryTests(TestCase):
+    def test_counts_and_next_deadline(self):
+        cache.clear()
+        user = seed_user("summary", categories=3, todos_per_category=4)
+        category = user.categories.order_by("name").first()
+        # 期限切れの未完了は「次の締め切り」にしない
+        past = category.todos.create(
+            title="past", deadline_time=timezone.now() - timedelta(days=2)
+        )
+        with self.assertNumQueries(1):
+            get_category_summaries(user)
+        self.client.force_login(user)
+        rows = self.client.get(reverse("category_summary")).json()["categories"]
+        self.assertEqual([row["id"] for row in rows][:1], [category.pk])
+        self.assertEqual(rows[0]["todo_count"], 5)
+        # seed_user は j % 3 == 0 (0, 3) を完了済みにする
+        self.assertEqual(rows[0]["unfinished_count"], 3)
+        self.assertEqual(rows[0]["total_hours"], 0 + 1 + 2 + 3)
+        upcoming = category.todos.filter(is_finished=False).exclude(pk=past.pk)
+        expected = min(todo.deadline_time for todo in upcoming)
+        self.assertEqual(rows[0]["next_deadline"][:19], expected.isoformat()[:19])
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = seed_user("versioned", categories=1, todos_per_category=2)
+        self.other = seed_user("unrelated", categories=1, todos_per_category=2)
+        self.todo = Todo.objects.filter(category__user=self.user).first()
+        self.builds = []
+
+    def build(self):
+        self.builds.append(len(self.builds))
+        return self.builds[-1]
+
+    def cached(self):
+        return user_cache.get_or_set(self.user.pk, "value", self.build)
+
+    def test_write_bumps_the_version_on_commit(self):
+        version = user_cache.get_version(self.user.pk)
+        other_version = user_cache.get_version(self.other.pk)
+        self.assertEqual((self.cached(), self.cached()), (0, 0))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.todo.title = "changed"
+            self.todo.save()
+            # コミットまでは古いバージョンのまま
+            self.assertEqual(user_cache.get_version(self.user.pk), version)
+        self.assertEqual(self.cached(), 0)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(user_cache.get_version(self.user.pk), version)
+        self.assertEqual(user_cache.get_version(self.other.pk), other_version)
+        self.assertEqual(self.cached(), 1)
+
+    def test_rolled_back_write_keeps_the_version(self):
+        version = user_cache.get_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.todo.title = "changed"
+                self.todo.save()
+                raise ValueError
+        self.assertEqual(user_cache.get_version(self.user.pk), version)
+
+    def test_bump_always_moves_forward(self):
+        version = user_cache.get_version(self.user.pk)
+        with mock.patch.object(user_cache.time, "time_ns", return_value=version):
+            user_cache.bump_version(self.user.pk)
+            user_cache.bump_version(self.user.pk)
+        self.assertEqual(user_cache.get_version(self.user.pk), version + 2)
+
+    def test_stats_count_a_miss_then_a_hit(self):
+        user_cache.reset_stats()
+        self.assertEqual((self.cached(), self.cached()), (0, 0))
+        self.assertEqual(user_cache.stats(), {"hits": 1, "misses": 1})
+        user_cache.reset_stats()
+        self.assertEqual(user_cache.stats(), {"hits": 0, "misses": 0})
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        auth.clear()
+        self.user = User.objects.create_user("cached", password="old-pass")
+        self.client.force_login(self.user)
+        self.url = reverse("mypage")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_session_and_user_come_from_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn("django_session", tables)
+        self.assertNotIn("main_user", tables)
+
+    def test_password_change_logs_out_other_sessions(self):
+        self.user.set_password("new-pass")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_deactivated_user_is_logged_out(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+
+class CalendarDayCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("calendar", password="pass")
+        self.category = Category.objects.create(user=self.user, name="予定")
+        self.client.force_login(self.user)
+
+    def create_todos(self, *deadlines, **kwargs):
+        for deadline in deadlines:
+            Todo.objects.create(
+                category=self.category,
+                title="todo",
+                deadline_time=timezone.make_aware(deadline),
+                **kwargs,
+            )
+
+    def day_counts(self, **params):
+        response = self.client.get(
+            reverse("calendar"), {"year": 2024, "month": 3, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        counts = {
+            day["date"]: (day["unfinished"], day["total"])
+            for week in response.context["calendar_weeks"]
+            for day in week
+            if day["total"]
+        }
+        return counts, response.context["todos"]
+
+    def test_days_split_at_local_midnight(self):
+        self.create_todos(
+            datetime(2024, 3, 9, 23, 59, 59),
+            datetime(2024, 3, 10, 0, 0),
+            datetime(2024, 3, 11, 0, 0),
+        )
+        self.create_todos(datetime(2024, 3, 10, 23, 59, 59), is_finished=True)
+        # 表示する 6 週 (2/25〜4/6) の外側の前後の日
+        self.create_todos(datetime(2024, 2, 24, 23, 59), datetime(2024, 4, 7, 0, 0))
+        self.create_todos(datetime(2024, 2, 25, 0, 0), datetime(2024, 4, 6, 23, 59))
+
+        counts, todos = self.day_counts(day="2024-03-10")
+        self.assertEqual(
+            counts,
+            {
+                date(2024, 2, 25): (1, 1),
+                date(2024, 3, 9): (1, 1),
+                date(2024, 3, 10): (1, 2),
+                date(2024, 3, 11): (1, 1),
+                date(2024, 4, 6): (1, 1),
+            },
+        )
+        self.assertEqual(len(todos), 2)
+
+    def test_days_follow_the_current_time_zone(self):
+        # 東京の 3/10 8:00 は UTC では 3/9 23:00
+        self.create_todos(datetime(2024, 3, 10, 8, 0))
+        self.assertEqual(self.day_counts()[0], {date(2024, 3, 10): (1, 1)})
+        with timezone.override("UTC"):
+            cache.clear()
+            self.assertEqual(self.day_counts()[0], {date(2024, 3, 9): (1, 1)})
+
+    def test_invalid_parameters_are_bad_requests(self):
+        for use_async in (False, True):
+            with override_settings(ROOT_URLCONF=bench_urlconf(use_async=use_async)):
+                for params in (
+                    {"month": 13},
+                    {"month": "x"},
+                    {"year": 0},
+                    {"day": "abc"},
+                    {"day": "2024-02-30"},
+                ):
+                    with self.subTest(use_async=use_async, **params):
+                        response = self.client.get(reverse("calendar"), params)
+                        self.assertEqual(response.status_code, 400)
+                response = self.client.get(reverse("calendar"), {"day": "2024-03-10"})
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, "2024-03-10 のTodo")
+
+
+class CalendarFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("feed", password="pass")
+        category = Category.objects.create(user=user, name="仕事, 私用")
+        now = timezone.now()
+        self.todo = Todo.objects.create(
+            category=category,
+            title="長いタイトル" * 10,
+            description="1行目\n2行目",
+            deadline_time=now,
+        )
+        Todo.objects.create(
+            category=category, title="古い", deadline_time=now - timedelta(days=400)
+        )
+        self.token = CalendarFeedToken.objects.create(user=user).token
+        self.url = reverse("calendar_feed", kwargs={"token": self.token})
+
+    def get_feed(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        body = b"".join(response.streaming_content) if response.streaming else b""
+        return response, body.decode()
+
+    def test_feed(self):
+        response, body = self.get_feed(self.url)
+        self.assertEqual(response["Content-Type"], "text/calendar; charset=utf-8")
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR\r\n"))
+        self.assertEqual(body.count("BEGIN:VEVENT"), 1)
+        self.assertIn(f"UID:todo-{self.todo.pk}@", body)
+        self.assertIn("CATEGORIES:仕事\\, 私用", body)
+        self.assertIn("DESCRIPTION:1行目\\n2行目", body)
+        for line in body.split("\r\n"):
+            self.assertLessEqual(len(line.encode()), 75)
+
+        today = timezone.localdate()
+        start = today - timedelta(days=500)
+        window = f"?start={start:%Y-%m-%d}&end={today:%Y-%m-%d}"
+        _, body = self.get_feed(self.url + window)
+        self.assertEqual(body.count("BEGIN:VEVENT"), 2)
+
+    def test_conditional_and_invalid_requests(self):
+        response, _ = self.get_feed(self.url)
+        with self.assertNumQueries(1):
+            cached, _ = self.get_feed(self.url, **{"If-None-Match": response["ETag"]})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(self.get_feed(self.url + "?start=x")[0].status_code, 400)
+        bad_url = reverse("calendar_feed", kwargs={"token": "wrong"})
+        self.assertEqual(self.get_feed(bad_url)[0].status_code, 404)
+
+
+class TimeEntryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("timelog", password="pass")
+        self.category = Category.objects.create(user=self.user, name="作業")
+        self.todo = Todo.objects.create(
+            category=self.category, title="todo", deadline_time=timezone.now()
+        )
+        # 2024-01-01 は月曜日
+        self.monday = date(2024, 1, 1)
+
+    def period_hours(self):
+        daily = dict(DailyTimeRollup.objects.values_list("day", "hours"))
+        weekly = dict(WeeklyTimeRollup.objects.values_list("week_start", "hours"))
+        return daily, weekly
+
+    def test_log_time_updates_rollups(self):
+        timelog.log_time(self.todo, 2, self.monday)
+        timelog.log_time(self.todo, 3, self.monday + timedelta(days=2))
+        timelog.log_time(self.todo, 1, self.monday + timedelta(days=7))
+        daily, weekly = self.period_hours()
+        self.assertEqual(sum(daily.values()), 6)
+        self.assertEqual(weekly, {self.monday: 5, self.monday + timedelta(days=7): 1})
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.hour_spent, 6)
+        rollup = CategoryRollup.objects.get(category=self.category)
+        self.assertEqual(rollup.total_hours, 6)
+
+        granularity, rows = timelog.period_rows(
+            self.user, self.monday, self.monday + timedelta(days=6)
+        )
+        self.assertEqual(granularity, "day")
+        self.assertEqual([hours for _, _, hours in rows], [2, 3])
+
+    def test_deleting_todos_subtracts_entries(self):
+        timelog.log_time(self.todo, 2, self.monday)
+        other = Todo.objects.create(
+            category=self.category, title="other", deadline_time=timezone.now()
+        )
+        timelog.log_time(other, 4, self.monday)
+        self.todo.delete()
+        self.assertEqual(self.period_hours(), ({self.monday: 4}, {self.monday: 4}))
+        bulk_update_todos(self.user, [other.pk], ACTION_DELETE)
+        self.assertEqual(self.period_hours(), ({self.monday: 0}, {self.monday: 0}))
+        self.category.delete()
+        self.assertEqual(self.period_hours(), ({}, {}))
+
+    def test_editing_hour_spent_records_the_difference(self):
+        self.client.force_login(self.user)
+        url = reverse(
+            "todo_update",
+            kwargs={"category_id": self.category.id, "todo_id": self.todo.id},
+        )
+        response = self.client.post(
+            url,
+            {
+                "title": "todo",
+                "description": "",
+                "deadline_time": timezone.localtime().strftime("%Y-%m-%dT%H:%M"),
+                "hour_spent": 3,
+            },
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            list(self.todo.time_entries.values_list("hours", flat=True)), [3]
+        )
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = seed_user("sync", categories=2, todos_per_category=3)
+        self.client.force_login(self.user)
+        self.category = self.user.categories.order_by("id").first()
+
+    def pull(self, cursor=None, limit=None):
+        params = {"cursor": cursor or "", "limit": limit or ""}
+        response = self.client.get(reverse("sync_changes"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def pull_all(self, cursor=None, limit=2):
+        pages = []
+        while True:
+            page = self.pull(cursor, limit)
+            pages.append(page)
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                return pages, cursor
+
+    def push(self, payload):
+        response = self.client.post(
+            reverse("sync_push"), payload, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_pull_returns_only_changes_in_order(self):
+        pages, cursor = self.pull_all()
+        self.assertEqual(sum(len(page["todos"]) for page in pages), 6)
+        self.assertEqual(self.pull(cursor)["todos"], [])
+
+        todo_ids = list(self.category.todos.values_list("id", flat=True))
+        # 同じ同期番号の 3 行をページの境目をまたいで読む
+        bulk_update_todos(self.user, todo_ids, ACTION_DELETE)
+        other = self.user.categories.order_by("id").last()
+        todo = other.todos.first()
+        todo.title = "変更"
+        todo.save()
+        pages, cursor = self.pull_all(cursor)
+        self.assertEqual(
+            [row["id"] for page in pages for row in page["todos"]], [todo.pk]
+        )
+        deleted = [row for page in pages for row in page["deleted"]]
+        self.assertEqual(sorted(row["id"] for row in deleted), sorted(todo_ids))
+        self.assertEqual(self.pull(cursor)["deleted"], [])
+
+    def test_push(self):
+        todo = self.category.todos.order_by("id").first()
+        row = {
+            "id": todo.pk,
+            "category_id": self.category.pk,
+            "title": "更新",
+            "deadline_time": "2030-01-01T09:00:00+09:00",
+            "hour_spent": todo.hour_spent + 2,
+            "base_seq": todo.sync_seq,
+        }
+        results = self.push(
+            {
+                "categories": [{"client_id": "c1", "name": "新しいカテゴリ"}],
+                "todos": [
+                    row,
+                    {
+                        **row,
+                        "id": None,
+                        "client_id": "t1",
+                        "category_id": None,
+                        "category_client_id": "c1",
+                    },
+                    {"client_id": "t2", "category_id": self.category.pk},
+                ],
+            }
+        )
+        self.assertEqual(results["categories"][0]["status"], sync.STATUS_OK)
+        self.assertEqual(
+            [result["status"] for result in results["todos"]],
+            [sync.STATUS_OK, sync.STATUS_OK, sync.STATUS_INVALID],
+        )
+        created = Todo.objects.get(pk=results["todos"][1]["id"])
+        self.assertEqual(created.category_id, results["categories"][0]["id"])
+        todo.refresh_from_db()
+        self.assertEqual(todo.title, "更新")
+        self.assertEqual(todo.time_entries.get().hours, 2)
+
+        # 古い base_seq のままの更新・削除はほかの端末の変更を上書きしない
+        stale = self.push(
+            {
+                "todos": [row],
+                "deleted": [{"type": "todo", "id": todo.pk, "base_seq": 0}],
+            }
+        )
+        self.assertEqual(stale["todos"][0]["status"], sync.STATUS_CONFLICT)
+        self.assertEqual(stale["deleted"][0]["status"], sync.STATUS_CONFLICT)
+        results = self.push({"deleted": [{"type": "category", "id": self.category.pk}]})
+        self.assertEqual(results["deleted"][0]["status"], sync.STATUS_OK)
+        self.assertFalse(Todo.objects.filter(pk=todo.pk).exists())
+
+    @modify_settings(MIDDLEWARE={"prepend": "main.middleware.QueryBudgetMiddleware"})
+    def test_push_uses_one_seq(self):
+        first, other = self.user.categories.order_by("id")
+        todo, doomed = first.todos.order_by("id")[:2]
+        row = {
+            "id": todo.pk,
+            "category_id": first.pk,
+            "title": "更新",
+            "deadline_time": "2030-01-01T09:00:00+09:00",
+            "hour_spent": todo.hour_spent + 1,
+            "base_seq": todo.sync_seq,
+        }
+        # 作成・更新・削除をすべて含む push でも、上限内で同じクエリを繰り返さない
+        with self.assertNoLogs("main.middleware", "WARNING"):
+            results = self.push(
+                {
+                    "categories": [
+                        {"client_id": "c1", "name": "新しいカテゴリ"},
+                        {"id": first.pk, "name": "改名"},
+                    ],
+                    "todos": [
+                        row,
+                        {**row, "id": None, "client_id": "t1", "base_seq": None},
+                    ],
+                    "deleted": [
+                        {"type": "todo", "id": doomed.pk},
+                        {"type": "category", "id": other.pk},
+                    ],
+                }
+            )
+        seq = results["todos"][0]["seq"]
+        todo.refresh_from_db()
+        self.assertEqual(todo.sync_seq, seq)
+        self.assertEqual(
+            set(SyncTombstone.objects.values_list("sync_seq", flat=True)), {seq}
+        )
+        self.assertEqual(SyncTombstone.objects.count(), 5)
+
+    def test_expired_cursor(self):
+        _, cursor = self.pull_all()
+        self.category.todos.first().delete()
+        changelog.purge_tombstones(timezone.now() + timedelta(seconds=1))
+        response = self.client.get(reverse("sync_changes"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 410)
+        response = self.client.get(reverse("sync_changes"), {"cursor": "broken"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TodoTreeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("tree", password="pass")
+        self.category = Category.objects.create(user=self.user, name="計画")
+        self.root = self.add("root", None, hour_spent=1)
+        self.child = self.add("child", self.root, hour_spent=2, is_finished=True)
+        self.leaf = self.add("leaf", self.child, hour_spent=3)
+        self.other = self.add("other", None)
+
+    def add(self, title, parent, **fields):
+        return Todo.objects.create(
+            category=self.category,
+            title=title,
+            deadline_time=timezone.now(),
+            parent=parent,
+            **fields,
+        )
+
+    def test_load_subtree_in_one_query(self):
+        with self.assertNumQueries(1):
+            root = tree.load_subtree(self.root)
+        self.assertEqual((root.subtree_hours, root.subtree_count), (6, 3))
+        self.assertEqual(root.progress, 33)
+        (child,) = root.subtasks
+        self.assertEqual([leaf.title for leaf in child.subtasks], ["leaf"])
+        self.assertEqual((child.subtree_hours, child.progress), (5, 50))
+
+    def test_move_subtree(self):
+        tree.move_subtree(self.child, self.other)
+        self.leaf.refresh_from_db()
+        self.assertEqual(tree.depth(self.leaf.path), 3)
+        self.assertEqual(tree.load_subtree(self.other).subtree_hours, 5)
+        self.assertEqual(tree.load_subtree(self.root).subtree_count, 1)
+        with self.assertRaises(tree.InvalidMove):
+            tree.move_subtree(self.other, self.leaf)
+
+    def test_delete_removes_subtasks(self):
+        bulk_update_todos(self.user, [self.root.pk], ACTION_DELETE)
+        self.assertEqual(list(Todo.objects.all()), [self.other])
+        rollup = CategoryRollup.objects.get(category=self.category)
+        self.assertEqual(rollup.total_hours, 0)
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ranking", password="pass")
+        self.category = Category.objects.create(user=self.user, name="並び順")
+        self.todos = [
+            Todo.objects.create(
+                category=self.category, title=f"todo-{i}", deadline_time=timezone.now()
+            )
+            for i in range(5)
+        ]
+        self.client.force_login(self.user)
+
+    def titles(self):
+        return list(
+            self.category.todos.order_by("rank", "id").values_list("title", flat=True)
+        )
+
+    def reorder(self, todo, **data):
+        url = reverse(
+            "todo_reorder",
+            kwargs={"category_id": self.category.pk, "todo_id": todo.pk},
+        )
+        return self.client.post(url, data)
+
+    def test_move_writes_one_row(self):
+        self.assertEqual(self.titles(), [f"todo-{i}" for i in range(5)])
+        before = dict(self.category.todos.values_list("id", "rank"))
+        self.reorder(self.todos[4], after=self.todos[0].pk)
+        self.reorder(self.todos[0], direction="down")
+        after = dict(self.category.todos.values_list("id", "rank"))
+        changed = {pk for pk in after if after[pk] != before[pk]}
+        self.assertEqual(changed, {self.todos[4].pk, self.todos[0].pk})
+        self.assertEqual(
+            self.titles(), ["todo-4", "todo-0", "todo-1", "todo-2", "todo-3"]
+        )
+
+    def test_rebalance(self):
+        # 順位が未設定の行どうしの間には入れられないので、その場で振り直す
+        self.category.todos.update(rank="")
+        self.reorder(self.todos[3], before=self.todos[1].pk)
+        self.assertEqual(
+            self.titles(), ["todo-0", "todo-3", "todo-1", "todo-2", "todo-4"]
+        )
+        Todo.objects.filter(pk=self.todos[2].pk).update(rank="i" * 20)
+        order = self.titles()
+        call_command("rebalance_ranks", stdout=StringIO())
+        self.assertEqual(self.titles(), order)
+        ranks = self.category.todos.values_list("rank", flat=True)
+        self.assertLessEqual(max(len(rank) for rank in ranks), 2)
+
+    def test_front_inserts_rebalance(self):
+        for i in range(200):
+            todo = self.todos[4 - i % 5]
+            first = self.category.todos.order_by("rank", "id").first()
+            ranking.move(todo, before=first)
+        self.assertEqual(self.titles(), [f"todo-{i}" for i in range(5)])
+        ranks = self.category.todos.values_list("rank", flat=True)
+        self.assertLessEqual(max(len(rank) for rank in ranks), ranking.REBALANCE_LENGTH)
+
+
+class ReadAliasView(ReplicaReadMixin, View):
+    """読み込みの振り分け先をそのまま返す"""
+
+    def get(self, request):
+        return HttpResponse(ReplicaRouter().db_for_read(Todo))
+
+    post = get
+
+
+@override_settings(REPLICA_DATABASES=["replica1"])
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("replica", password="pass")
+        # 最後の書き込みは 1 分前
+        cache.set(
+            user_cache.version_key(self.user.pk),
+            time.time_ns() - 60 * 1_000_000_000,
+            None,
+        )
+
+    def read_alias(self, method="get"):
+        request = getattr(RequestFactory(), method)("/")
+        request.user = self.user
+        return ReadAliasView.as_view()(request).content.decode()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.read_alias(), "replica1")
+        self.assertEqual(self.read_alias("post"), "default")
+        # ビューの外ではプライマリに戻る
+        self.assertEqual(ReplicaRouter().db_for_read(Todo), "default")
+        self.assertEqual(ReplicaRouter().db_for_write(Todo), "default")
+
+    def test_sticky_after_write(self):
+        user_cache.bump_version(self.user.pk)
+        self.assertEqual(self.read_alias(), "default")
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            self.assertEqual(self.read_alias(), "replica1")
+
+
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        self.user = seed_user("timing", categories=2, todos_per_category=3)
+        self.client.force_login(self.user)
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    def test_header_breaks_down_time(self):
+        cache.clear()
+        header = self.client.get(reverse("home"))["Server-Timing"]
+        names = [entry.split(";")[0] for entry in header.split(", ")]
+        self.assertEqual(names, ["db", "template", "app", "total"], header)
+        self.assertIn(" queries", header)
+        header = self.client.get(reverse("mypage_chart"))["Server-Timing"]
+        self.assertIn("chart;dur=", header)
+
+    def test_async_chain_is_not_wrapped_in_a_thread(self):
+        self.assertNotIsInstance(ASGIHandler()._middleware_chain, SyncToAsync)
+
+    async def test_async_request_is_measured(self):
+        await sync_to_async(cache.clear)()
+        await self.async_client.aforce_login(self.user)
+        with override_settings(ROOT_URLCONF=bench_urlconf(use_async=True)):
+            response = await self.async_client.get(reverse("mypage_chart"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("chart;dur=", response["Server-Timing"])
+        # ORM が動くスレッドの接続でも数える
+        self.assertIn('queries"', response["Server-Timing"])
+        self.assertGreater(int(response["X-Query-Count"]), 0)
+
+    def test_sampled_request_is_profiled(self):
+        with self.settings(PROFILE_SAMPLE_RATE=1, PROFILE_DIR=self.directory):
+            self.client.get(reverse("calendar"))
+        suffixes = sorted(path.suffix for path in self.directory.iterdir())
+        self.assertEqual(suffixes, [".prof", ".txt"])
+        report = next(self.directory.glob("*.txt")).read_text(encoding="utf-8")
+        self.assertIn("# cProfile", report)
+        self.assertIn('FROM "main_todo"', report)
+
+    def test_slow_request_keeps_stack_samples(self):
+        with self.settings(PROFILE_SLOW_MS=0.001, PROFILE_DIR=self.directory):
+            self.client.get(reverse("calendar"))
+        (path,) = self.directory.iterdir()
+        self.assertIn("calendar", path.name)
+        self.assertIn("# stack samples", path.read_text(encoding="utf-8"))
+
+    async def test_async_requests_are_not_profiled(self):
+        # イベントループのスレッドで重なるので、cProfile もスタックも取らない
+        await self.async_client.aforce_login(self.user)
+        with override_settings(
+            ROOT_URLCONF=bench_urlconf(use_async=True),
+            PROFILE_SAMPLE_RATE=1,
+            PROFILE_SLOW_MS=0.001,
+            PROFILE_DIR=self.directory,
+        ):
+            responses = await asyncio.gather(
+                *[self.async_client.get(reverse("mypage_chart")) for _ in range(3)]
+            )
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_sampler_keeps_requests_on_one_thread_apart(self):
+        sampler = profiling.StackSampler(interval=0.001)
+        first, second = sampler.watch(), sampler.watch()
+        sampler.unwatch(first)
+        stopped = Counter(first)
+        time.sleep(0.05)
+        self.assertEqual(first, stopped)
+        self.assertTrue(second)
+        sampler.unwatch(second)
+
+    def test_span_outside_request_is_noop(self):
+        with profiling.span("chart"):
+            pass
+        timings = profiling.Timings()
+        with profiling.measure(timings), profiling.span("chart"):
+            with profiling.span("db"):
+                pass
+        timings.finish()
+        self.assertEqual(timings.counts, {"chart": 1, "db": 1})
+        self.assertLessEqual(sum(timings.durations.values()), timings.total + 1e-9)
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.user = seed_user("soft", categories=2, todos_per_category=5)
+        self.category, self.other = self.user.categories.order_by("id")
+        self.todo = self.category.todos.order_by("id").first()
+        timelog.log_time(self.todo, 2, date(2024, 1, 1))
+        # 別のカテゴリにあるサブタスクも、親と一緒に消える
+        self.subtask = Todo.objects.create(
+            category=self.other,
+            parent=self.todo,
+            title="subtask",
+            deadline_time=timezone.now(),
+            hour_spent=1,
+        )
+
+    def purge(self):
+        out = StringIO()
+        call_command("purge_deleted", chunk_size=2, stdout=out)
+        return out.getvalue()
+
+    def test_category_is_hidden_then_purged(self):
+        # Todo は UPDATE 文 1 本で削除待ちにするので、Todo の件数によらない
+        with self.assertNumQueries(16):
+            purge.delete_categories(Category.objects.filter(pk=self.category.pk))
+        self.assertEqual(list(self.user.categories.all()), [self.other])
+        self.assertFalse(Todo.objects.filter(category=self.category).exists())
+        self.assertEqual(
+            Todo.all_objects.filter(category=self.category, is_deleted=True).count(), 5
+        )
+        # 既定のマネージャーはカテゴリを結合しない
+        self.assertNotIn("main_category", str(Todo.objects.all().query))
+        found = search.search_todos(self.user, "todo", page_size=50).todos
+        self.assertEqual({todo.category_id for todo in found}, {self.other.pk})
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+        self.assertFalse(DailyTimeRollup.objects.exists())
+        # 行は残っている
+        self.assertEqual(Todo.all_objects.filter(category=self.category).count(), 5)
+
+        self.assertIn("purged 6 todos and 1 categories", self.purge())
+        self.assertFalse(Category.all_objects.filter(pk=self.category.pk).exists())
+        self.assertFalse(Todo.all_objects.filter(is_deleted=True).exists())
+        self.assertFalse(Todo.all_objects.filter(pk=self.subtask.pk).exists())
+        self.assertFalse(TimeEntry.objects.exists())
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+        indexed, todos = search.verify_index()
+        self.assertEqual(indexed, todos)
+        deleted = SyncTombstone.objects.filter(user=self.user, kind="todo")
+        self.assertEqual(deleted.count(), 6)
+
+    def test_bulk_delete_is_hidden_then_purged(self):
+        bulk_update_todos(self.user, [self.todo.pk], ACTION_DELETE)
+        self.assertFalse(Todo.objects.filter(pk=self.subtask.pk).exists())
+        self.assertEqual(Todo.all_objects.filter(is_deleted=True).count(), 2)
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+        self.assertEqual(DailyTimeRollup.objects.get().hours, 0)
+        self.assertIn("purged 2 todos and 0 categories in 1 chunks", self.purge())
+        self.assertEqual(Todo.all_objects.count(), 9)
+        self.assertFalse(TimeEntry.objects.exists())
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.user = seed_user("transfer", categories=3, todos_per_category=3)
+        self.categories = list(self.user.categories.order_by("id"))
+
+    def export(self):
+        return list(transfer.iter_export_rows(self.user))
+
+    def test_export_skips_pending_todos(self):
+        first, second, third = self.categories
+        bulk_update_todos(self.user, [first.todos.earliest("id").pk], ACTION_DELETE)
+        bulk_update_todos(
+            self.user, list(second.todos.values_list("id", flat=True)), ACTION_DELETE
+        )
+        purge.delete_categories(Category.objects.filter(pk=third.pk))
+        rows = self.export()
+        self.assertEqual(
+            [(row["category"], row.get("title")) for row in rows],
+            [
+                (first.name, title)
+                for title in first.todos.order_by("deadline_time", "id").values_list(
+                    "title", flat=True
+                )
+            ]
+            + [(second.name, None)],
+        )
+
+
+    def round_trip(self, format):
+        data = "".join(transfer.iter_export(self.user, format)).encode()
+        other = User.objects.create_user(f"copy-{format}", password="pass")
+        stream = transfer.text_stream(BytesIO(data))
+        with self.captureOnCommitCallbacks(execute=True):
+            result = transfer.import_rows(other, transfer.read_rows(stream, format))
+        self.assertEqual(result.errors, [])
+        self.assertEqual(verify_rollups(users=[other.pk]), [])
+        return other, result
+
+    def test_round_trip(self):
+        Category.objects.create(user=self.user, name="空のカテゴリ")
+        for format in (transfer.FORMAT_CSV, transfer.FORMAT_JSONL):
+            with self.subTest(format=format):
+                other, result = self.round_trip(format)
+                self.assertEqual(result.categories_created, 4)
+                self.assertEqual(result.todos_created, 9)
+                self.assertEqual(list(transfer.iter_export_rows(other)), self.export())
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        lines = [
+            {"category": "ok", "title": "a", "deadline_time": "2024-03-10T09:00"},
+            {"title": "no category", "deadline_time": "2024-03-10T09:00"},
+            {"category": "ok", "title": "no deadline"},
+            {
+                "category": "ok",
+                "title": "b",
+                "deadline_time": "2024-03-10T09:00",
+                "hour_spent": -1,
+            },
+            {"category": "ok", "title": "c", "deadline_time": "tomorrow"},
+        ]
+        text = "\n".join(json.dumps(line) for line in lines) + "\n{broken\n"
+        result = transfer.import_rows(
+            self.user, transfer.read_rows(StringIO(text), transfer.FORMAT_JSONL)
+        )
+        self.assertEqual(result.todos_created, 1)
+        self.assertEqual([line for line, _ in result.errors], [2, 3, 4, 5, 6])
+        self.assertIn("category", result.errors[0][1])
+        self.assertIn("deadline_time", result.errors[1][1])
+        self.assertIn("hour_spent", result.errors[2][1])
+        self.assertEqual(result.errors[4][1], "行を読み取れません。")
+
+    def test_imported_hours_are_logged(self):
+        rows = [
+            {
+                "category": "作業",
+                "title": "a",
+                "deadline_time": "2024-03-10T09:00",
+                "hour_spent": 3,
+            },
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            transfer.import_rows(self.user, rows)
+        todo = Todo.objects.get(category__name="作業")
+        entry = todo.time_entries.get()
+        self.assertEqual((entry.hours, entry.spent_on), (3, timezone.localdate()))
+        for model in (DailyTimeRollup, WeeklyTimeRollup):
+            self.assertEqual(model.objects.get(category=todo.category).hours, 3)
+
+    def test_import_view(self):
+        self.client.force_login(self.user)
+        upload = SimpleUploadedFile(
+            "todos.csv",
+            "\ufeffcategory,title,deadline_time\n新規,x,2024-03-10T09:00\n".encode(),
+        )
+        response = self.client.post(
+            reverse("todo_import"), {"file": upload, "format": "csv"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["result"].todos_created, 1)
+        self.assertTrue(self.user.categories.filter(name="新規").exists())
+
+
+class BulkActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = seed_user("bulk", categories=2, todos_per_category=6)
+        self.category, self.other = self.user.categories.order_by("id")
+        self.todos = list(self.category.todos.order_by("id"))
+        self.ids = [todo.pk for todo in self.todos[:3]]
+        self.client.force_login(self.user)
+
+    def post(self, action, **data):
+        url = reverse("todo_bulk", kwargs={"category_id": self.category.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                url, {"todo_ids": self.ids, "action": action, **data}
+            )
+
+    def assert_applied(self, response, **expected):
+        self.assertEqual(response.status_code, 302)
+        for todo in Todo.objects.filter(pk__in=self.ids):
+            for field, value in expected.items():
+                self.assertEqual(getattr(todo, field), value)
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+
+    def test_finish_and_reopen(self):
+        self.assert_applied(self.post(bulk.ACTION_FINISH), is_finished=True)
+        self.assert_applied(self.post(bulk.ACTION_REOPEN), is_finished=False)
+
+    def test_move(self):
+        timelog.log_time(self.todos[0], 3, date(2024, 1, 1))
+        self.assert_applied(
+            self.post(bulk.ACTION_MOVE, category=self.other.pk), category=self.other
+        )
+        self.assertEqual(self.other.todos.count(), 9)
+        # 移す前に記録した作業時間は元のカテゴリの集計に残る
+        self.assertEqual(DailyTimeRollup.objects.get().category, self.category)
+
+    def test_shift(self):
+        response = self.post(bulk.ACTION_SHIFT, shift_days=-2)
+        self.assertEqual(response.status_code, 302)
+        for todo in self.todos[:3]:
+            shifted = Todo.objects.get(pk=todo.pk).deadline_time
+            self.assertEqual(shifted, todo.deadline_time - timedelta(days=2))
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+
+    def test_delete(self):
+        response = self.post(bulk.ACTION_DELETE)
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Todo.objects.filter(pk__in=self.ids).exists())
+        self.assertEqual(self.category.todos.count(), 3)
+        self.assertEqual(verify_rollups(users=[self.user.pk]), [])
+
+    def test_invalid_requests(self):
+        stranger = seed_user("stranger", categories=1, todos_per_category=1)
+        deadlines = [todo.deadline_time for todo in self.todos]
+        for data in (
+            {"action": bulk.ACTION_SHIFT, "shift_days": 3651},
+            {"action": bulk.ACTION_SHIFT, "shift_days": -3651},
+            {"action": bulk.ACTION_SHIFT},
+            {"action": bulk.ACTION_MOVE},
+            {"action": bulk.ACTION_MOVE, "category": stranger.categories.get().pk},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.post(**data).status_code, 400)
+        self.assertEqual(
+            [todo.deadline_time for todo in self.category.todos.order_by("id")],
+            deadlines,
+        )
+
+    def test_other_users_todos_are_ignored(self):
+        stranger = seed_user("stranger", categories=1, todos_per_category=1)
+        self.ids = [stranger.categories.get().todos.get().pk]
+        self.post(bulk.ACTION_DELETE)
+        self.assertTrue(Todo.objects.filter(pk__in=self.ids).exists())
+
+
+class TodoAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", password="pass")
+        self.client.force_login(self.admin)
+
+    def test_change_form_does_not_list_every_todo(self):
+        few = seed_user("few", categories=1, todos_per_category=3)
+        many = seed_user("many", categories=1, todos_per_category=300)
+        self.client.get(reverse("admin:main_todo_add"))
+        counts = []
+        for user in (few, many):
+            todo = Todo.objects.filter(category__user=user).earliest("id")
+            for url in (
+                reverse("admin:main_todo_add"),
+                reverse("admin:main_todo_change", args=[todo.pk]),
+            ):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(queries))
+        self.assertEqual(counts[:2], counts[2:])
+
+    def test_changelists_do_not_grow_with_rows(self):
+        def measure(username):
+            counts = []
+            for url in (
+                reverse("admin:main_todo_changelist"),
+                reverse("admin:main_todo_changelist") + "?is_finished__exact=0",
+                reverse("admin:main_todo_changelist") + f"?q={username}",
+                reverse("admin:main_category_changelist"),
+                reverse("admin:main_category_changelist") + f"?q={username}",
+                reverse("admin:main_user_changelist"),
+            ):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                counts.append(len(queries))
+            return counts
+
+        seed_user("few", categories=1, todos_per_category=3)
+        self.client.get(reverse("admin:main_todo_changelist"))
+        few = measure("few")
+        seed_user("many", categories=30, todos_per_category=20)
+        self.assertEqual(measure("many"), few)
+        self.assertLessEqual(max(few), 8)
+
+
+class EstimatedCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed_user("estimate", categories=2, todos_per_category=30)
+        bulk_update_todos(
+            cls.user, list(Todo.objects.values_list("id", flat=True)[:5]), ACTION_DELETE
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def paginator(self, queryset):
+        paginator = EstimatedCountPaginator(queryset.order_by("id"), 10)
+        paginator.count_limit = 20
+        return paginator
+
+    def test_estimate_ignores_partial_indexes(self):
+        # todo_pending_idx の統計は削除待ちの 5 件しか数えていない
+        self.assertEqual(estimated_row_count(Todo), Todo.all_objects.count())
+
+    def test_unfiltered_list_uses_estimate(self):
+        with CaptureQueriesContext(connection) as queries:
+            count = self.paginator(Todo.objects.all()).count
+        # 削除待ちの行も含むテーブルの行数
+        self.assertEqual(count, 60)
+        self.assertFalse(any("COUNT" in query["sql"] for query in queries))
+
+    def test_filtered_list_counts_up_to_limit(self):
+        paginator = self.paginator(Todo.objects.filter(is_finished=False))
+        self.assertEqual(paginator.count, 20)
+        paginator = self.paginator(Todo.objects.filter(title="todo-10"))
+        self.assertEqual(paginator.count, 2)
+
+
+class SqliteProfileTests(TestCase):
+    def connect(self, path):
+        handler = ConnectionHandler(
+            {
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": path,
+                    **settings.SQLITE_PRODUCTION_SETTINGS,
+                }
+            }
+        )
+        self.addCleanup(handler.close_all)
+        return handler["default"]
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / "db.sqlite3"
+        db = self.connect(path)
+        expected = {
+            "journal_mode": "wal",
+            "synchronous": 1,  # NORMAL
+            "busy_timeout": settings.SQLITE_PRAGMAS["busy_timeout"],
+            "mmap_size": settings.SQLITE_PRAGMAS["mmap_size"],
+            "cache_size": settings.SQLITE_PRAGMAS["cache_size"],
+            "temp_store": 2,  # MEMORY
+        }
+        with db.cursor() as cursor:
+            for name, value in expected.items():
+                cursor.execute(f"PRAGMA {name}")
+                self.assertEqual(cursor.fetchone()[0], value, name)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        path = Path(self.enterContext(tempfile.TemporaryDirectory())) / "db.sqlite3"
+        writer, other = self.connect(path), self.connect(path)
+        with writer.cursor() as cursor:
+            cursor.execute("CREATE TABLE t (x)")
+        # atomic() と同じ始め方。BEGIN IMMEDIATE なので、まだ何も読み書きして
+        # いなくても書き込みのロックを持っている
+        writer.set_autocommit(
+            False, force_begin_transaction_with_broken_autocommit=True
+        )
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("PRAGMA busy_timeout=0")
+                with self.assertRaises(OperationalError):
+                    cursor.execute("INSERT INTO t VALUES (1)")
+        finally:
+            writer.rollback()
+            writer.set_autocommit(True)
+
+
+class QueryBudgetHelperTests(TestCase):
+    def test_budget_exceeded(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(budget=1):
+                User.objects.count()
+                Category.objects.count()
+
+    def test_repeated_queries_are_flagged(self):
+        user = seed_user("n1", categories=3, todos_per_category=1)
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with query_budget(budget=10):
+                for todo in Todo.objects.filter(category__user=user):
+                    str(todo)  # category.name を 1 件ずつ取りに行く
+        self.assertIn("repeated queries", str(cm.exception))
+
+    def test_budgets_are_per_method(self):
+        self.assertEqual(get_budget("todo_update"), 3)
+        self.assertEqual(get_budget("todo_update", "POST"), 24)
+        self.assertIsNone(get_budget("todo_list", "POST"))
+        with override_settings(QUERY_BUDGETS={("todo_list", "POST"): 1}):
+            self.assertEqual(get_budget("todo_list", "POST"), 1)
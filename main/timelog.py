@@ -0,0 +1,200 @@
+"""作業時間の記録 (TimeEntry) と日別・週別の集計テーブル
+
+集計テーブルは TimeEntry の追加・削除のたびに差分で更新する (main/signals.py)。
+期間の集計はこのテーブルを読むだけなので、行数は日数 (週数) × カテゴリ数で済む。
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from main import changelog, rollups
+from main.models import (
+    Category,
+    DailyTimeRollup,
+    TimeEntry,
+    Todo,
+    WeeklyTimeRollup,
+)
+
+# これより長い期間は週別の集計を読む
+DAILY_MAX_DAYS = 92
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def _add_period_hours(model, period_field, user_id, category_id, period, hours, create):
+    lookup = {"category_id": category_id, period_field: period}
+    updated = model.objects.filter(**lookup).update(hours=F("hours") + hours)
+    if updated or not create:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(user_id=user_id, hours=hours, **lookup)
+    except IntegrityError:
+        # 同時に別のリクエストが行を作った
+        model.objects.filter(**lookup).update(hours=F("hours") + hours)
+
+
+def apply_entry_deltas(deltas, create=True):
+    """{(user_id, category_id, 作業日): 増減} を日別・週別の集計に反映する
+
+    削除の反映では create=False にして、行がなければ作らない
+    (カテゴリごと消すときは集計の行も一緒に消えるので、作ると外部キー違反になる)。
+    """
+    weekly = defaultdict(int)
+    for (user_id, category_id, day), hours in deltas.items():
+        if hours:
+            _add_period_hours(
+                DailyTimeRollup, "day", user_id, category_id, day, hours, create
+            )
+            weekly[user_id, category_id, week_start(day)] += hours
+    for (user_id, category_id, week), hours in weekly.items():
+        if hours:
+            _add_period_hours(
+                WeeklyTimeRollup,
+                "week_start",
+                user_id,
+                category_id,
+                week,
+                hours,
+                create,
+            )
+
+
+def entry_owner_id(entry):
+    return (
+        Category.objects.filter(pk=entry.category_id)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+
+
+def entries_deltas(queryset, sign=1):
+    """TimeEntry の queryset を {(user_id, category_id, 作業日): 時間数} にまとめる"""
+    rows = (
+        queryset.values("category__user_id", "category_id", "spent_on")
+        .annotate(total=Sum("hours"))
+        .order_by()
+        .values_list("category__user_id", "category_id", "spent_on", "total")
+    )
+    return {
+        (user_id, category_id, day): sign * total
+        for user_id, category_id, day, total in rows
+    }
+
+
+def subtract_entries(queryset):
+    """queryset の記録を日別・週別の集計から差し引く (記録の行は残す)"""
+    apply_entry_deltas(entries_deltas(queryset, sign=-1), create=False)
+
+
+def delete_entries(queryset):
+    """集計から差し引いてから、シグナルを通さない 1 本の DELETE 文で消す"""
+    subtract_entries(queryset)
+    return queryset._raw_delete(queryset.db)
+
+
+def record_hours(user_id, changes):
+    """[(Todo, 所要時間の増減)] を今日の作業として一括で記録し、作った記録を返す
+
+    一括で書き込んだ Todo (差分同期・インポート) の所要時間の分。bulk_create は
+    TimeEntry のシグナルを通らないので、日別・週別の集計はここで足す。
+    """
+    today = timezone.localdate()
+    entries = [
+        TimeEntry(todo=todo, category_id=todo.category_id, hours=hours, spent_on=today)
+        for todo, hours in changes
+        if hours
+    ]
+    TimeEntry.objects.bulk_create(entries)
+    deltas = defaultdict(int)
+    for entry in entries:
+        deltas[user_id, entry.category_id, today] += entry.hours
+    apply_entry_deltas(deltas)
+    return entries
+
+
+def log_time(todo, hours, spent_on):
+    """todo に hours 時間の作業を記録し、Todo の所要時間とカテゴリの集計にも足す"""
+    with transaction.atomic():
+        # 日別・週別の集計とキャッシュのバージョンは TimeEntry の post_save で更新される
+        entry = TimeEntry.objects.create(
+            todo=todo, category_id=todo.category_id, hours=hours, spent_on=spent_on
+        )
+        user_ids = rollups.apply_category_deltas(
+            {todo.category_id: {"total_hours": hours}}
+        )
+        Todo.objects.filter(pk=todo.pk).update(
+            hour_spent=F("hour_spent") + hours,
+            sync_seq=changelog.next_seq(*user_ids),
+        )
+    todo.hour_spent = (todo.hour_spent or 0) + hours
+    return entry
+
+
+def period_rows(user, start, end):
+    """start〜end (両端含む) のカテゴリ別の時間数を読む queryset を返す
+
+    戻り値は (粒度 "day"/"week", (期間の初日, カテゴリ名, 時間数) の queryset)。
+    期間が DAILY_MAX_DAYS 日以上なら週別の集計を使う。
+    """
+    if (end - start).days < DAILY_MAX_DAYS:
+        queryset = DailyTimeRollup.objects.filter(
+            user=user, day__gte=start, day__lte=end
+        ).values_list("day", "category__name", "hours")
+        return "day", queryset.order_by("day", "category__name")
+    queryset = WeeklyTimeRollup.objects.filter(
+        user=user, week_start__gte=week_start(start), week_start__lte=end
+    ).values_list("week_start", "category__name", "hours")
+    return "week", queryset.order_by("week_start", "category__name")
+
+
+def rebuild_time_rollups(users=None):
+    """日別・週別の集計を TimeEntry から作り直す。(日別の行数, 週別の行数) を返す"""
+    # 削除待ちの Todo・カテゴリの記録は、削除待ちにしたときに差し引いてある
+    entries = TimeEntry.objects.filter(
+        todo__is_deleted=False, category__is_deleted=False
+    )
+    daily_rollups = DailyTimeRollup.objects.all()
+    weekly_rollups = WeeklyTimeRollup.objects.all()
+    if users is not None:
+        entries = entries.filter(category__user__in=users)
+        daily_rollups = daily_rollups.filter(user__in=users)
+        weekly_rollups = weekly_rollups.filter(user__in=users)
+
+    daily = entries_deltas(entries)
+    weekly = defaultdict(int)
+    for (user_id, category_id, day), hours in daily.items():
+        weekly[user_id, category_id, week_start(day)] += hours
+
+    with transaction.atomic():
+        daily_rollups.delete()
+        weekly_rollups.delete()
+        DailyTimeRollup.objects.bulk_create(
+            [
+                DailyTimeRollup(
+                    user_id=user_id, category_id=category_id, day=day, hours=hours
+                )
+                for (user_id, category_id, day), hours in daily.items()
+            ],
+            batch_size=1000,
+        )
+        WeeklyTimeRollup.objects.bulk_create(
+            [
+                WeeklyTimeRollup(
+                    user_id=user_id,
+                    category_id=category_id,
+                    week_start=week,
+                    hours=hours,
+                )
+                for (user_id, category_id, week), hours in weekly.items()
+            ],
+            batch_size=1000,
+        )
+    return len(daily), len(weekly)
@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from main import changelog, ranking, rollups, timelog, user_cache
+from main.forms import TodoImportRowForm
+from main.models import Category, CategoryRollup, Todo
+
+FORMAT_CSV = "csv"
+FORMAT_JSONL = "jsonl"
+
+FIELDS = (
+    "category",
+    "title",
+    "description",
+    "deadline_time",
+    "hour_spent",
+    "is_finished",
+)
+
+CONTENT_TYPES = {
+    FORMAT_CSV: "text/csv; charset=utf-8",
+    FORMAT_JSONL: "application/x-ndjson; charset=utf-8",
+}
+
+
+def iter_export_rows(user, chunk_size=2000):
+    """ユーザーのカテゴリと Todo を 1 行ずつ dict で返す (Todo のないカテゴリは title なし)"""
+    # 削除待ちの Todo は LEFT JOIN の ON 句で外し、Todo のないカテゴリと同じく
+    # カテゴリだけの行にする
+    rows = (
+        Category.objects.filter(user=user)
+        .annotate(
+            live_todos=FilteredRelation("todos", condition=Q(todos__is_deleted=False))
+        )
+        .order_by("name", "id", "live_todos__deadline_time", "live_todos__id")
+        .values_list(
+            "name",
+            "live_todos__title",
+            "live_todos__description",
+            "live_todos__deadline_time",
+            "live_todos__hour_spent",
+            "live_todos__is_finished",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    for name, title, description, deadline_time, hour_spent, is_finished in rows:
+        if title is None:
+            yield {"category": name}
+            continue
+        yield {
+            "category": name,
+            "title": title,
+            "description": description or "",
+            "deadline_time": timezone.localtime(deadline_time).isoformat(),
+            "hour_spent": hour_spent,
+            "is_finished": is_finished,
+        }
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.DictWriter(_Echo(), fieldnames=FIELDS)
+    # Excel で開いても文字化けしないように BOM を付ける
+    yield "\ufeff" + writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_export(user, format):
+    rows = iter_export_rows(user)
+    if format == FORMAT_CSV:
+        return iter_csv(rows)
+    return iter_jsonl(rows)
+
+
+def read_rows(stream, format):
+    """テキストストリームから 1 行ずつ dict で読む"""
+    if format == FORMAT_CSV:
+        for reader_row in csv.DictReader(stream):
+            yield reader_row
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def text_stream(binary_file):
+    return io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+
+
+class ImportResult:
+    def __init__(self):
+        self.categories_created = 0
+        self.todos_created = 0
+        self.errors = []
+
+    def __repr__(self):
+        return (
+            f"<ImportResult categories={self.categories_created} "
+            f"todos={self.todos_created} errors={len(self.errors)}>"
+        )
+
+
+def import_rows(user, rows, batch_size=1000):
+    """rows (dict のイテラブル) を検証し、batch_size 件ずつ bulk_create する"""
+    result = ImportResult()
+    numbered = enumerate(rows, start=1)
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            break
+        valid = []
+        for line, row in batch:
+            if not isinstance(row, dict):
+                result.errors.append((line, "行を読み取れません。"))
+                continue
+            form = TodoImportRowForm(row)
+            if form.is_valid():
+                valid.append(form.cleaned_data)
+            else:
+                messages = [
+                    f"{field}: {error}"
+                    for field, errors in form.errors.items()
+                    for error in errors
+                ]
+                result.errors.append((line, " ".join(messages)))
+        _import_batch(user, valid, result)
+    if result.todos_created or result.categories_created:
+        transaction.on_commit(lambda: user_cache.bump_version(user.pk))
+    return result
+
+
+def _import_batch(user, rows, result):
+    if not rows:
+        return
+    names = {row["category"] for row in rows}
+    with transaction.atomic():
+        seq = changelog.next_seq(user.pk)
+        # 同名カテゴリが複数あるときは一番古いものに入れる
+        category_ids = {}
+        for pk, name in (
+            Category.objects.filter(user=user, name__in=names)
+            .order_by("-id")
+            .values_list("id", "name")
+        ):
+            category_ids[name] = pk
+        missing = [name for name in sorted(names) if name not in category_ids]
+        if missing:
+            created = Category.objects.bulk_create(
+                [Category(user=user, name=name, sync_seq=seq) for name in missing]
+            )
+            CategoryRollup.objects.bulk_create(
+                [CategoryRollup(category=category) for category in created]
+            )
+            category_ids.update((category.name, category.pk) for category in created)
+            result.categories_created += len(created)
+
+        todos = [
+            Todo(
+                category_id=category_ids[row["category"]],
+                title=row["title"],
+                description=row["description"] or None,
+                deadline_time=row["deadline_time"],
+                hour_spent=row["hour_spent"] or 0,
+                is_finished=row["is_finished"],
+                sync_seq=seq,
+            )
+            for row in rows
+            if row["title"]
+        ]
+        ranking.append_ranks(todos)
+        Todo.objects.bulk_create(todos)
+        deltas = {}
+        for todo in todos:
+            rollups.add_contribution(deltas, rollups.todo_state(todo))
+        rollups.apply_category_deltas(deltas)
+        # 所要時間は差分同期と同じく、今日の作業時間の記録にもする
+        timelog.record_hours(user.pk, [(todo, todo.hour_spent) for todo in todos])
+        result.todos_created += len(todos)
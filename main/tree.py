@@ -0,0 +1,138 @@
+"""サブタスクの階層 (経路列挙: materialized path)
+
+Todo.path には根から親までの祖先の ID を、固定幅の「ID/」にして順に並べて持つ
+(根の Todo は空文字列)。ある Todo の子孫はすべて path が同じ接頭辞
+(その Todo の path + 自分の ID/) で始まるので、部分木は todo_path_idx の
+範囲スキャン 1 本で読める。付け替えも子孫の path の接頭辞を 1 本の UPDATE 文で
+書き換えるだけで、部分木の大きさによらず書き込みの文の数は変わらない。
+
+子孫はすべて同じユーザーの Todo にする (カテゴリは違ってもよい)。
+"""
+
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Max, Q, Value
+from django.db.models.functions import Concat, Length, Substr
+
+from main import changelog, rollups, user_cache
+from main.models import Todo
+
+KEY_LENGTH = 11  # ID 10 桁 + "/"
+# 階層の深さの上限 (根が 1 段目)。path の max_length に収まる範囲で決める
+MAX_DEPTH = 10
+
+
+class InvalidMove(ValueError):
+    pass
+
+
+def path_key(pk):
+    return f"{pk:010d}/"
+
+
+def child_path(parent):
+    """parent の子に付ける path"""
+    if parent is None:
+        return ""
+    return parent.path + path_key(parent.pk)
+
+
+def depth(path):
+    """path を持つ Todo の深さ (根が 1)"""
+    return len(path) // KEY_LENGTH + 1
+
+
+def descendants_filter(todo):
+    """todo の子孫 (todo 自身は含まない) の条件
+
+    startswith (LIKE) は SQLite でインデックスを使わないので、接頭辞の範囲で書く
+    ("/" の次の文字は "0")。
+    """
+    prefix = child_path(todo)
+    return Q(path__gte=prefix, path__lt=prefix[:-1] + "0")
+
+
+def descendants(todo):
+    return Todo.objects.filter(descendants_filter(todo))
+
+
+def with_descendants(queryset, batch_size=200):
+    """queryset の Todo とその子孫すべての queryset を返す
+
+    条件の OR が長くなりすぎないよう、batch_size 件ずつ子孫の ID を集める。
+    """
+    todos = list(queryset.only("pk", "path"))
+    descendant_ids = set()
+    for start in range(0, len(todos), batch_size):
+        query = Q()
+        for todo in todos[start : start + batch_size]:
+            query |= descendants_filter(todo)
+        descendant_ids.update(Todo.objects.filter(query).values_list("pk", flat=True))
+    if not descendant_ids:
+        return queryset
+    return queryset | Todo.objects.filter(pk__in=descendant_ids)
+
+
+def load_subtree(todo):
+    """todo を根とする部分木を 1 本のクエリで読み、todo を返す
+
+    各ノードには subtasks (子のリスト) と、部分木全体の集計 subtree_hours
+    (所要時間の合計)・subtree_count (件数)・subtree_finished (完了件数)・
+    progress (完了率 %) を付ける。
+    """
+    nodes = list(
+        Todo.objects.filter(Q(pk=todo.pk) | descendants_filter(todo)).order_by(
+            "path", "id"
+        )
+    )
+    by_id = {node.pk: node for node in nodes}
+    for node in nodes:
+        node.subtasks = []
+        node.subtree_hours = node.hour_spent or 0
+        node.subtree_count = 1
+        node.subtree_finished = int(node.is_finished)
+    for node in nodes:
+        if node.pk != todo.pk and node.parent_id in by_id:
+            by_id[node.parent_id].subtasks.append(node)
+    # 深いノードから順に親へ足し込む
+    for node in sorted(nodes, key=lambda node: len(node.path), reverse=True):
+        node.progress = round(100 * node.subtree_finished / node.subtree_count)
+        parent = by_id.get(node.parent_id)
+        if node.pk != todo.pk and parent is not None:
+            parent.subtree_hours += node.subtree_hours
+            parent.subtree_count += node.subtree_count
+            parent.subtree_finished += node.subtree_finished
+    return by_id.get(todo.pk, todo)
+
+
+def move_subtree(todo, parent):
+    """todo を部分木ごと parent (None なら根) の下へ移す
+
+    parent が todo と同じユーザーの Todo であることは呼び出し側で確かめる。
+    todo 自身か子孫の下へは移せず、深さが MAX_DEPTH を超える場合も InvalidMove。
+    """
+    old_prefix = child_path(todo)
+    new_path = child_path(parent)
+    if parent is not None and (
+        parent.pk == todo.pk or new_path.startswith(old_prefix)
+    ):
+        raise InvalidMove("自分自身やサブタスクの下へは移動できません。")
+    deepest = descendants(todo).aggregate(length=Max(Length("path")))["length"]
+    levels = (deepest or len(todo.path)) // KEY_LENGTH - len(todo.path) // KEY_LENGTH
+    if depth(new_path) + levels > MAX_DEPTH:
+        raise InvalidMove(f"階層は{MAX_DEPTH}段までです。")
+
+    new_prefix = new_path + path_key(todo.pk)
+    with transaction.atomic():
+        # 子孫の parent は変わらないので、差分同期の番号は根の分だけ進める
+        owner_id = rollups.category_owners([todo.category_id]).get(todo.category_id)
+        descendants(todo).update(
+            path=Concat(Value(new_prefix), Substr("path", len(old_prefix) + 1))
+        )
+        Todo.objects.filter(pk=todo.pk).update(
+            parent=parent, path=new_path, sync_seq=changelog.next_seq(owner_id)
+        )
+        transaction.on_commit(partial(user_cache.bump_version, owner_id))
+    todo.parent = parent
+    todo.path = new_path
@@ -1,33 +1,111 @@
+from django.conf import settings
 from django.urls import path
 
-from main import views
+from main import async_views, views
 
-urlpatterns = [
-    path("signup", views.SignUpView.as_view(), name="signup"),
-    path("login", views.LoginView.as_view(), name="login"),
-    path("logout", views.LogoutView.as_view(), name="logout"),
-    path("", views.HomeView.as_view(), name="home"),
-    path("category/<int:category_id>", views.TodoListView.as_view(), name="todo_list"),
-    path(
-        "category/<int:category_id>/todo/create",
-        views.TodoCreateView.as_view(),
-        name="todo_create",
-    ),
-    path(
-        "category/<int:category_id>/todo/<int:todo_id>",
-        views.TodoDetailView.as_view(),
-        name="todo_detail",
-    ),
-    path(
-        "category/<int:category_id>/todo/<int:todo_id>/update",
-        views.TodoUpdateView.as_view(),
-        name="todo_update",
-    ),
-    path(
-        "category/<int:category_id>/todo/<int:todo_id>/delete",
-        views.TodoDeleteView.as_view(),
-        name="todo_delete",
-    ),
-    path("calendar", views.CalendarView.as_view(), name="calendar"),
-    path("mypage", views.MypageView.as_view(), name="mypage"),
-]
+
+def read_views(use_async):
+    """読み取り中心の画面のビュー。ASGI で動かすときは非同期版を使う"""
+    if use_async:
+        return {
+            "home": async_views.HomeAsyncView,
+            "todo_list": async_views.TodoListAsyncView,
+            "calendar": async_views.CalendarAsyncView,
+            "mypage": async_views.MypageAsyncView,
+            "mypage_chart": async_views.MypageChartAsyncView,
+            "mypage_time_chart": async_views.MypageTimeChartAsyncView,
+        }
+    return {
+        "home": views.HomeView,
+        "todo_list": views.TodoListView,
+        "calendar": views.CalendarView,
+        "mypage": views.MypageView,
+        "mypage_chart": views.MypageChartView,
+        "mypage_time_chart": views.MypageTimeChartView,
+    }
+
+
+def build_urlpatterns(use_async=False):
+    read = read_views(use_async)
+    return [
+        path("signup", views.SignUpView.as_view(), name="signup"),
+        path("login", views.LoginView.as_view(), name="login"),
+        path("logout", views.LogoutView.as_view(), name="logout"),
+        path("", read["home"].as_view(), name="home"),
+        path(
+            "category/<int:category_id>",
+            read["todo_list"].as_view(),
+            name="todo_list",
+        ),
+        path(
+            "category/<int:category_id>/todo/create",
+            views.TodoCreateView.as_view(),
+            name="todo_create",
+        ),
+        path(
+            "category/<int:category_id>/todo/bulk",
+            views.TodoBulkActionView.as_view(),
+            name="todo_bulk",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>",
+            views.TodoDetailView.as_view(),
+            name="todo_detail",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>/update",
+            views.TodoUpdateView.as_view(),
+            name="todo_update",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>/time",
+            views.TimeEntryCreateView.as_view(),
+            name="time_entry_create",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>/move",
+            views.TodoMoveView.as_view(),
+            name="todo_move",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>/reorder",
+            views.TodoReorderView.as_view(),
+            name="todo_reorder",
+        ),
+        path(
+            "category/<int:category_id>/todo/<int:todo_id>/delete",
+            views.TodoDeleteView.as_view(),
+            name="todo_delete",
+        ),
+        path("calendar", read["calendar"].as_view(), name="calendar"),
+        path("mypage", read["mypage"].as_view(), name="mypage"),
+        path("mypage/chart", read["mypage_chart"].as_view(), name="mypage_chart"),
+        path(
+            "mypage/time-chart",
+            read["mypage_time_chart"].as_view(),
+            name="mypage_time_chart",
+        ),
+        path("export", views.TodoExportView.as_view(), name="todo_export"),
+        path("import", views.TodoImportView.as_view(), name="todo_import"),
+        path("search", views.TodoSearchView.as_view(), name="todo_search"),
+        path(
+            "feed",
+            views.CalendarFeedSettingsView.as_view(),
+            name="calendar_feed_settings",
+        ),
+        path(
+            "feed/<str:token>.ics",
+            views.CalendarFeedView.as_view(),
+            name="calendar_feed",
+        ),
+        path(
+            "api/categories",
+            views.CategorySummaryView.as_view(),
+            name="category_summary",
+        ),
+        path("api/sync", views.SyncChangesView.as_view(), name="sync_changes"),
+        path("api/sync/push", views.SyncPushView.as_view(), name="sync_push"),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.ASYNC_READ_VIEWS)
@@ -0,0 +1,101 @@
+"""ユーザーごとのバージョン付きキャッシュ
+
+キャッシュのキーにユーザーごとのバージョン番号を含め、そのユーザーの Category/Todo
+に書き込みがあったらバージョンを上げる。バージョンは条件付き GET の ETag にも使う
+(main/conditional.py)。古いバージョンのエントリは参照されなくなるだけなので削除して
+回る必要はなく、期限切れや LRU で自然に消える。
+"""
+
+import threading
+import time
+
+from django.core.cache import cache
+
+ENTRY_TIMEOUT = 60 * 60
+
+_MISSING = object()
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    """get_or_set/aget_or_set のヒット・ミスの回数 (bench_routes の出力に含める)"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def version_key(user_id):
+    return f"main:user_version:{user_id}"
+
+
+def entry_key(user_id, version, name):
+    return f"main:user:{user_id}:v{version}:{name}"
+
+
+def _initial_version():
+    # バージョンキーが追い出されても以前の番号に戻らないよう時刻から始める
+    return time.time_ns()
+
+
+def get_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        version = _initial_version()
+        if not cache.add(version_key(user_id), version, None):
+            version = cache.get(version_key(user_id), version)
+    return version
+
+
+def bump_version(user_id):
+    # バージョンは書き込み時刻 (ns) にする。同じ ns 内の書き込みが重なっても
+    # 前より必ず大きくする
+    version = _initial_version()
+    current = cache.get(version_key(user_id))
+    if current is not None and current >= version:
+        version = current + 1
+    cache.set(version_key(user_id), version, None)
+
+
+def get_or_set(user_id, name, build, timeout=ENTRY_TIMEOUT):
+    key = entry_key(user_id, get_version(user_id), name)
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _count("hits")
+        return value
+    _count("misses")
+    value = build()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def aget_version(user_id):
+    version = await cache.aget(version_key(user_id))
+    if version is None:
+        version = _initial_version()
+        if not await cache.aadd(version_key(user_id), version, None):
+            version = await cache.aget(version_key(user_id), version)
+    return version
+
+
+async def aget_or_set(user_id, name, build, timeout=ENTRY_TIMEOUT):
+    """get_or_set の非同期版。build はコルーチン関数"""
+    key = entry_key(user_id, await aget_version(user_id), name)
+    value = await cache.aget(key, _MISSING)
+    if value is not _MISSING:
+        _count("hits")
+        return value
+    _count("misses")
+    value = await build()
+    await cache.aset(key, value, timeout)
+    return value
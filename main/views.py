@@ -1,31 +1,147 @@
 import calendar
-from datetime import datetime
+import hashlib
+import json
+from datetime import datetime, time, timedelta
+from urllib.parse import urlencode
 
 from django.contrib.auth import login
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.db.models import Sum
-from django.shortcuts import get_object_or_404
-from django.urls import reverse_lazy
+from django.core.exceptions import BadRequest
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, TruncDate
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
 from django.views.generic import (
     CreateView,
     DeleteView,
     DetailView,
     ListView,
     TemplateView,
+    FormView,
     UpdateView,
+    View,
 )
-from plotly import graph_objs, offline
 
+from main import ics, ranking, search, sync, timelog, transfer, tree, user_cache
+from main.conditional import ConditionalGetMixin, etag_for, set_validators
+from main.bulk import bulk_update_todos
+from main.charts import get_category_hours_chart, get_period_hours_chart
 from main.forms import (
+    CalendarFeedForm,
+    CalendarForm,
     CategoryCreateForm,
     LoginForm,
     SignUpForm,
+    SyncPullForm,
+    TimeEntryForm,
+    TimeRangeForm,
+    TodoBulkActionForm,
     TodoCreateForm,
+    TodoFilterForm,
+    TodoImportForm,
+    TodoMoveForm,
+    TodoReorderForm,
+    TodoSearchForm,
     TodoUpdateForm,
 )
-from main.models import Category, Todo
+from main.models import CalendarFeedToken, Category, TimeEntry, Todo, new_feed_token
+from main.pagination import InvalidCursor, paginate_keyset
+from main.replicas import ReplicaReadMixin
+
+
+def category_list_queryset(user):
+    return Category.objects.filter(user=user).order_by("name").only("id", "name")
+
+
+def get_category_list(user):
+    """ユーザーのカテゴリ一覧 (名前順, キャッシュ)。一括操作の移動先の選択肢にも使う"""
+    return user_cache.get_or_set(
+        user.pk, "category_list", lambda: list(category_list_queryset(user))
+    )
+
+
+async def aget_category_list(user):
+    async def build():
+        return [category async for category in category_list_queryset(user)]
+
+    return await user_cache.aget_or_set(user.pk, "category_list", build)
+
+
+def local_day_range(first_day, last_day):
+    """first_day 0:00 〜 last_day の翌日 0:00 (ローカル時刻) の半開区間を返す"""
+    start = timezone.make_aware(datetime.combine(first_day, time.min))
+    end = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+    return start, end
+
+
+def category_summary_queryset(user, today):
+    """カテゴリごとの件数・所要時間 (CategoryRollup) と、今日以降の最も近い未完了の
+    締め切りを 1 本のクエリで読む (名前順の dict)
+
+    締め切りはカテゴリごとに todo_category_status_idx を 1 件だけ引く相関サブクエリ。
+    """
+    start, _ = local_day_range(today, today)
+    next_deadline = (
+        Todo.objects.filter(
+            category=OuterRef("pk"),
+            is_finished__in=[False],
+            deadline_time__gte=start,
+        )
+        .order_by("deadline_time")
+        .values("deadline_time")[:1]
+    )
+    return (
+        Category.objects.filter(user=user)
+        .order_by("name")
+        .values("id", "name")
+        .annotate(
+            todo_count=Coalesce(
+                F("rollup__finished_count") + F("rollup__unfinished_count"), 0
+            ),
+            unfinished_count=Coalesce(F("rollup__unfinished_count"), 0),
+            total_hours=Coalesce(F("rollup__total_hours"), 0),
+            next_deadline=Subquery(next_deadline),
+        )
+    )
+
+
+def get_category_summaries(user):
+    # 「今日以降」の締め切りは日付が変わると変わるので、キャッシュも日付ごと
+    today = timezone.localdate()
+    return user_cache.get_or_set(
+        user.pk,
+        f"category_summaries:{today}",
+        lambda: list(category_summary_queryset(user, today)),
+    )
+
+
+async def aget_category_summaries(user):
+    today = timezone.localdate()
+
+    async def build():
+        return [row async for row in category_summary_queryset(user, today)]
+
+    return await user_cache.aget_or_set(user.pk, f"category_summaries:{today}", build)
+
+
+class DailyMixin:
+    """表示が今日の日付でも変わる画面の ETag
+
+    ConditionalGetMixin より前に置く。
+    """
+
+    def get_etag_extra(self):
+        return (timezone.localdate(),)
 
 
 class SignUpView(CreateView):
@@ -53,7 +169,9 @@ class LogoutView(LogoutView):
     pass
 
 
-class HomeView(LoginRequiredMixin, CreateView):
+class HomeView(
+    LoginRequiredMixin, DailyMixin, ConditionalGetMixin, ReplicaReadMixin, CreateView
+):
     template_name = "main/home.html"
     model = Category
     form_class = CategoryCreateForm
@@ -61,9 +179,7 @@ class HomeView(LoginRequiredMixin, CreateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["category_list"] = Category.objects.filter(
-            user=self.request.user
-        ).order_by("name")
+        context["category_list"] = get_category_summaries(self.request.user)
         return context
 
     def form_valid(self, form):
@@ -73,26 +189,126 @@ class HomeView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class TodoListView(LoginRequiredMixin, ListView):
+class TodoListMixin:
+    """Todo 一覧の絞り込み・ページングの組み立て (同期版/非同期版で共通)"""
+
     template_name = "main/todo_list.html"
+    page_size = 50
+    orderings = {
+        "deadline": ("deadline_time", "id"),
+        "status": ("is_finished", "deadline_time", "id"),
+        "manual": ("rank", "id"),
+    }
+
+    def get_filtered_queryset(self):
+        """(queryset, ordering) を返す。DB にはまだアクセスしない"""
+        queryset = (
+            Todo.objects.filter(
+                category_id=self.kwargs["category_id"],
+                category__user=self.request.user,
+            )
+            .select_related("category")
+            .only(
+                "id",
+                "title",
+                "deadline_time",
+                "is_finished",
+                "rank",
+                "category__id",
+                "category__name",
+            )
+        )
+
+        self.filter_form = TodoFilterForm(self.request.GET)
+        filters = self.filter_form.cleaned_data if self.filter_form.is_valid() else {}
+        if filters.get("status") == "open":
+            queryset = queryset.filter(is_finished=False)
+        elif filters.get("status") == "done":
+            queryset = queryset.filter(is_finished=True)
+        if filters.get("deadline_from"):
+            start, _ = local_day_range(filters["deadline_from"], filters["deadline_from"])
+            queryset = queryset.filter(deadline_time__gte=start)
+        if filters.get("deadline_to"):
+            _, end = local_day_range(filters["deadline_to"], filters["deadline_to"])
+            queryset = queryset.filter(deadline_time__lt=end)
+
+        return queryset, self.orderings[filters.get("order") or "deadline"]
+
+    def get_cache_name(self):
+        query = urlencode(sorted(self.request.GET.lists()), doseq=True)
+        digest = hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()
+        return f"todo_list:{self.kwargs['category_id']}:{digest}"
+
+    def get_page_context(self, category, next_cursor):
+        next_query = None
+        if next_cursor:
+            params = self.request.GET.copy()
+            params["cursor"] = next_cursor
+            next_query = params.urlencode()
+        return {
+            "category": category,
+            "filter_form": self.filter_form,
+            "next_query": next_query,
+            "is_first_page": not self.request.GET.get("cursor"),
+            "is_manual_order": self.filter_form.is_valid()
+            and self.filter_form.cleaned_data["order"] == "manual",
+        }
+
+
+class TodoListView(
+    LoginRequiredMixin, TodoListMixin, ConditionalGetMixin, ReplicaReadMixin, ListView
+):
     model = Todo
     context_object_name = "todo_list"
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        category_id = self.kwargs["category_id"]
-        context["category"] = get_object_or_404(
-            Category,
-            id=category_id,
-            user=self.request.user,
-        )
+        context.update(self.get_page_context(self.category, self.next_cursor))
+        bulk_form = TodoBulkActionForm(user=self.request.user)
+        bulk_form.set_category_choices(get_category_list(self.request.user))
+        context["bulk_form"] = bulk_form
         return context
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        category_id = self.kwargs["category_id"]
-        queryset = queryset.filter(category=category_id)
-        return queryset
+        queryset, ordering = self.get_filtered_queryset()
+
+        def load_page():
+            try:
+                page, next_cursor = paginate_keyset(
+                    queryset, ordering, self.request.GET.get("cursor"), self.page_size
+                )
+            except InvalidCursor:
+                raise BadRequest("invalid cursor")
+            if page:
+                # 所有者チェックは Todo のクエリに含めているので category はそこから取る
+                category = page[0].category
+            else:
+                category = get_object_or_404(
+                    Category,
+                    id=self.kwargs["category_id"],
+                    user=self.request.user,
+                )
+            return page, next_cursor, category
+
+        page, self.next_cursor, self.category = user_cache.get_or_set(
+            self.request.user.pk, self.get_cache_name(), load_page
+        )
+        return page
+
+
+class TodoBulkActionView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        form = TodoBulkActionForm(request.POST, user=request.user)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        bulk_update_todos(
+            request.user,
+            form.cleaned_data["todo_ids"],
+            form.cleaned_data["action"],
+            category=form.cleaned_data["category"],
+            shift_days=form.cleaned_data["shift_days"] or 0,
+        )
+        return redirect("todo_list", category_id=self.kwargs["category_id"])
 
 
 class TodoCreateView(LoginRequiredMixin, CreateView):
@@ -100,11 +316,25 @@ class TodoCreateView(LoginRequiredMixin, CreateView):
     model = Todo
     template_name = "main/todo_create.html"
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs["user"] = self.request.user
+        return kwargs
+
+    def get_initial(self):
+        return {"parent": self.request.GET.get("parent")}
+
     def form_valid(self, form):
         form.instance.category_id = self.kwargs["category_id"]
         return super().form_valid(form)
 
     def get_success_url(self):
+        parent = self.object.parent
+        if parent is not None:
+            return reverse_lazy(
+                "todo_detail",
+                kwargs={"category_id": parent.category_id, "todo_id": parent.pk},
+            )
         return reverse_lazy(
             "todo_list",
             kwargs={"category_id": self.kwargs["category_id"]},
@@ -124,6 +354,11 @@ class TodoDetailView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["category_id"] = self.kwargs["category_id"]
+        context["time_entry_form"] = TimeEntryForm()
+        context["subtree"] = tree.load_subtree(self.object)
+        context["move_form"] = TodoMoveForm(
+            user=self.request.user, initial={"parent": self.object.parent_id}
+        )
         return context
 
 
@@ -133,6 +368,21 @@ class TodoUpdateView(LoginRequiredMixin, UpdateView):
     template_name = "main/todo_update.html"
     pk_url_kwarg = "todo_id"
 
+    def form_valid(self, form):
+        # 所要時間を直接書き換えたときも、差分を作業時間の記録として残す
+        before = form.initial["hour_spent"] or 0
+        delta = (form.cleaned_data["hour_spent"] or 0) - before
+        with transaction.atomic():
+            response = super().form_valid(form)
+            if delta:
+                TimeEntry.objects.create(
+                    todo=self.object,
+                    category_id=self.object.category_id,
+                    hours=delta,
+                    spent_on=timezone.localdate(),
+                )
+        return response
+
     def get_success_url(self):
         return reverse_lazy(
             "todo_detail",
@@ -149,6 +399,78 @@ class TodoUpdateView(LoginRequiredMixin, UpdateView):
         return context
 
 
+class TimeEntryCreateView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        todo = get_object_or_404(
+            Todo,
+            pk=self.kwargs["todo_id"],
+            category_id=self.kwargs["category_id"],
+            category__user=request.user,
+        )
+        form = TimeEntryForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        timelog.log_time(
+            todo, form.cleaned_data["hours"], form.cleaned_data["spent_on"]
+        )
+        return redirect("todo_detail", category_id=todo.category_id, todo_id=todo.pk)
+
+
+class TodoMoveView(LoginRequiredMixin, View):
+    """サブタスクを部分木ごと別の親の下 (または最上位) へ移す"""
+
+    def post(self, request, *args, **kwargs):
+        todo = get_object_or_404(
+            Todo,
+            pk=self.kwargs["todo_id"],
+            category_id=self.kwargs["category_id"],
+            category__user=request.user,
+        )
+        form = TodoMoveForm(request.POST, user=request.user)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        try:
+            tree.move_subtree(todo, form.cleaned_data["parent"])
+        except tree.InvalidMove as e:
+            return HttpResponseBadRequest(str(e))
+        return redirect("todo_detail", category_id=todo.category_id, todo_id=todo.pk)
+
+
+class TodoReorderView(LoginRequiredMixin, View):
+    """手動の並び順で Todo を移す。書き込むのはこの Todo の 1 行だけ"""
+
+    def post(self, request, *args, **kwargs):
+        todo = get_object_or_404(
+            Todo,
+            pk=self.kwargs["todo_id"],
+            category_id=self.kwargs["category_id"],
+            category__user=request.user,
+        )
+        form = TodoReorderForm(request.POST)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        data = form.cleaned_data
+        ids = [pk for pk in (data["after"], data["before"]) if pk is not None]
+        neighbors = (
+            Todo.objects.filter(category_id=todo.category_id)
+            .exclude(pk=todo.pk)
+            .only("id", "rank")
+            .in_bulk(ids)
+        )
+        if len(neighbors) < len(ids):
+            return HttpResponseBadRequest("同じカテゴリの Todo を指定してください。")
+        after = neighbors.get(data["after"])
+        before = neighbors.get(data["before"])
+        if data["direction"] == "up":
+            before = ranking.neighbor(todo, previous=True)
+        elif data["direction"] == "down":
+            after = ranking.neighbor(todo, previous=False)
+        if after is not None or before is not None:
+            ranking.move(todo, after=after, before=before)
+        url = reverse("todo_list", kwargs={"category_id": todo.category_id})
+        return redirect(f"{url}?order=manual")
+
+
 class TodoDeleteView(LoginRequiredMixin, DeleteView):
     model = Todo
     pk_url_kwarg = "todo_id"
@@ -166,22 +488,25 @@ class TodoDeleteView(LoginRequiredMixin, DeleteView):
         return context
 
 
-class CalendarView(TemplateView):
+class CalendarMixin(DailyMixin):
+    """カレンダーの月・日付まわりの計算とクエリの組み立て (同期版/非同期版で共通)
+
+    「今日」の強調表示と既定の表示月は日付で変わる。
+    """
+
     template_name = "main/calendar.html"
+    weeks_shown = 6
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
+    def get_calendar_context(self):
+        """DB を使わない部分のコンテキスト。calendar_weeks は日付のリストのまま
 
+        年・月・日付が不正なら BadRequest (400) にする。
+        """
+        form = CalendarForm(self.request.GET)
+        if not form.is_valid():
+            raise BadRequest(form.errors.as_text())
         today = timezone.localdate()
-        year = int(self.request.GET.get("year", today.year))
-        month = int(self.request.GET.get("month", today.month))
-        selected_day = self.request.GET.get("day")
-
-        calendar_weeks = self.get_month_calendar(year, month)
-        context["calendar_weeks"] = calendar_weeks
-        context["year"] = year
-        context["month"] = month
-        context["today"] = today
+        year, month = form.cleaned_data["year"], form.cleaned_data["month"]
 
         if month == 1:
             prev_year, prev_month = year - 1, 12
@@ -193,51 +518,293 @@ class CalendarView(TemplateView):
         else:
             next_year, next_month = year, month + 1
 
-        context["prev_year"] = prev_year
-        context["prev_month"] = prev_month
-        context["next_year"] = next_year
-        context["next_month"] = next_month
+        return {
+            "calendar_weeks": self.get_month_calendar(year, month),
+            "year": year,
+            "month": month,
+            "today": today,
+            "prev_year": prev_year,
+            "prev_month": prev_month,
+            "next_year": next_year,
+            "next_month": next_month,
+            "selected_day": form.cleaned_data["day"],
+        }
 
-        todos = Todo.objects.none()
-        if selected_day:
-            day_date = datetime.strptime(selected_day, "%Y-%m-%d").date()
-            todos = Todo.objects.filter(
-                deadline_time__date=day_date, category__user=self.request.user
+    def get_month_calendar(self, year, month):
+        cal = calendar.Calendar(firstweekday=6)  # 日曜始まり
+        weeks = cal.monthdatescalendar(year, month)
+        # 月によって 4〜6 週になるので常に 6 週表示にそろえる
+        while len(weeks) < self.weeks_shown:
+            start = weeks[-1][-1] + timedelta(days=1)
+            weeks.append([start + timedelta(days=i) for i in range(7)])
+        return weeks
+
+    def get_todos_between(self, first_day, last_day):
+        start, end = local_day_range(first_day, last_day)
+        return Todo.objects.filter(
+            category__user=self.request.user,
+            deadline_time__gte=start,
+            deadline_time__lt=end,
+        )
+
+    def get_day_counts_queryset(self, weeks):
+        """日ごとの (件数, 未完了件数) を 1 回の集計クエリで取る queryset"""
+        return (
+            self.get_todos_between(weeks[0][0], weeks[-1][-1])
+            .annotate(
+                day=TruncDate("deadline_time", tzinfo=timezone.get_current_timezone())
+            )
+            .values("day")
+            .annotate(
+                total=Count("id"),
+                unfinished=Count("id", filter=Q(is_finished=False)),
             )
-        context["selected_day"] = selected_day
+            .order_by()
+        )
+
+    def get_selected_day_queryset(self, selected_day):
+        return (
+            self.get_todos_between(selected_day, selected_day)
+            .only("id", "category_id", "title", "deadline_time")
+            .order_by("deadline_time", "id")
+        )
+
+    def annotate_weeks(self, weeks, day_counts):
+        counts = {row["day"]: (row["total"], row["unfinished"]) for row in day_counts}
+        return [
+            [
+                {
+                    "date": day,
+                    "total": counts.get(day, (0, 0))[0],
+                    "unfinished": counts.get(day, (0, 0))[1],
+                }
+                for day in week
+            ]
+            for week in weeks
+        ]
+
+
+class CalendarView(
+    LoginRequiredMixin,
+    CalendarMixin,
+    ConditionalGetMixin,
+    ReplicaReadMixin,
+    TemplateView,
+):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.get_calendar_context())
+
+        weeks = context["calendar_weeks"]
+        context["calendar_weeks"] = self.annotate_weeks(
+            weeks, self.get_day_counts_queryset(weeks)
+        )
+
+        todos = Todo.objects.none()
+        if context["selected_day"]:
+            todos = self.get_selected_day_queryset(context["selected_day"])
         context["todos"] = todos
 
         return context
 
-    def get_month_calendar(self, year, month):
-        cal = calendar.Calendar(firstweekday=6)  # 日曜始まり
-        return cal.monthdatescalendar(year, month)
-
 
-class MypageView(LoginRequiredMixin, TemplateView):
+class MypageView(
+    LoginRequiredMixin, ConditionalGetMixin, ReplicaReadMixin, TemplateView
+):
     template_name = "main/mypage.html"
 
+
+class MypageChartView(LoginRequiredMixin, ConditionalGetMixin, ReplicaReadMixin, View):
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(get_category_hours_chart(request.user))
+
+
+class MypageTimeChartView(
+    LoginRequiredMixin, DailyMixin, ConditionalGetMixin, ReplicaReadMixin, View
+):
+    """?start=&end= の期間の日別 (長い期間は週別) の作業時間グラフ
+
+    期間を省略すると今日までの 30 日なので、検証子も日付で変える。
+    """
+
+    def get(self, request, *args, **kwargs):
+        form = TimeRangeForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        return JsonResponse(
+            get_period_hours_chart(
+                request.user, form.cleaned_data["start"], form.cleaned_data["end"]
+            )
+        )
+
+
+class TodoExportView(LoginRequiredMixin, ConditionalGetMixin, View):
+    def get(self, request, *args, **kwargs):
+        format = request.GET.get("format", transfer.FORMAT_CSV)
+        if format not in transfer.CONTENT_TYPES:
+            return HttpResponseBadRequest("unknown format")
+        response = StreamingHttpResponse(
+            transfer.iter_export(request.user, format),
+            content_type=transfer.CONTENT_TYPES[format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="todos.{format}"'
+        return response
+
+
+class TodoImportView(LoginRequiredMixin, FormView):
+    form_class = TodoImportForm
+    template_name = "main/todo_import.html"
+
+    def form_valid(self, form):
+        rows = transfer.read_rows(
+            transfer.text_stream(form.cleaned_data["file"]),
+            form.cleaned_data["format"],
+        )
+        result = transfer.import_rows(self.request.user, rows)
+        return self.render_to_response(
+            self.get_context_data(form=self.form_class(), result=result)
+        )
+
+
+class TodoSearchView(LoginRequiredMixin, ConditionalGetMixin, TemplateView):
+    template_name = "main/todo_search.html"
+    page_size = 20
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user = self.request.user
+        form = TodoSearchForm(self.request.GET)
+        context["form"] = form
+        if not form.is_valid() or not form.cleaned_data["q"].strip():
+            return context
+        query = form.cleaned_data["q"]
+        page = form.cleaned_data["page"] or 1
+        result = search.search_todos(
+            self.request.user, query, page=page, page_size=self.page_size
+        )
+        context.update(
+            {
+                "query": query,
+                "todo_list": result.todos,
+                "prev_page": page - 1 if page > 1 else None,
+                "next_page": page + 1 if result.has_next else None,
+            }
+        )
+        return context
+
+
+class CalendarFeedSettingsView(LoginRequiredMixin, TemplateView):
+    """ICS フィードの URL の表示 (GET) とトークンの再発行 (POST)"""
 
-        categories = Category.objects.filter(user=user).annotate(
-            total_hours=Sum("todos__hour_spent")
+    template_name = "main/calendar_feed.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        feed_token, _ = CalendarFeedToken.objects.get_or_create(
+            user=self.request.user
         )
-        category_names = [c.name for c in categories]
-        total_hours = [c.total_hours for c in categories]
+        context["feed_url"] = self.request.build_absolute_uri(
+            reverse("calendar_feed", kwargs={"token": feed_token.token})
+        )
+        return context
 
-        bar = graph_objs.Bar(x=category_names, y=total_hours)
-        layout = graph_objs.Layout(
-            title="カテゴリごとの経過時間(h)",
-            xaxis=dict(title="カテゴリ"),
-            yaxis=dict(
-                title="経過時間(h)",
-                rangemode="tozero",
-            ),
+    def post(self, request, *args, **kwargs):
+        CalendarFeedToken.objects.update_or_create(
+            user=request.user, defaults={"token": new_feed_token()}
         )
-        fig = graph_objs.Figure(data=[bar], layout=layout)
-        graph_div = offline.plot(fig, auto_open=False, output_type="div")
+        return redirect("calendar_feed_settings")
 
-        context["graph"] = graph_div
-        return context
+
+class CalendarFeedView(View):
+    """トークンで認証する ICS フィード。?start=&end= (日付) で期間を絞れる"""
+
+    def get(self, request, token, *args, **kwargs):
+        user_id = (
+            CalendarFeedToken.objects.filter(token=token)
+            .values_list("user_id", flat=True)
+            .first()
+        )
+        if user_id is None:
+            raise Http404
+        form = CalendarFeedForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest("invalid range")
+
+        # データが変わっていなければ Todo を読まずに 304 を返す
+        version = user_cache.get_version(user_id)
+        etag = etag_for(user_id, version, request.get_full_path(), timezone.localdate())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            start, end = local_day_range(
+                form.cleaned_data["start"], form.cleaned_data["end"]
+            )
+
+            def url_for(category_id, todo_id):
+                return request.build_absolute_uri(
+                    reverse(
+                        "todo_detail",
+                        kwargs={"category_id": category_id, "todo_id": todo_id},
+                    )
+                )
+
+            response = StreamingHttpResponse(
+                ics.iter_calendar(
+                    ics.feed_rows(user_id, start, end),
+                    name="BeEn_todo",
+                    host=request.get_host(),
+                    url_for=url_for,
+                ),
+                content_type=ics.CONTENT_TYPE,
+            )
+        return set_validators(response, etag)
+
+
+class CategorySummaryView(
+    LoginRequiredMixin, DailyMixin, ConditionalGetMixin, ReplicaReadMixin, View
+):
+    """ホーム画面と同じカテゴリごとの件数・所要時間・次の締め切りを JSON で返す"""
+
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({"categories": get_category_summaries(request.user)})
+
+
+class SyncChangesView(LoginRequiredMixin, ConditionalGetMixin, View):
+    """差分同期: ?cursor= より後に変わったカテゴリ・Todo と削除を JSON で返す"""
+
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        form = SyncPullForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        try:
+            changes = sync.pull_changes(
+                request.user,
+                form.cleaned_data["cursor"],
+                form.cleaned_data["limit"] or sync.DEFAULT_LIMIT,
+            )
+        except InvalidCursor:
+            return HttpResponseBadRequest("invalid cursor")
+        except sync.CursorExpired:
+            # 削除の記録が残っていない。クライアントはカーソルなしで取り直す
+            return JsonResponse({"error": "cursor expired"}, status=410)
+        return JsonResponse(changes)
+
+
+class SyncPushView(LoginRequiredMixin, View):
+    """差分同期: クライアントの作成・更新・削除を JSON でまとめて受け取る"""
+
+    raise_exception = True
+
+    def post(self, request, *args, **kwargs):
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return HttpResponseBadRequest("invalid JSON")
+        if not isinstance(payload, dict):
+            return HttpResponseBadRequest("invalid JSON")
+        try:
+            return JsonResponse(sync.push_changes(request.user, payload))
+        except sync.InvalidPush as e:
+            return HttpResponseBadRequest(str(e))